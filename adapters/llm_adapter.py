@@ -24,49 +24,209 @@
 """
 import os
 from dotenv import load_dotenv
-from openai import OpenAI, AsyncOpenAI, OpenAIError
+from openai import OpenAI, AsyncOpenAI, OpenAIError, APIConnectionError, APITimeoutError
 import asyncio
+import httpx
 import typing
-from core.logging_config import logger
+from core.logging_config import logger, model_meta_for_log
 import uuid
 import time
 import core.statistics
 from core.statistics import model_hit_counter, model_cost_counter
+from core.response_cache import ResponseCache, make_request_key
+from core.single_flight import SingleFlight
+from core.admission import AdmissionController, AdmissionRejected
+from core.circuit_breaker import CircuitBreakerRegistry, CircuitOpen
+from core.concurrency_limit import ConcurrencyLimitRegistry, IGNORE, OVERLOAD, SUCCESS
+from core.model_stats import ModelStats
+from core.model_registry import ModelRegistry
+from core.routing_engine import RoutingEngine
+from core.bandit_router import BanditRouter, BANDIT_POLICIES
+from core.deadline import DEADLINE_MIN_REMAINING_MS, DeadlineExceeded, check_deadline, remaining_sec
+from core.retry_policy import CONNECTION, RATE_LIMIT, RETRY, SERVER_ERROR, TIMEOUT, RetryPolicy, classify_error
+from core.http_pool import UpstreamClientPool
+from core.stub_llm import STUB_BASE_URL, STUB_URL_SCHEME, AsyncStubTransport, StubLLM, StubTransport
+from core import tracing
+from core.token_estimator import PromptTooLong, TRUNCATE_POLICIES, estimate_messages_tokens, estimate_tokens, truncate_text
 import yaml
+import json
+import math
 import contextvars
 
 load_dotenv()
 
 ENABLE_SMART_ROUTING = True  # 智能分流开关，关闭则始终用当前模型
 
+# 响应缓存（精确匹配：模型 + 消息 + 采样参数），可通过环境变量调整
+ENABLE_RESPONSE_CACHE = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", "3600"))
+STREAM_REPLAY_CHUNK_SIZE = 16  # 缓存命中时流式回放的分片字符数
+ENABLE_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT_ENABLED", "1") == "1"  # 合并并发的相同请求
+
+# 对冲请求（降低长尾延迟）：默认关闭，可通过 llm_context 的 hedge/hedge_delay_ms/race_n 按请求开启
+ENABLE_HEDGING = os.getenv("LLM_HEDGING_ENABLED", "0") == "1"
+HEDGE_DEFAULT_DELAY_MS = 2000  # 模型还没有延迟统计时的对冲阈值
+HEDGE_MIN_DELAY_MS = 50
+RACE_N_BY_BIZ_LEVEL = {"premium": int(os.getenv("LLM_RACE_N_PREMIUM", "1"))}  # 按业务等级同时竞速的候选数
+
+# 准入控制：按模型 max_concurrency 限制同时进行的上游调用，超出部分排队等待
+ENABLE_ADMISSION_CONTROL = os.getenv("LLM_ADMISSION_ENABLED", "1") == "1"
+ADMISSION_DEFAULT_MAX_QUEUE = 100
+ADMISSION_DEFAULT_MAX_WAIT_MS = 30000
+
+# 自适应并发上限（需开启准入控制）：aimd / gradient / off；初始值取 meta.max_concurrency（或 qps），
+# 在 [meta.min_concurrency, meta.max_concurrency_limit] 内根据延迟与 429/5xx 自动调整
+ADAPTIVE_CONCURRENCY = os.getenv("LLM_ADAPTIVE_CONCURRENCY", "aimd")
+ADAPTIVE_MAX_MULTIPLIER = int(os.getenv("LLM_ADAPTIVE_MAX_MULTIPLIER", "4"))  # 未配置上界时为初始值的倍数
+ADAPTIVE_LATENCY_TIMEOUT_MS = float(os.getenv("LLM_ADAPTIVE_LATENCY_TIMEOUT_MS", "0"))  # aimd：超过该延迟视为过载，0 关闭
+
+# 熔断：模型连续失败或近期失败率过高时暂停路由，冷却后放行单个探测请求；可通过 meta 按模型覆盖
+ENABLE_CIRCUIT_BREAKER = os.getenv("LLM_CIRCUIT_BREAKER_ENABLED", "1") == "1"
+CIRCUIT_FAILURE_THRESHOLD = 5        # 连续失败次数
+CIRCUIT_FAILURE_RATE_THRESHOLD = 0.5  # 最近 CIRCUIT_WINDOW 次调用的失败率
+CIRCUIT_WINDOW = 20
+CIRCUIT_MIN_CALLS = 10
+CIRCUIT_COOLDOWN_SEC = float(os.getenv("LLM_CIRCUIT_COOLDOWN_SEC", "30"))
+# 计入熔断的错误类别（上游过载/故障）；400/401、内容审核、输入超长等请求本身的问题不计入，避免少数坏请求熔断整个模型
+CIRCUIT_FAILURE_CLASSES = (RATE_LIMIT, TIMEOUT, SERVER_ERROR, CONNECTION)
+
+# 延迟分位数：按滚动窗口统计上游/排队/端到端耗时，路由评分使用上游延迟的尾部分位数
+LATENCY_WINDOW_SEC = float(os.getenv("LLM_LATENCY_WINDOW_SEC", "300"))
+
+# 上游 HTTP 连接池：同一 (url, key) 的模型共享客户端，池大小按 max_concurrency 之和，启动时并行预热连接
+ENABLE_SHARED_HTTP_POOL = os.getenv("LLM_HTTP_POOL_ENABLED", "1") == "1"
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SEC", "30"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "0"))  # 0 表示与连接池大小相同
+HTTP_MIN_POOL_SIZE = int(os.getenv("LLM_HTTP_MIN_POOL_SIZE", "4"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT_SEC", "10"))
+ENABLE_HTTP2 = os.getenv("LLM_HTTP2_ENABLED", "0") == "1"
+HTTP_WARMUP_CONNECTIONS = int(os.getenv("LLM_HTTP_WARMUP_CONNECTIONS", "1"))  # 每个连接池预建的连接数，0 关闭预热
+HTTP_WARMUP_TIMEOUT_SEC = float(os.getenv("LLM_HTTP_WARMUP_TIMEOUT_SEC", "5"))
+
+# 批量生成（async_generate_many / /llm_invoke_batch）：单条失败的重试次数
+BATCH_MAX_RETRIES = int(os.getenv("LLM_BATCH_MAX_RETRIES", "2"))
+BATCH_POLL_INTERVAL_SEC = 0.5
+
+# 输入长度预检：发往上游前估算 token 数，排除 meta.max_input_length 放不下的模型，按 truncate 策略截断
+ENABLE_PROMPT_LENGTH_CHECK = os.getenv("LLM_PROMPT_LENGTH_CHECK_ENABLED", "1") == "1"
+
+# 路由策略：score 为固定加权打分；thompson / ucb 为按 (tags, biz_level) 分桶的老虎机，兼顾探索与利用，状态持久化到文件
+ROUTING_POLICY = os.getenv("LLM_ROUTING_POLICY", "score")
+BANDIT_STATE_PATH = os.getenv("LLM_BANDIT_STATE_PATH", "bandit_state.json")
+BANDIT_DISCOUNT = float(os.getenv("LLM_BANDIT_DISCOUNT", "0.995"))
+BANDIT_LATENCY_REF_MS = float(os.getenv("LLM_BANDIT_LATENCY_REF_MS", "2000"))  # 该延迟的延迟得分为 0.5
+BANDIT_COST_REF = float(os.getenv("LLM_BANDIT_COST_REF", "0.05"))              # 该单位成本的成本得分为 0.5
+BANDIT_WEIGHTS = (  # 奖励中延迟、成本、效果（meta.effect_score）的权重
+    float(os.getenv("LLM_BANDIT_LATENCY_WEIGHT", "0.4")),
+    float(os.getenv("LLM_BANDIT_COST_WEIGHT", "0.3")),
+    float(os.getenv("LLM_BANDIT_EFFECT_WEIGHT", "0.3")),
+)
+# 状态由后台线程写盘：每隔 LLM_BANDIT_SAVE_INTERVAL_SEC 秒，或累计 LLM_BANDIT_SAVE_EVERY 次更新时提前写
+BANDIT_SAVE_INTERVAL_SEC = float(os.getenv("LLM_BANDIT_SAVE_INTERVAL_SEC", "30"))
+BANDIT_SAVE_EVERY = int(os.getenv("LLM_BANDIT_SAVE_EVERY", "1000"))
+
+# 重试策略：按错误类别决定同模型退避重试 / 换模型 / 直接失败，配置见 retry_policy.yaml（可选）。
+# 开启时 openai SDK 自身的重试关闭（max_retries=0），避免两层重试叠加放大上游压力
+ENABLE_RETRY_POLICY = os.getenv("LLM_RETRY_POLICY_ENABLED", "1") == "1"
+RETRY_POLICY_PATH = os.getenv("LLM_RETRY_POLICY_PATH", "retry_policy.yaml")
+UPSTREAM_SDK_MAX_RETRIES = 0 if ENABLE_RETRY_POLICY else 2  # 2 为 openai SDK 默认值
+
+# 离线压测：url 以 stub:// 开头的模型（或 LLM_STUB_ALL=1 时的全部模型）不发网络请求，
+# 由进程内的 StubLLM 按 meta.stub 配置模拟延迟、流式速度、错误与限流
+STUB_ALL_MODELS = os.getenv("LLM_STUB_ALL", "0") == "1"
+
+# 单次上游调用的超时上限；请求带截止时间（llm_context 的 deadline）时取剩余时间与该值中较小的
+UPSTREAM_TIMEOUT_SEC = float(os.getenv("LLM_UPSTREAM_TIMEOUT_SEC", "600"))
+
+DEFAULT_MODEL_META = {
+    "qps": 2,
+    "cost": 0.0,
+    "latency": 1000,
+    "error_rate": 0.0,
+    "max_input_length": 0,  # 输入 token 上限，0 表示不限制
+    "effect_score": 5.0,
+    "health": "unknown",
+    "supported_tasks": [],
+    "languages": [],
+    "description": "",
+    "vendor": "",
+    "tags": [],
+}
+
+# 模型条目中的运行时字段：不属于配置，热重载比较差异时忽略
+RUNTIME_MODEL_FIELDS = ("sync_client", "async_client")
+
 llm_context: contextvars.ContextVar = contextvars.ContextVar('llm_context', default={})
 
 class MultiLLM:
     def __init__(self):
-        print("[MultiLLM.__init__] Starting initialization...", flush=True)
-        # 从 YAML 加载模型配置
-        with open('llm_models.yaml', 'r', encoding='utf-8') as f:
+        logger.info("[MultiLLM.__init__] Starting initialization...")
+        # 从 YAML 加载模型配置，写入只读的注册表快照
+        self.registry = ModelRegistry(self._load_models())
+        self._config_fingerprints = {m['name']: self._config_fingerprint(m) for m in self.models}  # 热重载比较差异用
+        self.current = 0
+        logger.info("[MultiLLM.__init__] Initialization complete. Total usable model configs stored: %s", len(self.models))
+
+        self.latency_alpha = 0.3  # 滑动平均系数
+        self.latency_window_sec = LATENCY_WINDOW_SEC  # 延迟分位数统计窗口
+        self.error_window = 20    # 错误率统计窗口
+        self.model_stats = {}  # model_name -> ModelStats
+        self.response_cache = ResponseCache(
+            max_bytes=RESPONSE_CACHE_MAX_BYTES,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_sec=RESPONSE_CACHE_TTL_SEC,
+        ) if ENABLE_RESPONSE_CACHE else None
+        self.single_flight = SingleFlight() if ENABLE_SINGLE_FLIGHT else None
+        self.admission = AdmissionController() if ENABLE_ADMISSION_CONTROL else None
+        self.concurrency_limits = ConcurrencyLimitRegistry(
+            ADAPTIVE_CONCURRENCY, latency_timeout_ms=ADAPTIVE_LATENCY_TIMEOUT_MS,
+        ) if self.admission is not None and ADAPTIVE_CONCURRENCY != "off" else None
+        self.circuit_breakers = CircuitBreakerRegistry() if ENABLE_CIRCUIT_BREAKER else None
+        self.retry_policy = self._load_retry_policy() if ENABLE_RETRY_POLICY else None
+        self.stubs = {}  # model_name -> StubLLM
+        self.client_pool = UpstreamClientPool(
+            keepalive_expiry_sec=HTTP_KEEPALIVE_EXPIRY_SEC,
+            max_keepalive=HTTP_MAX_KEEPALIVE,
+            http2=ENABLE_HTTP2,
+            connect_timeout_sec=HTTP_CONNECT_TIMEOUT_SEC,
+            min_size=HTTP_MIN_POOL_SIZE,
+            max_retries=UPSTREAM_SDK_MAX_RETRIES,
+        ) if ENABLE_SHARED_HTTP_POOL else None
+        for m in self.models:
+            self._init_stats(m)
+            self._configure_admission(m)
+            self._configure_concurrency_limit(m)
+            self._configure_circuit_breaker(m)
+            self._configure_stub(m)
+            self._configure_client_pool(m)
+        self.bandit = BanditRouter(
+            ROUTING_POLICY,
+            state_path=BANDIT_STATE_PATH,
+            discount=BANDIT_DISCOUNT,
+            latency_ref_ms=BANDIT_LATENCY_REF_MS,
+            cost_ref=BANDIT_COST_REF,
+            weights=BANDIT_WEIGHTS,
+            save_interval_sec=BANDIT_SAVE_INTERVAL_SEC,
+            save_every=BANDIT_SAVE_EVERY,
+        ) if ROUTING_POLICY in BANDIT_POLICIES else None
+        # 统一路由：注册表或健康状态变化时重新编译路由表
+        self.routing = RoutingEngine(self.registry, self._stats, self._circuit_breaker, self.bandit)
+
+    @property
+    def models(self):
+        """当前注册表快照中的模型（只读 tuple，按配置顺序）"""
+        return self.registry.snapshot.models
+
+    def _load_models(self, path='llm_models.yaml'):
+        with open(path, 'r', encoding='utf-8') as f:
             config = yaml.safe_load(f)
-        all_configs = config['models']
-        self.models = []
-        DEFAULT_META = {
-            "qps": 2,
-            "cost": 0.0,
-            "latency": 1000,
-            "error_rate": 0.0,
-            "max_input_length": 2048,
-            "effect_score": 5.0,
-            "health": "unknown",
-            "supported_tasks": [],
-            "languages": [],
-            "description": "",
-            "vendor": "",
-            "tags": [],
-        }
-        for m in all_configs:
+        models = []
+        for m in config['models']:
             meta = m.get('meta', {})
             # 合并默认值
-            meta = {**DEFAULT_META, **meta}
+            meta = {**DEFAULT_MODEL_META, **meta}
             m['meta'] = meta
             # 兼容老字段，优先meta
             m['tags'] = meta.get('tags', m.get('tags', []))
@@ -76,30 +236,77 @@ class MultiLLM:
             m['version'] = m.get('version', '')
             m['sync_client'] = None
             m['async_client'] = None
-            self.models.append(m)
-        self.current = 0
-        print(f"[MultiLLM.__init__] Initialization complete. Total usable model configs stored: {len(self.models)}", flush=True)
+            models.append(m)
+        return models
 
-        self.llm_status = {}
-        for m in self.models:
-            self.llm_status[m['name']] = {
-                'current_concurrency': 0,
-                'max_concurrency': m.get('qps', 2) or 2,  # 默认2，便于测试分流
-                'healthy': m.get('status', '可用') == '可用',
-                'latency': 0.0,      # ms，滑动平均
-                'error_rate': 0.0,   # 近N次错误率
-                'cost': m.get('cost', 0.0) or 0.0,  # 单位成本
-                'call_count': 0,
-                'error_count': 0
-            }
-        self.latency_alpha = 0.3  # 滑动平均系数
-        self.error_window = 20    # 错误率统计窗口
-        self._error_history = {m['name']: [] for m in self.models}
+    @staticmethod
+    def _config_fingerprint(model_info) -> str:
+        """模型配置的指纹（不含客户端等运行时字段），用于热重载时判断条目是否变化"""
+        config = {k: v for k, v in model_info.items() if k not in RUNTIME_MODEL_FIELDS}
+        return json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def _carry_runtime_state(old, new):
+        """配置变化的模型沿用旧条目的运行时状态：url/key 未变时复用客户端，保留健康检查结果"""
+        if old.get('url') == new.get('url') and old.get('key') == new.get('key'):
+            new['sync_client'] = old.get('sync_client')
+            new['async_client'] = old.get('async_client')
+        if 'health' in old:
+            new['health'] = old['health']
+        if old.get('meta', {}).get('status') == new['meta'].get('status'):
+            new['status'] = old.get('status', new['status'])  # 用户没改状态时保留健康检查写入的上/下线
+
+    def reload(self, path='llm_models.yaml'):
+        """
+        增量热重载：与当前注册表逐个比较配置，只重建变化的部分，再原子替换快照。
+        - 配置未变的模型直接沿用旧条目（客户端、健康状态不变）
+        - 配置变化的模型保留统计数据，url/key 未变时复用客户端
+        - 已删除的模型清理对应状态；进行中的请求持有旧条目，照常完成
+        """
+        models = self._load_models(path)
+        current = self.registry.snapshot
+        fingerprints = {}
+        merged, added, updated = [], [], []
+        # 先为新增/变化的模型准备统计与熔断器，再替换快照，路由表编译时即可绑定
+        for m in models:
+            name = m['name']
+            fingerprints[name] = self._config_fingerprint(m)
+            old = current.get(name)
+            if old is not None and self._config_fingerprints.get(name) == fingerprints[name]:
+                merged.append(old)
+                continue
+            if old is None:
+                added.append(name)
+            else:
+                updated.append(name)
+                self._carry_runtime_state(old, m)
+            if name in self.model_stats:
+                self._refresh_stats(m)
+            else:
+                self._init_stats(m)
+            self._configure_admission(m)
+            self._configure_concurrency_limit(m)
+            self._configure_circuit_breaker(m)
+            self._configure_stub(m)
+            self._configure_client_pool(m)
+            merged.append(m)
+        removed = [name for name in current.by_name if name not in fingerprints]
+        self._config_fingerprints = fingerprints
+        if not (added or updated or removed) and [m['name'] for m in merged] == [m['name'] for m in current.models]:
+            logger.info("[MultiLLM.reload] No changes, registry version %s", current.version)
+            return current
+        snapshot = self.registry.replace(merged)
+        for name in [n for n in self.model_stats if n not in snapshot.by_name]:
+            self._drop_runtime_state(name)
+        if self.current >= len(snapshot.models):
+            self.current = max(0, len(snapshot.models) - 1)
+        logger.info("[MultiLLM.reload] Registry version %s: %s models, added=%s, updated=%s, removed=%s", snapshot.version, len(snapshot.models), added, updated, removed)
+        return snapshot
 
     def _next(self):
         # 切换到下一个模型，如果到达末尾则回到第一个
         self.current = (self.current + 1) % len(self.models)
-        print(f"Switched to next model candidate: {self.models[self.current]['name']} (Index: {self.current} in usable list)", flush=True)
+        logger.info("Switched to next model candidate: %s (Index: %s in usable list)", self.models[self.current]['name'], self.current)
 
     def _create_sync_client(self, model_config: dict) -> OpenAI:
         """Creates and returns a synchronous OpenAI client for the given configuration."""
@@ -107,7 +314,13 @@ class MultiLLM:
         key = model_config["key"]
         name = model_config["name"]
         # print(f"[MultiLLM._create_sync_client] Attempting to create sync client for model: {name}", flush=True)
-        client = OpenAI(base_url=url, api_key=key)
+        stub = self.stubs.get(name)
+        if stub is not None:
+            return OpenAI(base_url=STUB_BASE_URL, api_key=key or "stub", max_retries=UPSTREAM_SDK_MAX_RETRIES,
+                          http_client=httpx.Client(transport=StubTransport(stub)))
+        if self.client_pool is not None:
+            return self.client_pool.sync_client(url, key)
+        client = OpenAI(base_url=url, api_key=key, max_retries=UPSTREAM_SDK_MAX_RETRIES)
         # print(f"[MultiLLM._create_sync_client] Sync client created successfully for model: {name}", flush=True)
         return client
 
@@ -124,10 +337,10 @@ class MultiLLM:
             try:
                 # Pass model_info to create method
                 model_info["sync_client"] = self._create_sync_client(model_info)
-                print(f"[MultiLLM._get_sync_client] Sync client created successfully for model: {model_name}", flush=True)
+                logger.debug("[MultiLLM._get_sync_client] Sync client created successfully for model: %s", model_name)
             except Exception as e:
                  # If client creation failed, raise the error (switching is handled in generate)
-                print(f"[MultiLLM._get_sync_client] Failed to create sync client for {model_name}: {e}", flush=True)
+                logger.warning("[MultiLLM._get_sync_client] Failed to create sync client for %s: %s", model_name, e)
                 raise e
 
         # Return the client and the model name
@@ -139,7 +352,13 @@ class MultiLLM:
          key = model_config["key"]
          name = model_config["name"]
          # print(f"[MultiLLM._create_async_client] Attempting to create async client for model: {name}", flush=True)
-         client = AsyncOpenAI(base_url=url, api_key=key)
+         stub = self.stubs.get(name)
+         if stub is not None:
+             return AsyncOpenAI(base_url=STUB_BASE_URL, api_key=key or "stub", max_retries=UPSTREAM_SDK_MAX_RETRIES,
+                                http_client=httpx.AsyncClient(transport=AsyncStubTransport(stub)))
+         if self.client_pool is not None:
+             return self.client_pool.async_client(url, key)
+         client = AsyncOpenAI(base_url=url, api_key=key, max_retries=UPSTREAM_SDK_MAX_RETRIES)
          # print(f"[MultiLLM._create_async_client] Async client created successfully for model: {name}", flush=True)
          return client
 
@@ -156,59 +375,442 @@ class MultiLLM:
             try:
                  # No await here, _create_async_client is not async
                  model_info["async_client"] = self._create_async_client(model_info)
-                 print(f"[MultiLLM._get_async_client] Async client created successfully for model: {model_name}", flush=True)
+                 logger.debug("[MultiLLM._get_async_client] Async client created successfully for model: %s", model_name)
             except Exception as e:
                  # If client creation failed, raise the error (switching is handled in async_generate)
-                print(f"[MultiLLM._get_async_client] Failed to create async client for {model_name}: {e}", flush=True)
+                logger.warning("[MultiLLM._get_async_client] Failed to create async client for %s: %s", model_name, e)
                 raise e
 
          # Return the client and the model name
          return model_info["async_client"], model_name
 
-    def _select_llm_candidates(self, model_name=None, biz_level=None, prefer_cost=None, tags=None):
+    def _build_messages(self, prompt, temperature=None, top_p=None, max_tokens=None, stop=None):
+        """构造 chat messages；同步与异步路径共用，保证相同请求得到相同的消息（及缓存键）"""
+        messages = []
+        if temperature is not None or top_p is not None or max_tokens is not None or stop is not None:
+            messages.append({"role": "system", "content": f"You are a helpful assistant, your temperature is {temperature}, top_p is {top_p}, max_tokens is {max_tokens}, and stop is {stop}."})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def _request_key(self, model_name, messages, temperature=None, top_p=None, max_tokens=None, stop=None, use_cache=None):
+        """
+        返回本次请求的规范化键，用于响应缓存与并发合并（single-flight）。
+        返回 None 表示需要一次独立的上游调用：请求显式 use_cache=False，或 temperature > 0 的采样请求
+        （结果本身不确定，每次应重新采样；显式 use_cache=True 时仍走缓存）。流式与非流式规则相同。
+        """
+        if use_cache is None:
+            use_cache = llm_context.get({}).get('use_cache')
+        if use_cache is False or (self.response_cache is None and self.single_flight is None):
+            return None
+        if use_cache is not True and temperature is not None and temperature > 0:
+            return None
+        return make_request_key(model_name, messages, {
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "stop": stop,
+        })
+
+    def _cached_result(self, request_key, model_name, prompt, stream=False):
+        """查询缓存，命中时返回结果副本（不产生上游调用，成本记为 0）。没有 usage 的流式结果只供流式请求回放。"""
+        if request_key is None or self.response_cache is None:
+            return None
+        cached = self.response_cache.get(request_key)
+        if cached is None or (cached.get("stream_only") and not stream):
+            return None
+        logger.info({
+            "event": "llm_cache_hit",
+            "model": model_name,
+            "prompt_len": len(prompt),
+            "token_usage": cached.get("token_usage"),
+        })
+        return {**cached, "cost": 0.0, "cached": True}
+
+    def _stream_result(self, model_info, used_model_name, parts, token_usage):
+        """完整结束的流的结果（写入缓存的格式与非流式一致）；上游没有返回 usage 时标记为 stream_only"""
+        from core.statistics import record_model_cost
+        total_tokens = getattr(token_usage, 'total_tokens', None) if token_usage else None
+        cost_per_token = model_info.get('cost', 0.0)
+        cost = (total_tokens or 0) * cost_per_token if cost_per_token else None
+        record_model_cost(model_info['name'], cost or 0.0)
+        result = {"result": "".join(parts), "used_model": used_model_name, "token_usage": total_tokens, "cost": cost}
+        if total_tokens is None:
+            result["stream_only"] = True
+        return result
+
+    def _init_stats(self, model_info):
+        self.model_stats[model_info['name']] = ModelStats(
+            max_concurrency=model_info['meta'].get('max_concurrency') or model_info.get('qps', 2) or 2,  # 默认2，便于测试分流
+            healthy=model_info.get('status', '可用') == '可用',
+            cost=model_info.get('cost', 0.0) or 0.0,  # 单位成本
+            error_window=self.error_window,
+            latency_window_sec=self.latency_window_sec,
+            latency_alpha=self.latency_alpha,
+        )
+
+    def _refresh_stats(self, model_info):
+        stats = self._stats(model_info['name'])
+        stats.healthy = model_info.get('status', '可用') == '可用'
+        stats.cost = model_info.get('cost', 0.0) or 0.0
+        # 启用自适应并发时以限流器当前学到的上限为准，配置值只是它的初始值
+        limiter = self.concurrency_limits.get(model_info['name']) if self.concurrency_limits else None
+        if limiter is not None:
+            stats.max_concurrency = limiter.current
+        else:
+            stats.max_concurrency = model_info['meta'].get('max_concurrency') or model_info.get('qps', 2) or 2
+        self.routing.invalidate()
+
+    def update_model_health(self, model_name, meta):
+        """健康检查结果回写（health/status）：结果未变化时直接返回；变化时写时复制替换条目，并让路由表重新编译"""
+        current = self.registry.snapshot.get(model_name)
+        if current is None or all(current.get(k) == v for k, v in meta.items()):
+            return
+        # 不原地修改：持有旧快照的读者看到的条目保持不变
+        model = {**current, **meta}
+        self.registry.replace([model if m["name"] == model_name else m for m in self.registry.snapshot.models])
+        self._refresh_stats(model)
+
+    def _drop_runtime_state(self, model_name):
+        self.model_stats.pop(model_name, None)
+        if self.admission is not None:
+            self.admission.remove(model_name)
+        if self.concurrency_limits is not None:
+            self.concurrency_limits.remove(model_name)
+        if self.circuit_breakers is not None:
+            self.circuit_breakers.remove(model_name)
+        if self.client_pool is not None:
+            self.client_pool.unregister(model_name)
+        self.stubs.pop(model_name, None)
+        if self.bandit is not None:
+            self.bandit.remove_model(model_name)
+        self._config_fingerprints.pop(model_name, None)
+
+    def _stats(self, model_name):
+        stats = self.model_stats.get(model_name)
+        if stats is None:
+            stats = self.model_stats.setdefault(model_name, ModelStats(
+                error_window=self.error_window, latency_window_sec=self.latency_window_sec, latency_alpha=self.latency_alpha))
+        return stats
+
+    @property
+    def llm_status(self):
+        """各模型运行时统计的快照（/llm_status 返回的结构）"""
+        return {name: stats.snapshot() for name, stats in list(self.model_stats.items())}
+
+    def _admission_gate(self, model_name):
+        return self.admission.get(model_name) if self.admission else None
+
+    def _configure_admission(self, model_info):
+        if self.admission is None:
+            return
+        meta = model_info.get('meta', {})
+        max_concurrency = meta.get('max_concurrency') or model_info.get('qps') or 2
+        self.admission.configure(
+            model_info['name'],
+            max_concurrency,
+            max_queue=meta.get('max_queue', ADMISSION_DEFAULT_MAX_QUEUE),
+            max_wait_sec=meta.get('max_queue_wait_ms', ADMISSION_DEFAULT_MAX_WAIT_MS) / 1000,
+        )
+
+    def _configure_concurrency_limit(self, model_info):
+        if self.concurrency_limits is None:
+            return
+        meta = model_info.get('meta', {})
+        initial = meta.get('max_concurrency') or model_info.get('qps') or 2
+        self.concurrency_limits.configure(
+            model_info['name'],
+            initial,
+            min_limit=meta.get('min_concurrency') or 1,
+            max_limit=meta.get('max_concurrency_limit') or initial * ADAPTIVE_MAX_MULTIPLIER,
+            on_change=lambda limit, name=model_info['name']: self._apply_concurrency_limit(name, limit),
+        )
+
+    def _apply_concurrency_limit(self, model_name, limit):
+        """自适应上限变化：同步到准入控制与路由统计"""
+        gate = self._admission_gate(model_name)
+        if gate is not None:
+            gate.set_limit(limit)
+        stats = self.model_stats.get(model_name)
+        if stats is not None:
+            stats.set_max_concurrency(limit)
+
+    def _observe_concurrency(self, model_name, latency_ms, in_flight, error=None):
+        """上游调用结束时向自适应并发上限采样：429/5xx/超时/连接失败视为过载，其他错误忽略"""
+        limiter = self.concurrency_limits.get(model_name) if self.concurrency_limits else None
+        if limiter is None:
+            return
+        if error is None:
+            outcome = SUCCESS
+        else:
+            status = getattr(error, 'status_code', None)
+            overloaded = status == 429 or (status is not None and status >= 500) or isinstance(error, APIConnectionError)
+            outcome = OVERLOAD if overloaded else IGNORE
+        limiter.record(latency_ms, in_flight, outcome)
+
+    def _observe_route(self, model_info, latency_ms, success, route_bucket):
+        """上游调用结束时回报老虎机奖励；route_bucket 由做出路由决定的一方传入，指定模型的调用为 None，不计入"""
+        if self.bandit is None or route_bucket is None:
+            return
+        reward = self.bandit.reward(
+            success, latency_ms,
+            cost=model_info.get('cost', 0.0),
+            effect_score=model_info.get('meta', {}).get('effect_score', DEFAULT_MODEL_META['effect_score']),
+        )
+        self.bandit.record(route_bucket, model_info['name'], reward)
+
+    @staticmethod
+    def _breaker_outcome(error):
+        """失败调用在熔断器上的记录值：上游故障为 False，其余错误为 None（不计入）"""
+        return False if classify_error(error) in CIRCUIT_FAILURE_CLASSES else None
+
+    @staticmethod
+    def _deadline():
+        """当前请求的截止时间（time.monotonic() 时间戳），由接口层写入 llm_context，未设置时为 None"""
+        return llm_context.get({}).get('deadline')
+
+    def _upstream_timeout(self, model_name):
+        """单次上游调用的超时秒数，返回 (timeout, 是否受截止时间约束)；剩余时间不足时抛出 DeadlineExceeded"""
+        remaining = check_deadline(self._deadline(), "upstream", model_name)
+        if remaining is None or remaining >= UPSTREAM_TIMEOUT_SEC:
+            return UPSTREAM_TIMEOUT_SEC, False
+        return remaining, True
+
+    def _deadline_scope(self):
+        """
+        到请求截止时间为止的 asyncio.timeout 作用域（没有截止时间时不限制），超时后 expired() 为 True。
+        httpx 的 timeout 分别作用于连接池、建连、写入与每次读取，不限制整个调用的总时长，由这里兜底。
+        """
+        return asyncio.timeout(remaining_sec(self._deadline()))
+
+    def _queue_timeout(self, gate):
+        # 准入排队最多等到截止时间；返回 None 表示沿用 gate 的 max_wait_sec
+        remaining = check_deadline(self._deadline(), "queue", gate.model_name)
+        return remaining if remaining is not None and remaining < gate.max_wait_sec else None
+
+    def _admit(self, gate):
+        """同步准入排队，因截止时间耗尽而排队失败时抛出 DeadlineExceeded"""
+        if gate is None:
+            return 0.0
+        timeout = self._queue_timeout(gate)
+        try:
+            return gate.acquire(timeout)
+        except AdmissionRejected as e:
+            if timeout is not None and e.reason == "queue_timeout":
+                raise DeadlineExceeded("queue", gate.model_name) from e
+            raise
+
+    async def _admit_async(self, gate):
+        if gate is None:
+            return 0.0
+        timeout = self._queue_timeout(gate)
+        try:
+            return await gate.acquire_async(timeout)
+        except AdmissionRejected as e:
+            if timeout is not None and e.reason == "queue_timeout":
+                raise DeadlineExceeded("queue", gate.model_name) from e
+            raise
+
+    def concurrency_budget(self, model_name=None):
+        """实时并发预算：指定模型时为其当前上限，否则为所有可路由模型上限之和"""
+        if model_name:
+            return self._model_capacity(model_name)
+        return max(1, sum(self._model_capacity(m['name']) for m in self.routing.candidates()))
+
+    @staticmethod
+    def _load_retry_policy(path=RETRY_POLICY_PATH):
+        if not os.path.exists(path):
+            return RetryPolicy()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return RetryPolicy.from_config(yaml.safe_load(f) or {})
+        except Exception as e:
+            logger.warning("[MultiLLM] 重试策略 %s 加载失败，使用默认策略: %s", path, e)
+            return RetryPolicy()
+
+    def _retry_decision(self, model_name, error, attempt):
+        # 返回同一模型上重试前的等待秒数，不重试时返回 None；退避时间不能超出请求剩余时间
+        remaining = remaining_sec(self._deadline())
+        time_left = None if remaining is None else remaining - DEADLINE_MIN_REMAINING_MS / 1000
+        action, delay, error_class = self.retry_policy.decide(error, attempt, time_left)
+        if action != RETRY:
+            return None
+        logger.info({
+            "event": "llm_retry",
+            "model": model_name,
+            "error_class": error_class,
+            "attempt": attempt + 1,
+            "delay_ms": int(delay * 1000),
+            "error": str(error),
+        })
+        return delay
+
+    def _call_with_retries(self, model_name, call):
+        """同一模型上的重试：失败按 RetryPolicy 分类，可重试的错误退避后再调，其余原样抛出，由上层决定是否换模型"""
+        if self.retry_policy is None:
+            return call()
+        self.retry_policy.budget.record_call()
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                delay = self._retry_decision(model_name, e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def _call_with_retries_async(self, model_name, call):
+        if self.retry_policy is None:
+            return await call()
+        self.retry_policy.budget.record_call()
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_decision(model_name, e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _should_failover(self, error):
+        """某个候选失败（含重试）后是否换下一个候选；截止时间已到、请求本身有误、内容审核拦截时直接失败"""
+        if self.retry_policy is None:
+            return not isinstance(error, DeadlineExceeded)
+        return self.retry_policy.should_failover(error)
+
+    def _circuit_breaker(self, model_name):
+        return self.circuit_breakers.get(model_name) if self.circuit_breakers else None
+
+    def _configure_circuit_breaker(self, model_info):
+        if self.circuit_breakers is None:
+            return
+        meta = model_info.get('meta', {})
+        self.circuit_breakers.configure(
+            model_info['name'],
+            failure_threshold=meta.get('circuit_failure_threshold', CIRCUIT_FAILURE_THRESHOLD),
+            failure_rate_threshold=meta.get('circuit_failure_rate', CIRCUIT_FAILURE_RATE_THRESHOLD),
+            min_calls=meta.get('circuit_min_calls', CIRCUIT_MIN_CALLS),
+            cooldown_sec=meta.get('circuit_cooldown_sec', CIRCUIT_COOLDOWN_SEC),
+            window=CIRCUIT_WINDOW,
+        )
+
+    def _configure_stub(self, model_info):
+        name = model_info['name']
+        if not (STUB_ALL_MODELS or str(model_info.get('url') or '').startswith(STUB_URL_SCHEME)):
+            self.stubs.pop(name, None)
+            return
+        profile = model_info.get('meta', {}).get('stub') or {}
+        stub = self.stubs.get(name)
+        if stub is None:
+            self.stubs[name] = StubLLM(profile, name=name)
+        else:
+            stub.configure(profile)  # 热重载时沿用计数，只更新行为配置
+
+    def _configure_client_pool(self, model_info):
+        if self.client_pool is None or model_info['name'] in self.stubs:
+            return
+        meta = model_info.get('meta', {})
+        self.client_pool.register(
+            model_info['name'], model_info['url'], model_info['key'],
+            meta.get('max_concurrency') or model_info.get('qps') or 2,
+        )
+
+    def warm_up(self, connections=None, timeout_sec=None):
+        """为所有同步客户端并行预建上游连接（DNS + TCP + TLS），返回 {url: 成功连接数}"""
+        connections = HTTP_WARMUP_CONNECTIONS if connections is None else connections
+        if self.client_pool is None or connections <= 0:
+            return {}
+        result = self.client_pool.warm_up(connections, timeout_sec or HTTP_WARMUP_TIMEOUT_SEC)
+        self._attach_pooled_clients()
+        return result
+
+    async def async_warm_up(self, connections=None, timeout_sec=None):
+        """异步版本：在事件循环中为异步客户端并行预建连接"""
+        connections = HTTP_WARMUP_CONNECTIONS if connections is None else connections
+        if self.client_pool is None or connections <= 0:
+            return {}
+        result = await self.client_pool.async_warm_up(connections, timeout_sec or HTTP_WARMUP_TIMEOUT_SEC)
+        self._attach_pooled_clients()
+        return result
+
+    def _attach_pooled_clients(self):
+        # 预热后把共享客户端挂到各模型条目上，首个请求不再走创建流程
+        for m in self.models:
+            if m.get('sync_client') is None:
+                m['sync_client'] = self._create_sync_client(m)
+            if m.get('async_client') is None:
+                m['async_client'] = self._create_async_client(m)
+
+    async def aclose(self):
+        if self.bandit is not None:
+            await asyncio.to_thread(self.bandit.save)
+        if self.client_pool is not None:
+            await self.client_pool.aclose()
+
+    def _estimate_prompt_tokens(self, prompt):
+        """未校准的输入 token 估算（只含用户消息），用于路由时按上下文长度过滤"""
+        if not ENABLE_PROMPT_LENGTH_CHECK:
+            return None
+        return estimate_messages_tokens([{"role": "user", "content": prompt}])
+
+    def _fit_prompt(self, prompt, model_info, truncate=None, temperature=None, top_p=None, max_tokens=None, stop=None):
+        """
+        发往上游前的长度预检：按该模型的校准系数估算输入 token，超过 meta.max_input_length 时
+        按 truncate 策略（head/tail/middle）截断，未配置截断则直接抛出 PromptTooLong，不再等上游报错。
+        """
+        limit = model_info.get('meta', {}).get('max_input_length') or 0
+        if not ENABLE_PROMPT_LENGTH_CHECK or not limit:
+            return prompt
+        factor = self._stats(model_info['name']).token_factor
+        messages = self._build_messages(prompt, temperature, top_p, max_tokens, stop)
+        raw = estimate_messages_tokens(messages)
+        estimated = math.ceil(raw * factor)
+        if estimated <= limit:
+            return prompt
+        if truncate not in TRUNCATE_POLICIES:
+            raise PromptTooLong(model_info['name'], estimated, limit)
+        # 截断预算：上限换算回未校准的估算值，再扣除消息格式与系统消息的开销
+        budget = int(limit / factor) - (raw - estimate_tokens(prompt))
+        truncated = truncate_text(prompt, budget, truncate)
+        logger.info({
+            "event": "llm_prompt_truncated",
+            "model": model_info['name'],
+            "policy": truncate,
+            "estimated_tokens": estimated,
+            "max_input_length": limit,
+            "prompt_len": len(prompt),
+            "truncated_len": len(truncated),
+        })
+        return truncated
+
+    def _select_llm_candidates(self, model_name=None, biz_level=None, prefer_cost=None, tags=None, prompt=None, truncate=None):
+        with tracing.span("route", model_name=model_name, biz_level=biz_level, prefer_cost=prefer_cost, tags=tags) as span:
+            candidates = self._route_candidates(model_name, biz_level, prefer_cost, tags, prompt, truncate)
+            if span is not None:
+                span.set(candidates=len(candidates), selected=candidates[0]['name'] if candidates else None)
+            return candidates
+
+    def _route_candidates(self, model_name, biz_level, prefer_cost, tags, prompt, truncate):
         # 1. model_name 强制指定
         if model_name:
-            return [m for m in self.models if m['name'] == model_name]
-
-        # 2. 先筛健康、可用、并发未超限
-        candidates = [m for m in self.models if self.llm_status[m['name']]['healthy'] and self.llm_status[m['name']]['current_concurrency'] < self.llm_status[m['name']]['max_concurrency']]
-        if not candidates:
-            candidates = [m for m in self.models if self.llm_status[m['name']]['healthy']]
-        if not candidates:
-            candidates = self.models  # 全部超载或不健康时兜底
-
-        # 3. biz_level 过滤
-        if biz_level:
-            if biz_level == "premium":
-                candidates = [m for m in candidates if m.get("cost", 0) >= 0.05]
-            elif biz_level == "economy":
-                candidates = [m for m in candidates if m.get("cost", 0) <= 0.02]
-            # 你可以根据实际模型配置调整阈值
-
-        # 4. prefer_cost 过滤/排序
-        if prefer_cost == "low":
-            if candidates:
-                min_cost = min(m.get("cost", 0) for m in candidates)
-                candidates = [m for m in candidates if m.get("cost", 0) == min_cost]
-        elif prefer_cost == "high":
-            if candidates:
-                max_cost = max(m.get("cost", 0) for m in candidates)
-                candidates = [m for m in candidates if m.get("cost", 0) == max_cost]
-
-        # 5. tags 过滤
-        if tags:
-            candidates = [m for m in candidates if set(tags).issubset(set(m.get("tags", [])))]
-
-        # 6. 综合排序
-        def score(m):
-            s = self.llm_status[m['name']]
-            return (
-                s['error_rate'] * 1000 +
-                s['latency'] * 0.1 +
-                s['cost'] * 10 +
-                s['current_concurrency'] * 5
-            )
-        return sorted(candidates, key=score)
+            model_info = self.registry.snapshot.get(model_name)
+            return [model_info] if model_info is not None else []
+        # 2. 其余条件交给路由引擎：输入长度/熔断/健康/并发过滤、biz_level、prefer_cost、tags，按综合评分（或老虎机策略）排序
+        return self.routing.candidates(
+            tags=tags, biz_level=biz_level, prefer_cost=prefer_cost,
+            prompt_tokens=self._estimate_prompt_tokens(prompt) if prompt else None,
+            allow_overflow=truncate in TRUNCATE_POLICIES,
+        )
+
+    def _record_prompt_tokens(self, stats, messages, token_usage):
+        """记录估算与实际的 prompt_tokens（用于校准），返回 (估算值, 实际值)"""
+        estimated = estimate_messages_tokens(messages)
+        actual = getattr(token_usage, 'prompt_tokens', None) if token_usage else None
+        stats.record_prompt_tokens(estimated, actual)
+        return estimated, actual
 
     def generate(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, **kwargs):
         # 优先从 contextvars 获取 LLM 路由参数
@@ -218,6 +820,7 @@ class MultiLLM:
         top_p = top_p if top_p is not None else ctx.get('top_p')
         max_tokens = max_tokens if max_tokens is not None else ctx.get('max_tokens')
         stop = stop if stop is not None else ctx.get('stop')
+        truncate = kwargs.pop('truncate', None) or ctx.get('truncate')
         # 如果指定了 model_name，则强制只用该模型
         if model_name:
             return self.generate_with_specific_model(
@@ -227,110 +830,36 @@ class MultiLLM:
                 top_p=top_p,
                 max_tokens=max_tokens,
                 stop=stop,
+                truncate=truncate,
                 **kwargs
             )
         # 否则走原有分流逻辑
         core.statistics.total_request_count += 1
-        request_id = str(uuid.uuid4())
-        start = time.time()
-        candidates = self._select_llm_candidates()
+        candidates = self._select_llm_candidates(prompt=prompt, truncate=truncate)
+        route_bucket = self.routing.route_bucket()
         last_exception = None
         for model_info in candidates:
             model_name_for_log = model_info['name']
-            print(f"[MultiLLM.generate] Using model: {model_name_for_log} (智能分流={ENABLE_SMART_ROUTING})", flush=True)
-            self.llm_status[model_name_for_log]['current_concurrency'] += 1
-            self.llm_status[model_name_for_log]['call_count'] += 1
+            # 剩余时间不足时不再尝试（包括降级到下一个候选），直接失败
+            check_deadline(self._deadline(), "dispatch", model_name_for_log)
             try:
-                client, used_model_name = self._get_sync_client(model_info)
-                messages = []
-                if temperature is not None or top_p is not None or max_tokens is not None or stop is not None:
-                    messages.append({"role": "system", "content": f"You are a helpful assistant, your temperature is {temperature}, top_p is {top_p}, max_tokens is {max_tokens}, and stop is {stop}."})
-                messages.append({"role": "user", "content": prompt})
-                print(f"[MultiLLM.generate] Calling client.chat.completions.create with model '{used_model_name}'...", flush=True)
-                t0 = time.time()
-                response = client.chat.completions.create(
-                    model=used_model_name,
-                    messages=messages,
-                    temperature=temperature,
-                    top_p=top_p,
-                    max_tokens=max_tokens,
-                    stop=stop,
-                )
-                latency = (time.time() - t0) * 1000  # ms
-                s = self.llm_status[model_name_for_log]
-                s['latency'] = latency if s['latency'] == 0 else (self.latency_alpha * latency + (1 - self.latency_alpha) * s['latency'])
-                self._error_history[model_name_for_log].append(0)
-                if len(self._error_history[model_name_for_log]) > self.error_window:
-                    self._error_history[model_name_for_log].pop(0)
-                s['error_rate'] = sum(self._error_history[model_name_for_log]) / len(self._error_history[model_name_for_log])
-                content = response.choices[0].message.content
-                token_usage = getattr(response, 'usage', None)
-                total_tokens = token_usage.total_tokens if token_usage and hasattr(token_usage, 'total_tokens') else None
-                model_info2 = next((m for m in self.models if m['name'] == used_model_name), None)
-                cost_per_token = model_info2.get('cost', 0.0) if model_info2 else 0.0
-                cost = (total_tokens or 0) * cost_per_token if cost_per_token else None
-                from core.statistics import record_model_cost, record_model_call
-                record_model_cost(model_name_for_log, cost or 0.0)
-                record_model_call(model_name_for_log)
-                logger.info({
-                    "event": "llm_generate",
-                    "model": used_model_name,
-                    "meta": model_info2.get("meta", {}) if model_info2 else {},
-                    "request_id": request_id,
-                    "success": True,
-                    "duration_ms": int((time.time() - start) * 1000),
-                    "prompt_len": len(prompt),
-                    "token_usage": total_tokens,
-                    "cost": cost,
-                    "params": {
-                        "temperature": temperature,
-                        "top_p": top_p,
-                        "max_tokens": max_tokens,
-                        "stop": stop
-                    },
-                    # "user_id": user_id,  # 如有可补充
-                })
-                return {
-                    "result": content,
-                    "used_model": used_model_name,
-                    "token_usage": total_tokens,
-                    "cost": cost
-                }
+                model_prompt = self._fit_prompt(prompt, model_info, truncate, temperature, top_p, max_tokens, stop)
+                messages = self._build_messages(model_prompt, temperature, top_p, max_tokens, stop)
+                logger.debug("[MultiLLM.generate] Using model: %s (智能分流=%s)", model_name_for_log, ENABLE_SMART_ROUTING)
+                # 同一模型上的重试由 RetryPolicy 决定；熔断、排队失败及可降级的错误切换到下一个候选
+                return self._call_with_retries(model_name_for_log, lambda: self._call_model_sync(
+                    model_prompt, model_info, messages, temperature, top_p, max_tokens, stop, route_bucket=route_bucket))
             except Exception as e:
                 last_exception = e
-                s = self.llm_status[model_name_for_log]
-                self._error_history[model_name_for_log].append(1)
-                if len(self._error_history[model_name_for_log]) > self.error_window:
-                    self._error_history[model_name_for_log].pop(0)
-                s['error_rate'] = sum(self._error_history[model_name_for_log]) / len(self._error_history[model_name_for_log])
-                s['error_count'] += 1
-                logger.error({
-                    "event": "llm_generate",
-                    "model": model_name_for_log,
-                    "meta": model_info.get("meta", {}),
-                    "request_id": request_id,
-                    "success": False,
-                    "duration_ms": int((time.time() - start) * 1000),
-                    "prompt_len": len(prompt),
-                    "error": str(e),
-                    "params": {
-                        "temperature": temperature,
-                        "top_p": top_p,
-                        "max_tokens": max_tokens,
-                        "stop": stop
-                    },
-                    # "user_id": user_id,  # 如有可补充
-                })
-            finally:
-                self.llm_status[model_name_for_log]['current_concurrency'] -= 1
+                if not self._should_failover(e):
+                    raise
         # 如果所有候选 LLM 都失败，抛出最后一个异常
         if last_exception:
             raise last_exception
 
     def add_LLM(self, name, url, key, tags=None, version=None, status=None, cost=None, qps=None, health=None):
-        for model in self.models:
-            if model["name"] == name:
-                return False
+        if self.registry.snapshot.get(name) is not None:
+            return False
         new_model = {
             "url": url,
             "name": name,
@@ -351,57 +880,74 @@ class MultiLLM:
         new_model["status"] = new_model["meta"]["status"]
         new_model["cost"] = new_model["meta"]["cost"]
         new_model["qps"] = new_model["meta"]["qps"]
-        self.models.append(new_model)
+        self._init_stats(new_model)
+        self._configure_admission(new_model)
+        self._configure_concurrency_limit(new_model)
+        self._configure_circuit_breaker(new_model)
+        self._configure_client_pool(new_model)
+        if not self.registry.add(new_model):
+            return False
+        self._config_fingerprints[name] = self._config_fingerprint(new_model)
         return True
 
     def update_LLM(self, name, url=None, key=None, tags=None, version=None, status=None, cost=None, qps=None, health=None):
-        for model in self.models:
-            if model["name"] == name:
-                if url is not None:
-                    model["url"] = url
-                if key is not None:
-                    model["key"] = key
-                if version is not None:
-                    model["version"] = version
-                if "meta" not in model:
-                    model["meta"] = {}
-                if tags is not None:
-                    model["meta"]["tags"] = tags
-                    model["tags"] = tags
-                if status is not None:
-                    model["meta"]["status"] = status
-                    model["status"] = status
-                if cost is not None:
-                    model["meta"]["cost"] = cost
-                    model["cost"] = cost
-                if qps is not None:
-                    model["meta"]["qps"] = qps
-                    model["qps"] = qps
-                if health is not None:
-                    model["health"] = health
-                model["sync_client"] = None
-                model["async_client"] = None
-                return True
-        return False
+        current = self.registry.snapshot.get(name)
+        if current is None:
+            return False
+        # 写时复制：修改副本后整体替换快照，读者不会看到改到一半的条目
+        model = {**current, "meta": dict(current.get("meta", {}))}
+        if url is not None:
+            model["url"] = url
+        if key is not None:
+            model["key"] = key
+        if version is not None:
+            model["version"] = version
+        if tags is not None:
+            model["meta"]["tags"] = tags
+            model["tags"] = tags
+        if status is not None:
+            model["meta"]["status"] = status
+            model["status"] = status
+        if cost is not None:
+            model["meta"]["cost"] = cost
+            model["cost"] = cost
+        if qps is not None:
+            model["meta"]["qps"] = qps
+            model["qps"] = qps
+        if health is not None:
+            model["health"] = health
+        if model.get("url") != current.get("url") or model.get("key") != current.get("key"):
+            # 只有地址或密钥变化才需要新客户端；只改标签、成本等元数据时沿用原客户端
+            model["sync_client"] = None
+            model["async_client"] = None
+        self.registry.replace([model if m["name"] == name else m for m in self.registry.snapshot.models])
+        self._refresh_stats(model)
+        self._configure_admission(model)
+        self._configure_concurrency_limit(model)
+        self._configure_circuit_breaker(model)
+        self._configure_client_pool(model)
+        self._config_fingerprints[name] = self._config_fingerprint(model)
+        return True
 
     def remove_LLM(self, name):
-        for i, model in enumerate(self.models):
-            if model["name"] == name:
-                del self.models[i]
-                # 修正 current 指针
-                if hasattr(self, "current") and self.current >= len(self.models):
-                    self.current = max(0, len(self.models) - 1)
-                return True
-        return False
-
-    def generate_with_specific_model(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, session_id=None, preferred_index=None, biz_level=None, prefer_cost=None, tags=None, **kwargs):
-        print(f"[generate_with_specific_model] 开始处理: model_name='{model_name}', prompt='{prompt[:50]}...'")
+        if self.registry.remove(name) is None:
+            return False
+        self._drop_runtime_state(name)
+        # 修正 current 指针
+        if hasattr(self, "current") and self.current >= len(self.models):
+            self.current = max(0, len(self.models) - 1)
+        return True
+
+    def generate_with_specific_model(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, session_id=None, preferred_index=None, biz_level=None, prefer_cost=None, tags=None, use_cache=None, route_bucket=None, **kwargs):
+        logger.debug("[generate_with_specific_model] 开始处理: model_name='%s', prompt='%s...'", model_name, prompt[:50])
         """
         统一入口，自动参数映射，支持 temperature、top_p、max_tokens、stop。
         路由优先级：
         1. model_name 明确指定，强制用该模型。
         2. preferred_index（如 session 绑定）有效，优先用该模型。
         3. 否则按 biz_level/prefer_cost/tags 动态分流。
+        use_cache=False（或上下文中的 use_cache=False）可跳过响应缓存。
+        route_bucket：调用方自行路由（如 ModelRouter.select_model）后指定模型时，传入该路由的老虎机分桶以回报奖励。
         """
         # 优先级1：model_name 显式参数 > 上下文参数
         ctx = llm_context.get({})
@@ -415,6 +961,8 @@ class MultiLLM:
         biz_level = biz_level or ctx.get('biz_level')
         prefer_cost = prefer_cost or ctx.get('prefer_cost')
         tags = tags or ctx.get('tags')
+        use_cache = use_cache if use_cache is not None else ctx.get('use_cache')
+        truncate = kwargs.pop('truncate', None) or ctx.get('truncate')
         # 构建参数映射表
         param_map = {
             'temperature': temperature,
@@ -426,67 +974,97 @@ class MultiLLM:
         mapped_params.update(kwargs)
         # 优先级1：model_name
         if model_name:
-            model_info = next((m for m in self.models if m["name"] == model_name), None)
+            snapshot = self.registry.snapshot
+            model_info = snapshot.get(model_name)
             if model_info is not None:
-                self.current = self.models.index(model_info)
+                self.current = snapshot.index_of(model_name)
                 # 直接调用底层生成逻辑，避免递归
-                return self._generate_with_model_info(prompt, model_info, temperature, top_p, max_tokens, stop, **kwargs)
+                return self._generate_with_model_info(prompt, model_info, temperature, top_p, max_tokens, stop, use_cache=use_cache, truncate=truncate, route_bucket=route_bucket, **kwargs)
         # 优先级2：preferred_index
-        if preferred_index is not None and 0 <= preferred_index < len(self.models):
+        models = self.models
+        if preferred_index is not None and 0 <= preferred_index < len(models):
             self.current = preferred_index
-            model_info = self.models[preferred_index]
-            return self._generate_with_model_info(prompt, model_info, temperature, top_p, max_tokens, stop, **kwargs)
-        # 优先级3：动态分流
-        candidates = self._select_llm_candidates(biz_level=biz_level, prefer_cost=prefer_cost, tags=tags)
+            model_info = models[preferred_index]
+            return self._generate_with_model_info(prompt, model_info, temperature, top_p, max_tokens, stop, use_cache=use_cache, truncate=truncate, **kwargs)
+        # 优先级3：动态分流（排除上下文放不下该 prompt 的模型）
+        candidates = self._select_llm_candidates(biz_level=biz_level, prefer_cost=prefer_cost, tags=tags, prompt=prompt, truncate=truncate)
         if candidates:
             model_info = candidates[0]  # 使用第一个候选模型
-            return self._generate_with_model_info(prompt, model_info, temperature, top_p, max_tokens, stop, **kwargs)
+            return self._generate_with_model_info(prompt, model_info, temperature, top_p, max_tokens, stop, use_cache=use_cache, truncate=truncate,
+                                                  route_bucket=self.routing.route_bucket(tags, biz_level), **kwargs)
         else:
             raise ValueError("No suitable model found")
 
-    def _generate_with_model_info(self, prompt, model_info, temperature=None, top_p=None, max_tokens=None, stop=None, **kwargs):
+    def _generate_with_model_info(self, prompt, model_info, temperature=None, top_p=None, max_tokens=None, stop=None, use_cache=None, truncate=None, route_bucket=None, **kwargs):
         """底层生成逻辑，避免递归调用"""
+        model_name_for_log = model_info['name']
+        prompt = self._fit_prompt(prompt, model_info, truncate, temperature, top_p, max_tokens, stop)
+        messages = self._build_messages(prompt, temperature, top_p, max_tokens, stop)
+        request_key = self._request_key(model_name_for_log, messages, temperature, top_p, max_tokens, stop, use_cache)
+        cached = self._cached_result(request_key, model_name_for_log, prompt)
+        if cached is not None:
+            return cached
+        call = lambda: self._call_with_retries(model_name_for_log, lambda: self._call_model_sync(
+            prompt, model_info, messages, temperature, top_p, max_tokens, stop, request_key, route_bucket))
+        if request_key is not None and self.single_flight is not None:
+            # 相同请求并发时只发起一次上游调用
+            return self.single_flight.do(request_key, call)
+        return call()
+
+    def _call_model_sync(self, prompt, model_info, messages, temperature=None, top_p=None, max_tokens=None, stop=None, request_key=None, route_bucket=None):
+        """同步调用上游模型，并更新延迟、错误率、成本等统计"""
         import uuid
         import time
         from core.statistics import record_model_cost, record_model_call
-        
+
         model_name_for_log = model_info['name']
         request_id = str(uuid.uuid4())
         start = time.time()
-        
-        print(f"[MultiLLM._generate_with_model_info] 开始处理: model='{model_name_for_log}', prompt='{prompt[:50]}...'", flush=True)
-        self.llm_status[model_name_for_log]['current_concurrency'] += 1
-        self.llm_status[model_name_for_log]['call_count'] += 1
+
+        logger.debug("[MultiLLM._generate_with_model_info] 开始处理: model='%s', prompt='%s...'", model_name_for_log, prompt[:50])
+        # 熔断中直接抛出 CircuitOpen；准入控制：并发已满时排队，队列满或等待超时抛出 AdmissionRejected
+        breaker = self._circuit_breaker(model_name_for_log)
+        probe = breaker.acquire() if breaker else False
+        gate = self._admission_gate(model_name_for_log)
+        try:
+            queue_wait_ms = self._admit(gate)
+        except BaseException:
+            if breaker:
+                breaker.record(None, probe)
+            raise
+        success = None
+        deadline_bound = False
+        stats = self._stats(model_name_for_log)
+        stats.begin()
         
         try:
+            timeout, deadline_bound = self._upstream_timeout(model_name_for_log)
             client, used_model_name = self._get_sync_client(model_info)
-            messages = []
-            if temperature is not None or top_p is not None or max_tokens is not None or stop is not None:
-                messages.append({"role": "system", "content": f"You are a helpful assistant, your temperature is {temperature}, top_p is {top_p}, max_tokens is {max_tokens}, and stop is {stop}."})
-            messages.append({"role": "user", "content": prompt})
-            print(f"[MultiLLM._generate_with_model_info] Calling client.chat.completions.create with model '{used_model_name}'...", flush=True)
+            logger.debug("[MultiLLM._generate_with_model_info] Calling client.chat.completions.create with model '%s'...", used_model_name)
             t0 = time.time()
-            response = client.chat.completions.create(
-                model=used_model_name,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                stop=stop,
-                timeout=10*60
-            )
+            with tracing.span("llm.upstream", tracing.CLIENT, model=model_name_for_log, queue_wait_ms=round(queue_wait_ms, 3)) as span:
+                response = client.chat.completions.create(
+                    model=used_model_name,
+                    messages=messages,
+                    temperature=temperature,
+                    top_p=top_p,
+                    max_tokens=max_tokens,
+                    stop=stop,
+                    timeout=timeout,
+                    extra_headers=tracing.inject_headers(),
+                )
+                if span is not None:
+                    span.set(total_tokens=getattr(getattr(response, 'usage', None), 'total_tokens', None))
+            success = True
             latency = (time.time() - t0) * 1000  # ms
-            s = self.llm_status[model_name_for_log]
-            s['latency'] = latency if s['latency'] == 0 else (self.latency_alpha * latency + (1 - self.latency_alpha) * s['latency'])
-            self._error_history[model_name_for_log].append(0)
-            if len(self._error_history[model_name_for_log]) > self.error_window:
-                self._error_history[model_name_for_log].pop(0)
-            s['error_rate'] = sum(self._error_history[model_name_for_log]) / len(self._error_history[model_name_for_log])
+            stats.record_success(latency, queue_wait_ms, (time.time() - start) * 1000)
+            self._observe_concurrency(model_name_for_log, latency, stats.current_concurrency)
+            self._observe_route(model_info, latency, True, route_bucket)
             content = response.choices[0].message.content
             token_usage = getattr(response, 'usage', None)
             total_tokens = token_usage.total_tokens if token_usage and hasattr(token_usage, 'total_tokens') else None
-            model_info2 = next((m for m in self.models if m['name'] == used_model_name), None)
-            cost_per_token = model_info2.get('cost', 0.0) if model_info2 else 0.0
+            estimated_prompt_tokens, prompt_tokens = self._record_prompt_tokens(stats, messages, token_usage)
+            cost_per_token = model_info.get('cost', 0.0)
             cost = (total_tokens or 0) * cost_per_token if cost_per_token else None
             
             # 记录统计数据
@@ -496,12 +1074,15 @@ class MultiLLM:
             logger.info({
                 "event": "llm_generate",
                 "model": used_model_name,
-                "meta": model_info2.get("meta", {}) if model_info2 else {},
+                "meta": model_meta_for_log(model_info.get("meta")),
                 "request_id": request_id,
                 "success": True,
+                "queue_wait_ms": int(queue_wait_ms),
                 "duration_ms": int((time.time() - start) * 1000),
                 "prompt_len": len(prompt),
                 "token_usage": total_tokens,
+                "prompt_tokens": prompt_tokens,
+                "estimated_prompt_tokens": estimated_prompt_tokens,
                 "cost": cost,
                 "params": {
                     "temperature": temperature,
@@ -510,23 +1091,29 @@ class MultiLLM:
                     "stop": stop
                 },
             })
-            return {
+            result = {
                 "result": content,
                 "used_model": used_model_name,
                 "token_usage": total_tokens,
                 "cost": cost
             }
+            if request_key is not None and self.response_cache is not None and content is not None:
+                self.response_cache.put(request_key, result)
+            return result
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            s = self.llm_status[model_name_for_log]
-            self._error_history[model_name_for_log].append(1)
-            if len(self._error_history[model_name_for_log]) > self.error_window:
-                self._error_history[model_name_for_log].pop(0)
-            s['error_rate'] = sum(self._error_history[model_name_for_log]) / len(self._error_history[model_name_for_log])
-            s['error_count'] += 1
+            if deadline_bound and isinstance(e, APITimeoutError):
+                # 超时由请求截止时间决定，不算模型失败
+                raise DeadlineExceeded("upstream", model_name_for_log) from e
+            success = self._breaker_outcome(e)
+            stats.record_failure()
+            self._observe_concurrency(model_name_for_log, 0.0, stats.current_concurrency, e)
+            self._observe_route(model_info, 0.0, False, route_bucket)
             logger.error({
                 "event": "llm_generate",
                 "model": model_name_for_log,
-                "meta": model_info.get("meta", {}),
+                "meta": model_meta_for_log(model_info.get("meta")),
                 "request_id": request_id,
                 "success": False,
                 "duration_ms": int((time.time() - start) * 1000),
@@ -541,11 +1128,16 @@ class MultiLLM:
             })
             raise e
         finally:
-            self.llm_status[model_name_for_log]['current_concurrency'] -= 1
+            stats.end()
+            if gate:
+                gate.release()
+            if breaker:
+                breaker.record(success, probe)
 
-    def generate_stream_with_specific_model(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, **kwargs):
+    def generate_stream_with_specific_model(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, use_cache=None, **kwargs):
         """
         OpenAI流式生成器：每次yield一个token或文本片段。
+        缓存命中时按 STREAM_REPLAY_CHUNK_SIZE 分片回放缓存内容；相同请求并发时共享同一条上游流。
         """
         ctx = llm_context.get({})
         model_name = model_name or ctx.get('model_name')
@@ -553,34 +1145,208 @@ class MultiLLM:
         top_p = top_p if top_p is not None else ctx.get('top_p')
         max_tokens = max_tokens if max_tokens is not None else ctx.get('max_tokens')
         stop = stop if stop is not None else ctx.get('stop')
-        model_info = next((m for m in self.models if m['name'] == model_name), None)
+        model_info = self.registry.snapshot.get(model_name)
         if model_info is None:
             raise ValueError(f"Model {model_name} not found.")
-        
+        prompt = self._fit_prompt(prompt, model_info, kwargs.get('truncate') or ctx.get('truncate'), temperature, top_p, max_tokens, stop)
+        # 与非流式路径相同的消息与缓存键，非流式的缓存结果可以直接流式回放
+        messages = self._build_messages(prompt, temperature, top_p, max_tokens, stop)
+        request_key = self._request_key(model_name, messages, temperature, top_p, max_tokens, stop, use_cache)
+        cached = self._cached_result(request_key, model_name, prompt, stream=True)
+        if cached is not None:
+            text = cached.get("result") or ""
+            for i in range(0, len(text), STREAM_REPLAY_CHUNK_SIZE):
+                yield text[i:i + STREAM_REPLAY_CHUNK_SIZE]
+            return
+
+        upstream = lambda: self._stream_model_sync(model_info, messages, temperature, top_p, max_tokens, stop, request_key)
+        if request_key is not None and self.single_flight is not None:
+            yield from self.single_flight.stream(request_key, upstream)
+        else:
+            yield from upstream()
+
+    def _stream_model_sync(self, model_info, messages, temperature=None, top_p=None, max_tokens=None, stop=None, request_key=None):
+        """读取上游流式响应；只有完整结束的流才写入缓存（客户端中途断开时生成器被关闭，不会走到末尾）"""
+        model_name = model_info['name']
         # 记录调用统计
         from core.statistics import record_model_call
         record_model_call(model_name)
-        
-        client, used_model_name = self._get_sync_client(model_info)
-        messages = []
-        messages.append({"role": "user", "content": prompt})
-        stream_resp = client.chat.completions.create(
-            model=used_model_name,
-            messages=messages,
-            temperature=temperature,
-            top_p=top_p,
-            max_tokens=max_tokens,
-            stop=stop,
-            stream=True
-        )
-        for chunk in stream_resp:
-            if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'delta'):
-                content = chunk.choices[0].delta.content
-                if content:
-                    yield content
+        breaker = self._circuit_breaker(model_name)
+        probe = breaker.acquire() if breaker else False
+        gate = self._admission_gate(model_name)
+        success = None
+        deadline_bound = False
+        upstream_span = None
+        try:
+            self._admit(gate)
+        except BaseException:
+            if breaker:
+                breaker.record(None, probe)
+            raise
+        try:
+            # httpx 的超时只约束建连与每次读取的等待，整个流的时长由每个 chunk 上的截止时间检查兜底
+            timeout, deadline_bound = self._upstream_timeout(model_name)
+            client, used_model_name = self._get_sync_client(model_info)
+            # 生成器跨 yield 不切换 current_span，span 手动结束于 finally，覆盖整个流
+            upstream_span = tracing.start_span("llm.upstream", tracing.CLIENT, model=model_name, stream=True)
+            stream_resp = client.chat.completions.create(
+                model=used_model_name,
+                messages=messages,
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=max_tokens,
+                stop=stop,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=timeout,
+                extra_headers={tracing.TRACEPARENT_HEADER: upstream_span.traceparent()} if upstream_span else None,
+            )
+            parts = []
+            token_usage = None
+            try:
+                for chunk in stream_resp:
+                    check_deadline(self._deadline(), "stream", model_name)
+                    token_usage = getattr(chunk, 'usage', None) or token_usage
+                    if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'delta'):
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            parts.append(content)
+                            yield content
+            finally:
+                stream_resp.close()
+            success = True
+            result = self._stream_result(model_info, used_model_name, parts, token_usage)
+            if request_key is not None and self.response_cache is not None:
+                self.response_cache.put(request_key, result)
+        except Exception as e:
+            if upstream_span is not None:
+                upstream_span.record_error(e)
+            if isinstance(e, DeadlineExceeded):
+                raise
+            if deadline_bound and isinstance(e, APITimeoutError):
+                # 超时由请求截止时间决定，不算模型失败
+                raise DeadlineExceeded("upstream", model_name) from e
+            success = self._breaker_outcome(e)
+            raise
+        finally:
+            if upstream_span is not None:
+                upstream_span.end()
+            if gate:
+                gate.release()
+            if breaker:
+                breaker.record(success, probe)
 
+    async def async_generate_stream(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, use_cache=None, **kwargs):
+        """
+        generate_stream_with_specific_model 的异步版本：基于 AsyncOpenAI 的原生异步流式生成器，
+        每个 token 直接在事件循环中转发，不占用线程池线程。缓存回放与并发合并行为与同步版本一致。
+        """
+        ctx = llm_context.get({})
+        model_name = model_name or ctx.get('model_name')
+        temperature = temperature if temperature is not None else ctx.get('temperature')
+        top_p = top_p if top_p is not None else ctx.get('top_p')
+        max_tokens = max_tokens if max_tokens is not None else ctx.get('max_tokens')
+        stop = stop if stop is not None else ctx.get('stop')
+        model_info = self.registry.snapshot.get(model_name)
+        if model_info is None:
+            raise ValueError(f"Model {model_name} not found.")
+        prompt = self._fit_prompt(prompt, model_info, kwargs.get('truncate') or ctx.get('truncate'), temperature, top_p, max_tokens, stop)
+        # 与非流式路径相同的消息与缓存键，非流式的缓存结果可以直接流式回放
+        messages = self._build_messages(prompt, temperature, top_p, max_tokens, stop)
+        request_key = self._request_key(model_name, messages, temperature, top_p, max_tokens, stop, use_cache)
+        cached = self._cached_result(request_key, model_name, prompt, stream=True)
+        if cached is not None:
+            text = cached.get("result") or ""
+            for i in range(0, len(text), STREAM_REPLAY_CHUNK_SIZE):
+                yield text[i:i + STREAM_REPLAY_CHUNK_SIZE]
+            return
 
+        upstream = lambda: self._stream_model_async(model_info, messages, temperature, top_p, max_tokens, stop, request_key)
+        if request_key is not None and self.single_flight is not None:
+            async for content in self.single_flight.async_stream(request_key, upstream):
+                yield content
+        else:
+            async for content in upstream():
+                yield content
 
+    async def _stream_model_async(self, model_info, messages, temperature=None, top_p=None, max_tokens=None, stop=None, request_key=None):
+        """异步读取上游流式响应；提前结束时关闭上游连接，只有完整结束的流才写入缓存"""
+        model_name = model_info['name']
+        from core.statistics import record_model_call
+        record_model_call(model_name)
+        breaker = self._circuit_breaker(model_name)
+        probe = breaker.acquire() if breaker else False
+        gate = self._admission_gate(model_name)
+        success = None
+        deadline_bound = False
+        scope = None
+        upstream_span = None
+        try:
+            await self._admit_async(gate)
+        except BaseException:
+            if breaker:
+                breaker.record(None, probe)
+            raise
+        try:
+            timeout, deadline_bound = self._upstream_timeout(model_name)
+            client, used_model_name = await self._get_async_client(model_info)
+            # 生成器跨 yield 不切换 current_span，span 手动结束于 finally，覆盖整个流
+            upstream_span = tracing.start_span("llm.upstream", tracing.CLIENT, model=model_name, stream=True)
+            scope = self._deadline_scope()
+            async with scope:
+                stream_resp = await client.chat.completions.create(
+                    model=used_model_name,
+                    messages=messages,
+                    temperature=temperature,
+                    top_p=top_p,
+                    max_tokens=max_tokens,
+                    stop=stop,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout,
+                    extra_headers={tracing.TRACEPARENT_HEADER: upstream_span.traceparent()} if upstream_span else None,
+                )
+            parts = []
+            token_usage = None
+            try:
+                chunks = stream_resp.__aiter__()
+                while True:
+                    # 每次读取都以请求截止时间为限：作用域不能跨 yield（消费者可能在另一个 task 中，如 single-flight 的转发任务）
+                    scope = self._deadline_scope()
+                    try:
+                        async with scope:
+                            chunk = await anext(chunks)
+                    except StopAsyncIteration:
+                        break
+                    token_usage = getattr(chunk, 'usage', None) or token_usage
+                    if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'delta'):
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            parts.append(content)
+                            yield content
+            finally:
+                await stream_resp.close()
+            success = True
+            result = self._stream_result(model_info, used_model_name, parts, token_usage)
+            if request_key is not None and self.response_cache is not None:
+                self.response_cache.put(request_key, result)
+        except Exception as e:
+            if upstream_span is not None:
+                upstream_span.record_error(e)
+            if isinstance(e, DeadlineExceeded):
+                raise
+            if (deadline_bound and isinstance(e, APITimeoutError)) or (scope is not None and scope.expired()):
+                # 超时由请求截止时间决定，不算模型失败
+                raise DeadlineExceeded("upstream", model_name) from e
+            success = self._breaker_outcome(e)
+            raise
+        finally:
+            if upstream_span is not None:
+                upstream_span.end()
+            if gate:
+                gate.release()
+            if breaker:
+                breaker.record(success, probe)
 
     async def async_generate(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, **kwargs):
         ctx = llm_context.get({})
@@ -608,51 +1374,108 @@ class MultiLLM:
             **kwargs
         )
 
-    async def async_generate_with_specific_model(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, **kwargs):
-        import uuid
-        import time
+    async def async_generate_with_specific_model(self, prompt, model_name=None, temperature=None, top_p=None, max_tokens=None, stop=None, session_id=None, preferred_index=None, biz_level=None, prefer_cost=None, tags=None, use_cache=None, route_bucket=None, **kwargs):
+        """
+        generate_with_specific_model 的异步版本（基于 AsyncOpenAI，不阻塞事件循环），参数与路由优先级一致：
+        1. model_name 明确指定，强制用该模型（不存在时抛 ValueError）。
+        2. preferred_index（如 session 绑定）有效，优先用该模型。
+        3. 否则按 biz_level/prefer_cost/tags 动态分流。
+        route_bucket 含义同 generate_with_specific_model。
+        """
+        ctx = llm_context.get({})
+        model_name = model_name or ctx.get('model_name')
+        temperature = temperature if temperature is not None else ctx.get('temperature')
+        top_p = top_p if top_p is not None else ctx.get('top_p')
+        max_tokens = max_tokens if max_tokens is not None else ctx.get('max_tokens')
+        stop = stop if stop is not None else ctx.get('stop')
+        preferred_index = preferred_index if preferred_index is not None else ctx.get('preferred_index')
+        biz_level = biz_level or ctx.get('biz_level')
+        prefer_cost = prefer_cost or ctx.get('prefer_cost')
+        tags = tags or ctx.get('tags')
+        truncate = kwargs.pop('truncate', None) or ctx.get('truncate')
+        snapshot = self.registry.snapshot
+        if model_name:
+            model_info = snapshot.get(model_name)
+            if model_info is None:
+                raise ValueError(f"Model {model_name} not found.")
+        elif preferred_index is not None and 0 <= preferred_index < len(snapshot.models):
+            model_info = snapshot.models[preferred_index]
+        else:
+            candidates = self._select_llm_candidates(biz_level=biz_level, prefer_cost=prefer_cost, tags=tags, prompt=prompt, truncate=truncate)
+            if not candidates:
+                raise ValueError("No suitable model found")
+            model_info = candidates[0]
+            route_bucket = self.routing.route_bucket(tags, biz_level)
+
+        model_name_for_log = model_info['name']
+        prompt = self._fit_prompt(prompt, model_info, truncate, temperature, top_p, max_tokens, stop)
+        messages = self._build_messages(prompt, temperature, top_p, max_tokens, stop)
+        request_key = self._request_key(model_name_for_log, messages, temperature, top_p, max_tokens, stop, use_cache)
+        cached = self._cached_result(request_key, model_name_for_log, prompt)
+        if cached is not None:
+            return cached
+        call = lambda: self._call_with_retries_async(model_name_for_log, lambda: self._call_model_async(
+            prompt, model_info, messages, temperature, top_p, max_tokens, stop, request_key, route_bucket))
+        if request_key is not None and self.single_flight is not None:
+            # 相同请求并发时共享同一个上游 future
+            return await self.single_flight.async_do(request_key, call)
+        return await call()
+
+    async def _call_model_async(self, prompt, model_info, messages, temperature=None, top_p=None, max_tokens=None, stop=None, request_key=None, route_bucket=None):
+        """异步调用上游模型，并更新延迟、错误率、成本等统计"""
         from core.statistics import record_model_cost, record_model_call
-        
-        model_info = next((m for m in self.models if m["name"] == model_name), None)
-        if model_info is None:
-            raise ValueError(f"Model {model_name} not found.")
-        
+
         model_name_for_log = model_info['name']
         request_id = str(uuid.uuid4())
         start = time.time()
-        
-        print(f"[MultiLLM.async_generate_with_specific_model] 开始处理: model='{model_name_for_log}', prompt='{prompt[:50]}...'", flush=True)
-        self.llm_status[model_name_for_log]['current_concurrency'] += 1
-        self.llm_status[model_name_for_log]['call_count'] += 1
+
+        logger.debug("[MultiLLM.async_generate_with_specific_model] 开始处理: model='%s', prompt='%s...'", model_name_for_log, prompt[:50])
+        # 熔断中直接抛出 CircuitOpen；准入控制：并发已满时排队，队列满或等待超时抛出 AdmissionRejected
+        breaker = self._circuit_breaker(model_name_for_log)
+        probe = breaker.acquire() if breaker else False
+        gate = self._admission_gate(model_name_for_log)
+        try:
+            queue_wait_ms = await self._admit_async(gate)
+        except BaseException:
+            if breaker:
+                breaker.record(None, probe)
+            raise
+        success = None
+        deadline_bound = False
+        scope = None
+        stats = self._stats(model_name_for_log)
+        stats.begin()
         
         try:
+            timeout, deadline_bound = self._upstream_timeout(model_name_for_log)
             client, used_model_name = await self._get_async_client(model_info)
-            messages = []
-            if temperature is not None or top_p is not None or max_tokens is not None or stop is not None:
-                messages.append({"role": "system", "content": f"You are a helpful assistant, your temperature is {temperature}, top_p = {top_p}, max_tokens = {max_tokens}, and stop = {stop}."})
-            messages.append({"role": "user", "content": prompt})
-            print(f"[MultiLLM.async_generate_with_specific_model] Calling client.chat.completions.create with model '{used_model_name}'...", flush=True)
+            logger.debug("[MultiLLM.async_generate_with_specific_model] Calling client.chat.completions.create with model '%s'...", used_model_name)
             t0 = time.time()
-            response = await client.chat.completions.create(
-                model=used_model_name,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                stop=stop,
-            )
+            scope = self._deadline_scope()
+            with tracing.span("llm.upstream", tracing.CLIENT, model=model_name_for_log, queue_wait_ms=round(queue_wait_ms, 3)) as span:
+                async with scope:
+                    response = await client.chat.completions.create(
+                        model=used_model_name,
+                        messages=messages,
+                        temperature=temperature,
+                        top_p=top_p,
+                        max_tokens=max_tokens,
+                        stop=stop,
+                        timeout=timeout,
+                        extra_headers=tracing.inject_headers(),
+                    )
+                if span is not None:
+                    span.set(total_tokens=getattr(getattr(response, 'usage', None), 'total_tokens', None))
+            success = True
             latency = (time.time() - t0) * 1000  # ms
-            s = self.llm_status[model_name_for_log]
-            s['latency'] = latency if s['latency'] == 0 else (self.latency_alpha * latency + (1 - self.latency_alpha) * s['latency'])
-            self._error_history[model_name_for_log].append(0)
-            if len(self._error_history[model_name_for_log]) > self.error_window:
-                self._error_history[model_name_for_log].pop(0)
-            s['error_rate'] = sum(self._error_history[model_name_for_log]) / len(self._error_history[model_name_for_log])
+            stats.record_success(latency, queue_wait_ms, (time.time() - start) * 1000)
+            self._observe_concurrency(model_name_for_log, latency, stats.current_concurrency)
+            self._observe_route(model_info, latency, True, route_bucket)
             content = response.choices[0].message.content
             token_usage = getattr(response, 'usage', None)
             total_tokens = token_usage.total_tokens if token_usage and hasattr(token_usage, 'total_tokens') else None
-            model_info2 = next((m for m in self.models if m['name'] == used_model_name), None)
-            cost_per_token = model_info2.get('cost', 0.0) if model_info2 else 0.0
+            estimated_prompt_tokens, prompt_tokens = self._record_prompt_tokens(stats, messages, token_usage)
+            cost_per_token = model_info.get('cost', 0.0)
             cost = (total_tokens or 0) * cost_per_token if cost_per_token else None
             
             # 记录统计数据
@@ -662,12 +1485,15 @@ class MultiLLM:
             logger.info({
                 "event": "llm_generate",
                 "model": used_model_name,
-                "meta": model_info2.get("meta", {}) if model_info2 else {},
+                "meta": model_meta_for_log(model_info.get("meta")),
                 "request_id": request_id,
                 "success": True,
+                "queue_wait_ms": int(queue_wait_ms),
                 "duration_ms": int((time.time() - start) * 1000),
                 "prompt_len": len(prompt),
                 "token_usage": total_tokens,
+                "prompt_tokens": prompt_tokens,
+                "estimated_prompt_tokens": estimated_prompt_tokens,
                 "cost": cost,
                 "params": {
                     "temperature": temperature,
@@ -677,23 +1503,29 @@ class MultiLLM:
                 },
             })
             
-            return {
+            result = {
                 "result": content,
                 "used_model": used_model_name,
                 "token_usage": total_tokens,
                 "cost": cost
             }
+            if request_key is not None and self.response_cache is not None and content is not None:
+                self.response_cache.put(request_key, result)
+            return result
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            s = self.llm_status[model_name_for_log]
-            self._error_history[model_name_for_log].append(1)
-            if len(self._error_history[model_name_for_log]) > self.error_window:
-                self._error_history[model_name_for_log].pop(0)
-            s['error_rate'] = sum(self._error_history[model_name_for_log]) / len(self._error_history[model_name_for_log])
-            s['error_count'] += 1
+            if (deadline_bound and isinstance(e, APITimeoutError)) or (scope is not None and scope.expired()):
+                # 超时由请求截止时间决定，不算模型失败
+                raise DeadlineExceeded("upstream", model_name_for_log) from e
+            success = self._breaker_outcome(e)
+            stats.record_failure()
+            self._observe_concurrency(model_name_for_log, 0.0, stats.current_concurrency, e)
+            self._observe_route(model_info, 0.0, False, route_bucket)
             logger.error({
                 "event": "llm_generate",
                 "model": model_name_for_log,
-                "meta": model_info.get("meta", {}),
+                "meta": model_meta_for_log(model_info.get("meta")),
                 "request_id": request_id,
                 "success": False,
                 "duration_ms": int((time.time() - start) * 1000),
@@ -708,28 +1540,226 @@ class MultiLLM:
             })
             raise e
         finally:
-            self.llm_status[model_name_for_log]['current_concurrency'] -= 1
+            stats.end()
+            if gate:
+                gate.release()
+            if breaker:
+                breaker.record(success, probe)
+
+    def _hedge_delay(self, model_info, hedge_delay_ms=None):
+        """对冲阈值（秒）：优先用请求指定值，其次用该模型的滚动 p95，没有统计时用默认值"""
+        if hedge_delay_ms is None:
+            hedge_delay_ms = self._stats(model_info['name']).latency_quantile(0.95) or HEDGE_DEFAULT_DELAY_MS
+        return max(hedge_delay_ms, HEDGE_MIN_DELAY_MS) / 1000
 
     async def async_generate_with_auto_model(self, prompt, temperature=None, top_p=None, max_tokens=None, stop=None, **kwargs):
+        """
+        按候选顺序调用模型，失败则切换到下一个候选。
+        对冲模式（上下文 hedge=True）：当前候选超过阈值（默认取其 p95）仍未返回时，
+        并行发往下一个候选，取最先成功的结果并取消其余请求。
+        竞速模式（上下文 race_n=N，或按 RACE_N_BY_BIZ_LEVEL 配置）：同时发往前 N 个候选。
+        """
         ctx = llm_context.get({})
         model_name = ctx.get('model_name')
         biz_level = ctx.get('biz_level')
         prefer_cost = ctx.get('prefer_cost')
         tags = ctx.get('tags')
-        candidates = self._select_llm_candidates(model_name=model_name, biz_level=biz_level, prefer_cost=prefer_cost, tags=tags)
+        hedge = ctx.get('hedge')
+        if hedge is None:
+            hedge = ENABLE_HEDGING
+        hedge_delay_ms = ctx.get('hedge_delay_ms')
+        race_n = ctx.get('race_n') or RACE_N_BY_BIZ_LEVEL.get(biz_level, 1)
+        truncate = kwargs.get('truncate') or ctx.get('truncate')
+        candidates = self._select_llm_candidates(model_name=model_name, biz_level=biz_level, prefer_cost=prefer_cost, tags=tags, prompt=prompt, truncate=truncate)
+        route_bucket = None if model_name else self.routing.route_bucket(tags, biz_level)
+        queue = list(candidates)
+        pending = {}  # task -> model_info
+        loop = asyncio.get_running_loop()
+        next_hedge_at = None
         last_exception = None
-        for model_info in candidates:
-            try:
-                return await self.async_generate_with_specific_model(
-                    prompt=prompt,
-                    model_name=model_info['name'],
-                    temperature=temperature,
-                    top_p=top_p,
-                    max_tokens=max_tokens,
-                    stop=stop,
-                    **kwargs
-                )
-            except Exception as e:
-                last_exception = e
-                continue
-        raise last_exception or Exception("All model attempts failed.") 
\ No newline at end of file
+
+        def launch():
+            nonlocal next_hedge_at
+            model_info = queue.pop(0)
+            # 剩余时间不足时不再对冲或降级到下一个候选
+            check_deadline(self._deadline(), "dispatch", model_info['name'])
+            task = asyncio.ensure_future(self.async_generate_with_specific_model(
+                prompt=prompt,
+                model_name=model_info['name'],
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=max_tokens,
+                stop=stop,
+                route_bucket=route_bucket,
+                **kwargs
+            ))
+            pending[task] = model_info
+            if hedge:
+                next_hedge_at = loop.time() + self._hedge_delay(model_info, hedge_delay_ms)
+
+        try:
+            for _ in range(min(max(int(race_n), 1), len(queue))):
+                launch()
+            while pending:
+                timeout = None
+                if hedge and queue:
+                    timeout = max(0.0, next_hedge_at - loop.time())
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过阈值仍未返回，对冲到下一个候选
+                    logger.info({
+                        "event": "llm_hedge",
+                        "waiting": [m['name'] for m in pending.values()],
+                        "hedge_to": queue[0]['name'],
+                    })
+                    launch()
+                    continue
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_exception = task.exception()
+                    if not self._should_failover(last_exception):
+                        raise last_exception
+                # 失败后补位：顺序模式下切换到下一个候选，竞速模式下保持 N 路并发
+                while queue and len(pending) < max(int(race_n), 1):
+                    launch()
+            raise last_exception or Exception("All model attempts failed.")
+        finally:
+            # 取消落败/多余的请求（single-flight 会在无人等待时取消上游调用）
+            for task in pending:
+                task.cancel()
+
+    def _model_capacity(self, model_name):
+        """模型当前可承受的并发数：优先取准入控制的上限，其次取统计中的 max_concurrency"""
+        gate = self._admission_gate(model_name)
+        if gate is not None:
+            return gate.limit
+        return int(self._stats(model_name).max_concurrency) or 1
+
+    async def async_generate_many(self, prompts, model_name=None, biz_level=None, prefer_cost=None, tags=None, max_retries=BATCH_MAX_RETRIES, **kwargs):
+        """
+        批量生成：异步生成器，按完成顺序逐条产出 {"index", "id", "result"/"error", "used_model", "attempts", ...}。
+        - prompts 元素为字符串，或 {"prompt": ..., "id": ..., 以及 temperature/top_p/max_tokens/stop/truncate 等单条参数}
+        - 每个可用模型启动与其并发上限相同数量的 worker，从共享队列取任务，吞吐按容量自然分摊
+        - 队列按估算 token 数从长到短排序（长任务先发，减少尾部拖尾），worker 只取自己上下文放得下的任务
+        - 单条失败最多重试 max_retries 次，重试时优先换到没失败过的模型；熔断的模型停止取任务
+        """
+        ctx = llm_context.get({})
+        model_name = model_name or ctx.get('model_name')
+        biz_level = biz_level or ctx.get('biz_level')
+        prefer_cost = prefer_cost or ctx.get('prefer_cost')
+        tags = tags or ctx.get('tags')
+        truncate = kwargs.get('truncate') or ctx.get('truncate')
+        items = []
+        for index, p in enumerate(prompts):
+            item = dict(p) if isinstance(p, dict) else {"prompt": p}
+            item["index"] = index
+            item["tokens"] = estimate_messages_tokens([{"role": "user", "content": item.get("prompt") or ""}])
+            item["failed_on"] = set()
+            item["attempts"] = 0
+            items.append(item)
+        if not items:
+            return
+        if model_name:
+            models = self._select_llm_candidates(model_name=model_name)
+            route_bucket = None
+        else:
+            models = self.routing.candidates(tags=tags, biz_level=biz_level, prefer_cost=prefer_cost)
+            route_bucket = self.routing.route_bucket(tags, biz_level)
+        pending = sorted(items, key=lambda it: it["tokens"], reverse=True)
+        results = asyncio.Queue()
+        changed = asyncio.Condition()
+        alive = {m['name'] for m in models}
+        in_flight = 0
+        item_keys = ("temperature", "top_p", "max_tokens", "stop", "truncate", "use_cache")
+
+        def fits(item, model_info):
+            limit = model_info.get('meta', {}).get('max_input_length') or 0
+            item_truncate = item.get("truncate") or truncate
+            return not limit or item_truncate in TRUNCATE_POLICIES or \
+                item["tokens"] * self._stats(model_info['name']).token_factor <= limit
+
+        def take(model_info):
+            # 优先取没在该模型上失败过的最长任务；所有存活模型都失败过的任务也允许再试
+            name = model_info['name']
+            fallback = None
+            for i, item in enumerate(pending):
+                if not fits(item, model_info):
+                    continue
+                if name not in item["failed_on"]:
+                    return pending.pop(i)
+                if fallback is None and alive <= item["failed_on"]:
+                    fallback = i
+            return pending.pop(fallback) if fallback is not None else None
+
+        def finish(item, result=None, error=None):
+            out = {"index": item["index"]}
+            if "id" in item:
+                out["id"] = item["id"]
+            out["attempts"] = item["attempts"]
+            if error is None:
+                out.update(result)
+            else:
+                out["error"] = str(error)
+                out["error_type"] = type(error).__name__
+            results.put_nowait(out)
+
+        async def worker(model_info):
+            nonlocal in_flight
+            name = model_info['name']
+            while True:
+                async with changed:
+                    while True:
+                        if name not in alive:
+                            return
+                        item = take(model_info)
+                        if item is not None or in_flight == 0:
+                            break
+                        # 暂时没有可取的任务，但进行中的任务可能失败后重新入队
+                        await changed.wait()
+                    if item is None:
+                        changed.notify_all()
+                        return
+                    in_flight += 1
+                item["attempts"] += 1
+                params = {k: item[k] for k in item_keys if k in item}
+                try:
+                    result = await self.async_generate_with_specific_model(
+                        prompt=item["prompt"], model_name=name, route_bucket=route_bucket, **{**kwargs, **params})
+                    finish(item, result)
+                except Exception as e:
+                    item["failed_on"].add(name)
+                    retryable = item["attempts"] <= max_retries and not isinstance(e, PromptTooLong) and self._should_failover(e)
+                    if isinstance(e, CircuitOpen):
+                        alive.discard(name)  # 熔断中的模型不再取任务
+                    if retryable:
+                        pending.append(item)
+                        pending.sort(key=lambda it: it["tokens"], reverse=True)
+                    else:
+                        finish(item, error=e)
+                finally:
+                    async with changed:
+                        in_flight -= 1
+                        changed.notify_all()
+
+        workers = [asyncio.ensure_future(worker(m)) for m in models for _ in range(self._model_capacity(m['name']))]
+        done = 0
+        try:
+            while done < len(items):
+                if all(w.done() for w in workers) and results.empty():
+                    # 所有 worker 都已退出：剩余任务没有可用模型
+                    for item in list(pending):
+                        finish(item, error=ValueError("No suitable model available"))
+                    pending.clear()
+                    if results.empty():
+                        break
+                try:
+                    out = await asyncio.wait_for(results.get(), timeout=BATCH_POLL_INTERVAL_SEC)
+                except asyncio.TimeoutError:
+                    continue
+                done += 1
+                yield out
+        finally:
+            for w in workers:
+                w.cancel()
@@ -5,6 +5,8 @@ from datetime import datetime
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
 
+from core.logging_config import logger
+
 """
 llm_info_fetcher.py
 ==================
@@ -163,9 +165,9 @@ class LLMInfoFetcher:
                     "balance": balance,
                     "last_update": datetime.now().isoformat()
                 }
-                print(f"[{name}] cost/balance信息已刷新.")
+                logger.info("[%s] cost/balance信息已刷新.", name)
             except Exception as e:
-                print(f"[{name}] 刷新失败: {e}")
+                logger.warning("[%s] 刷新失败: %s", name, e)
 
     def save_to_yaml(self, file_path: str):
         with open(file_path, "w", encoding="utf-8") as f:
@@ -15,6 +15,7 @@ import httpx
 from datetime import datetime
 import threading
 import time
+import math
 from core.health_checker import QPSMonitor, HealthChecker
 from core.model_router import ModelRouter
 from filelock import FileLock
@@ -22,6 +23,12 @@ import json
 import inspect
 import asyncio
 from adapters.llm_adapter import MultiLLM, llm_context
+from core.admission import AdmissionRejected
+from core.circuit_breaker import CircuitOpen
+from core.token_estimator import PromptTooLong, TRUNCATE_POLICIES, estimate_messages_tokens
+from core.deadline import DEADLINE_HEADER, DeadlineExceeded, deadline_after, resolve_timeout_ms
+from core import tracing
+from core.logging_config import logger, logging_stats
 # 统计功能已移至 core.statistics 模块的函数调用
 from api import prompt_api
 import yaml
@@ -45,7 +52,7 @@ app.add_middleware(
 try:
     app.mount("/docs", StaticFiles(directory="docs"), name="docs")
 except Exception as e:
-    print(f"Warning: Could not mount docs directory: {e}")
+    logger.warning("Could not mount docs directory: %s", e)
 
 app.include_router(prompt_api.router, prefix="/api")
 # app.include_router(prompt_api.router)
@@ -54,9 +61,57 @@ SESSION_COOKIE_NAME = "session_id"
 
 # 全局监控器实例
 qps_monitor = QPSMonitor()
+
+# user_id / app_id 维度的 QPS 配额（可选），格式见 USAGE.md
+RATE_LIMITS_PATH = os.getenv("LLM_RATE_LIMITS_PATH", "rate_limits.yaml")
+if os.path.exists(RATE_LIMITS_PATH):
+    try:
+        with open(RATE_LIMITS_PATH, 'r', encoding='utf-8') as f:
+            qps_monitor.load_quotas(yaml.safe_load(f) or {})
+    except Exception as e:
+        logger.warning("Could not load rate limits from %s: %s", RATE_LIMITS_PATH, e)
+
+# 按插件配置的超长截断策略（可选）：{"default": "reject", "plugins": {"插件名": "tail"}}
+TRUNCATION_POLICIES_PATH = os.getenv("LLM_TRUNCATION_POLICIES_PATH", "truncation_policies.yaml")
+plugin_truncation_policies = {}
+if os.path.exists(TRUNCATION_POLICIES_PATH):
+    try:
+        with open(TRUNCATION_POLICIES_PATH, 'r', encoding='utf-8') as f:
+            plugin_truncation_policies = yaml.safe_load(f) or {}
+    except Exception as e:
+        logger.warning("Could not load truncation policies from %s: %s", TRUNCATION_POLICIES_PATH, e)
+
+def plugin_truncation_policy(plugin_name):
+    policies = plugin_truncation_policies.get("plugins") or {}
+    return policies.get(plugin_name, plugin_truncation_policies.get("default"))
+
+# 各接口默认的请求超时（ms），0 表示不限制；客户端可用 X-Request-Timeout-Ms 请求头或 timeout_ms 字段指定
+# 截止时间写入 llm_context，之后的排队、上游调用、重试与降级都只使用剩余时间
+ENDPOINT_TIMEOUT_MS = {
+    "llm_invoke": int(os.getenv("LLM_INVOKE_TIMEOUT_MS", "300000")),
+    "llm_invoke_batch": int(os.getenv("LLM_INVOKE_BATCH_TIMEOUT_MS", "0")),
+    "plugin_invoke": int(os.getenv("LLM_PLUGIN_INVOKE_TIMEOUT_MS", "600000")),
+}
+
+# /llm_invoke_batch 请求体（NDJSON）的大小上限，边读边解析，超过时返回 413
+BATCH_MAX_BODY_BYTES = int(os.getenv("LLM_BATCH_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+
+def request_deadline(endpoint, request: Request = None, timeout_ms=None):
+    header = request.headers.get(DEADLINE_HEADER) if request is not None else None
+    return deadline_after(resolve_timeout_ms(header, timeout_ms, ENDPOINT_TIMEOUT_MS.get(endpoint, 0)))
+
+def deadline_exceeded_response(e: DeadlineExceeded):
+    return JSONResponse(content={"error": "Deadline exceeded", "stage": e.stage, "model": e.model_name}, status_code=504)
+
+# 流式响应发出响应头后出错时，以该前缀开头的一行 JSON 结束响应体
+STREAM_ERROR_PREFIX = "[stream_error] "
+
+def stream_error_trailer(content: dict) -> str:
+    return "\n" + STREAM_ERROR_PREFIX + json.dumps(content, ensure_ascii=False) + "\n"
+
 health_checker = None  # 启动时初始化
 
-router = ModelRouter(lambda: llm_manager.models)
+router = ModelRouter(lambda: llm_manager.routing)
 
 SERVICE_REGISTRY_FILE = "service_registry.json"
 SERVICE_REGISTRY_LOCK = "service_registry.json.lock"
@@ -85,6 +140,11 @@ def negotiate_locale(request: Request) -> str:
         return "en"
     return "zh-CN"
 
+@app.exception_handler(DeadlineExceeded)
+async def handle_deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    # 插件等未单独处理的路径：截止时间已到统一返回 504（只对尚未发出响应头的请求有效，流式响应见 prepend_chunk）
+    return deadline_exceeded_response(exc)
+
 @app.middleware("http")
 async def language_negotiation(request: Request, call_next):
     try:
@@ -130,6 +190,9 @@ class LLMInvokeRequest(BaseModel):
     top_p: float | None = None
     max_tokens: int | None = None
     stop: list[str] | None = None
+    use_cache: bool | None = None  # False 时跳过响应缓存
+    truncate: str | None = None  # 超过模型输入上限时的截断策略：head/tail/middle，默认直接拒绝
+    timeout_ms: int | None = None  # 请求超时（ms），也可用 X-Request-Timeout-Ms 请求头，默认见 ENDPOINT_TIMEOUT_MS
 
 class ManageLLMRequest(BaseModel):
     action: Literal['add', 'update', 'delete']
@@ -216,22 +279,19 @@ async def set_preferred_model(request: Request, response: Response, preferred_mo
         session_id = str(uuid.uuid4())
         response.set_cookie(key=SESSION_COOKIE_NAME, value=session_id)
     model_name_to_find = preferred_model_info.model_name
-    preferred_index = -1
     global llm_manager
-    for i, model in enumerate(llm_manager.models):
-        if model["name"] == model_name_to_find:
-            preferred_index = i
-            break
-    if preferred_index != -1:
+    snapshot = llm_manager.registry.snapshot
+    preferred_index = snapshot.index_of(model_name_to_find)
+    if preferred_index is not None:
         state_manager.set_preferred_model_index(session_id, preferred_index)
         try:
-            model_info = llm_manager.models[preferred_index]
+            model_info = snapshot.models[preferred_index]
             # 同步客户端已经预先创建，异步客户端按需创建
             if model_info.get("sync_client") is None:
-                print(f"[api:/set_preferred_model] 警告: 模型 {model_name_to_find} 的同步客户端未正确初始化", flush=True)
+                logger.warning("[api:/set_preferred_model] 模型 %s 的同步客户端未正确初始化", model_name_to_find)
             # 异步客户端按需创建，这里不检查
         except Exception as e:
-            print(f"[api:/set_preferred_model] Could not verify client: {e}", flush=True)
+            logger.warning("[api:/set_preferred_model] Could not verify client: %s", e)
         return JSONResponse(content={
             "message": f"Preferred model set to {model_name_to_find} for session {session_id}.",
             "preferred_model_index": preferred_index,
@@ -244,21 +304,116 @@ async def set_preferred_model(request: Request, response: Response, preferred_mo
             "session_id": session_id
         }, status_code=404)
 
-def llm_stream_generator(prompt, model_name, temperature=None, top_p=None, max_tokens=None, stop=None, user_id=None, app_id=None):
+@app.post("/llm_invoke_batch")
+async def LLM_invoke_batch(request: Request, model_name: str = Query(None), tags: str = Query(None),
+                           biz_level: str = Query(None), prefer_cost: str = Query(None),
+                           user_id: str = Query(None), app_id: str = Query(None),
+                           max_retries: int = Query(None), truncate: str = Query(None), timeout_ms: int = Query(None)):
+    """
+    批量调用：请求体为 NDJSON，每行一个 {"prompt": ..., "id": ..., 可选 temperature/top_p/max_tokens/stop/truncate}
+    （或直接是 prompt 字符串）；路由参数走 query（tags 逗号分隔）。
+    结果按完成顺序以 NDJSON 流式返回，每行带 index（输入行序号，从 0 开始）与 id。
+    截止时间作用于整批：到期后未完成的条目以 DeadlineExceeded 错误返回。
+    请求体边读边解析（上限 BATCH_MAX_BODY_BYTES）；每个条目消耗一次 user_id/app_id 配额，整批不够时返回 429。
+    """
     global llm_manager
-    # 如果llm有原生流式方法，优先用
-    if hasattr(llm_manager, 'generate_stream_with_specific_model'):
-        yield from llm_manager.generate_stream_with_specific_model(
+    if truncate and truncate not in TRUNCATE_POLICIES:
+        return invalid_truncate_response(truncate)
+    items, error = await read_batch_items(request)
+    if error is not None:
+        return error
+    if model_name and llm_manager.registry.snapshot.get(model_name) is None:
+        return JSONResponse(content={"error": f"Model {model_name} not found"}, status_code=404)
+    # 每个条目按一次调用消耗 user/app 配额，整批不够时直接拒绝，不会部分执行
+    allowed, scope, retry_after = qps_monitor.acquire_quota(user_id, app_id, len(items))
+    if not allowed:
+        if retry_after is None:
+            return JSONResponse(content={"error": f"Batch of {len(items)} items exceeds the {scope} quota burst, split it", "scope": scope},
+                                status_code=429)
+        return JSONResponse(content={"error": f"QPS limit exceeded for {scope}", "scope": scope}, status_code=429,
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+    options = {"max_retries": max_retries} if max_retries is not None else {}
+    if truncate:
+        options["truncate"] = truncate
+    llm_context.set({"deadline": request_deadline("llm_invoke_batch", request, timeout_ms)})
+
+    async def result_lines():
+        from core.statistics import record_model_cost_user_app
+        async for out in llm_manager.async_generate_many(
+            items,
+            model_name=model_name,
+            tags=[t for t in tags.split(",") if t] if tags else None,
+            biz_level=biz_level,
+            prefer_cost=prefer_cost,
+            **options,
+        ):
+            if out.get("used_model"):
+                record_model_cost_user_app(out["used_model"], user_id, app_id, out.get("cost") or 0.0)
+            yield json.dumps(out, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+def invalid_truncate_response(truncate):
+    return JSONResponse(content={"error": f"Invalid truncate policy: {truncate}", "allowed": list(TRUNCATE_POLICIES)}, status_code=400)
+
+def parse_batch_line(line: bytes, line_no: int):
+    """解析 NDJSON 的一行，返回 (item, 错误信息)；空行返回 (None, None)"""
+    line = line.strip()
+    if not line:
+        return None, None
+    try:
+        item = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        return None, f"Invalid JSON on line {line_no}: {e}"
+    if isinstance(item, str):
+        item = {"prompt": item}
+    if not isinstance(item, dict) or not isinstance(item.get("prompt"), str):
+        return None, f"Line {line_no} must contain a string prompt"
+    if item.get("truncate") and item["truncate"] not in TRUNCATE_POLICIES:
+        return None, f"Invalid truncate policy on line {line_no}: {item['truncate']}"
+    return item, None
+
+async def read_batch_items(request: Request):
+    """边接收边按行解析批量请求体，不整体缓冲；返回 (items, 错误响应)"""
+    items = []
+    size = 0
+    line_no = 0
+    pending = b""
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BATCH_MAX_BODY_BYTES:
+            return None, JSONResponse(content={"error": f"Batch body exceeds {BATCH_MAX_BODY_BYTES} bytes"}, status_code=413)
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            line_no += 1
+            item, error = parse_batch_line(line, line_no)
+            if error:
+                return None, JSONResponse(content={"error": error}, status_code=400)
+            if item is not None:
+                items.append(item)
+    item, error = parse_batch_line(pending, line_no + 1)
+    if error:
+        return None, JSONResponse(content={"error": error}, status_code=400)
+    if item is not None:
+        items.append(item)
+    return items, None
+
+async def llm_stream_generator(prompt, model_name, temperature=None, top_p=None, max_tokens=None, stop=None, user_id=None, app_id=None):
+    global llm_manager
+    # 优先用原生异步流式方法：token 在事件循环中直接转发，不占用线程池线程
+    if hasattr(llm_manager, 'async_generate_stream'):
+        async for chunk in llm_manager.async_generate_stream(
             prompt=prompt,
             model_name=model_name,
             temperature=temperature,
             top_p=top_p,
             max_tokens=max_tokens,
             stop=stop
-        )
+        ):
+            yield chunk
     else:
         # 兼容：一次性返回全部内容
-        result_obj = llm_manager.generate_with_specific_model(
+        result_obj = await llm_manager.async_generate_with_specific_model(
             prompt=prompt,
             model_name=model_name,
             temperature=temperature,
@@ -271,12 +426,42 @@ def llm_stream_generator(prompt, model_name, temperature=None, top_p=None, max_t
         record_model_cost_user_app(model_name, user_id, app_id, result_obj.get("cost") or 0.0)
         yield result_obj.get("result")
 
+async def prepend_chunk(first, stream_gen):
+    """
+    把预先取出的第一个片段接回流的开头；响应结束或客户端断开时关闭原生成器。
+    响应头发出后状态码已无法修改：截止时间已到或上游中断时记录日志，以一行错误尾标正常结束响应体。
+    """
+    try:
+        if first is not None:
+            yield first
+        async for chunk in stream_gen:
+            yield chunk
+    except DeadlineExceeded as e:
+        logger.warning("[LLM_invoke] 流式响应中途超过截止时间: stage=%s, model=%s", e.stage, e.model_name)
+        yield stream_error_trailer({"error": "Deadline exceeded", "stage": e.stage, "model": e.model_name})
+    except Exception as e:
+        logger.error("[LLM_invoke] 流式响应中途失败: %s", e, exc_info=True)
+        yield stream_error_trailer({"error": "Model invocation failed", "details": str(e)})
+    finally:
+        await stream_gen.aclose()
+
+def _check_qps(model, user_id=None, app_id=None):
+    """按模型、user_id、app_id 三个维度消耗令牌，超限时返回 429 响应"""
+    allowed, scope, retry_after = qps_monitor.acquire(
+        model["name"], model.get("qps", 0), user_id=user_id, app_id=app_id,
+        burst=(model.get("meta") or {}).get("qps_burst"))
+    if allowed:
+        return None
+    errors = {"model": "QPS limit exceeded for model", "user": "QPS limit exceeded for user", "app": "QPS limit exceeded for app"}
+    return JSONResponse(content={"error": errors[scope], "model": model["name"], "scope": scope},
+                        status_code=429, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
 @app.post("/llm_invoke")
-async def LLM_invoke(request: LLMInvokeRequest, stream: bool = Query(False), session_id: str = Cookie(None)):
-    print(f"[LLM_invoke] 收到请求: prompt='{request.prompt[:50]}...', model_name='{request.model_name}', stream={stream}")
-    print(session_id)
-    # --- 自动设置 LLM 路由上下文 ---
-    llm_context.set(request.dict())
+async def LLM_invoke(request: LLMInvokeRequest, http_request: Request, stream: bool = Query(False), session_id: str = Cookie(None)):
+    logger.debug("[LLM_invoke] 收到请求: prompt='%s...', model_name='%s', stream=%s", request.prompt[:50], request.model_name, stream)
+    logger.debug("[LLM_invoke] session_id: %s", session_id)
+    # --- 自动设置 LLM 路由上下文（含本次请求的截止时间） ---
+    llm_context.set({**request.dict(), "deadline": request_deadline("llm_invoke", http_request, request.timeout_ms)})
     prompt = request.prompt
     model_name = request.model_name
     tags = request.tags
@@ -291,32 +476,33 @@ async def LLM_invoke(request: LLMInvokeRequest, stream: bool = Query(False), ses
     used_model = None
 
     global llm_manager
+    if request.truncate and request.truncate not in TRUNCATE_POLICIES:
+        return invalid_truncate_response(request.truncate)
 
     # todo 251020 首选会话中的模型设置
     # 如果没有指定模型，则尝试使用会话中的首选模型
     target_model_name = None
+    route_bucket = None  # 自动路由时的老虎机分桶，调用结束后据此回报奖励
 
     if model_name:
         # 如果请求中明确指定了模型，使用指定的模型
         target_model_name = model_name
-        print(f"[LLM_invoke] 使用请求指定的模型: {target_model_name}")
+        logger.debug("[LLM_invoke] 使用请求指定的模型: %s", target_model_name)
     elif session_id:
         # 如果没有指定模型，使用会话的首选模型
         preferred_index = state_manager.get_preferred_model_index(session_id)
         if preferred_index is not None and 0 <= preferred_index < len(llm_manager.models):
             target_model_name = llm_manager.models[preferred_index]["name"]
-            print(f"[LLM_invoke] 使用会话 {session_id} 的首选模型: {target_model_name}")
+            logger.debug("[LLM_invoke] 使用会话 %s 的首选模型: %s", session_id, target_model_name)
 
     try:
         # 如果通过以上逻辑确定了目标模型
         if target_model_name:
-            idx = next((i for i, m in enumerate(llm_manager.models) if m["name"] == target_model_name), None)
-            if idx is not None:
-                model = llm_manager.models[idx]
-                if qps_monitor.is_limited(target_model_name, model.get("qps", 0)):
-                    return JSONResponse(content={"error": "QPS limit exceeded for model", "model": target_model_name},
-                                        status_code=429)
-                qps_monitor.record(target_model_name)
+            model = llm_manager.registry.snapshot.get(target_model_name)
+            if model is not None:
+                limited = _check_qps(model, user_id, app_id)
+                if limited:
+                    return limited
                 if health_checker:
                     health_checker.notify_model_active(target_model_name)
             else:
@@ -324,12 +510,15 @@ async def LLM_invoke(request: LLMInvokeRequest, stream: bool = Query(False), ses
         else:
             # 如果既没有指定模型也没有会话首选模型，使用路由选择
             try:
-                model = router.select_model(tags=tags, biz_level=biz_level, prefer_cost=prefer_cost)
+                # 预估输入长度，排除上下文放不下的模型（配置了截断策略时允许退回到全部候选）
+                prompt_tokens = estimate_messages_tokens([{"role": "user", "content": prompt}])
+                model = router.select_model(tags=tags, biz_level=biz_level, prefer_cost=prefer_cost,
+                                            prompt_tokens=prompt_tokens, allow_overflow=request.truncate in TRUNCATE_POLICIES)
                 target_model_name = model["name"]
-                if qps_monitor.is_limited(target_model_name, model.get("qps", 0)):
-                    return JSONResponse(content={"error": "QPS limit exceeded for model", "model": target_model_name},
-                                        status_code=429)
-                qps_monitor.record(target_model_name)
+                route_bucket = router.route_bucket(tags=tags, biz_level=biz_level)
+                limited = _check_qps(model, user_id, app_id)
+                if limited:
+                    return limited
                 if health_checker:
                     health_checker.notify_model_active(target_model_name)
             except Exception as e:
@@ -337,28 +526,33 @@ async def LLM_invoke(request: LLMInvokeRequest, stream: bool = Query(False), ses
 
         # 成本统计初始化（已移至新的统计系统）
         if stream:
-            def stream_gen():
-                yield from llm_stream_generator(
-                    prompt=prompt,
-                    model_name=target_model_name,  # 使用修正后的模型名称
-                    temperature=temperature,
-                    top_p=top_p,
-                    max_tokens=max_tokens,
-                    stop=stop,
-                    user_id=user_id,
-                    app_id=app_id
-                )
-
-            return StreamingResponse(stream_gen(), media_type="text/plain")
+            stream_gen = llm_stream_generator(
+                prompt=prompt,
+                model_name=target_model_name,  # 使用修正后的模型名称
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=max_tokens,
+                stop=stop,
+                user_id=user_id,
+                app_id=app_id
+            )
+            # 先取出第一个片段再发送响应头：排队失败、熔断、输入超长、截止时间等错误发生在首个 token 之前，
+            # 由下面的 except 映射为 429/503/413/504，而不是在 200 之后中途截断响应体
+            try:
+                first = await stream_gen.__anext__()
+            except StopAsyncIteration:
+                first = None
+            return StreamingResponse(prepend_chunk(first, stream_gen), media_type="text/plain")
 
-        # 非流式同步返回
-        result_obj = llm_manager.generate_with_specific_model(
+        # 非流式：走 AsyncOpenAI，等待上游期间不阻塞事件循环
+        result_obj = await llm_manager.async_generate_with_specific_model(
             prompt=prompt,
             model_name=target_model_name,  # 使用修正后的模型名称
             temperature=temperature,
             top_p=top_p,
             max_tokens=max_tokens,
-            stop=stop
+            stop=stop,
+            route_bucket=route_bucket,
         )
         used_model = target_model_name  # 使用修正后的模型名称
 
@@ -375,6 +569,30 @@ async def LLM_invoke(request: LLMInvokeRequest, stream: bool = Query(False), ses
             "app_id": app_id
         })
 
+    except AdmissionRejected as e:
+        # 模型并发已满且排队失败
+        return JSONResponse(
+            content={"error": "Model is overloaded", "model": e.model_name, "reason": e.reason},
+            status_code=429,
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
+    except CircuitOpen as e:
+        # 模型熔断中，冷却结束前不再请求上游
+        return JSONResponse(
+            content={"error": "Model circuit is open", "model": e.model_name},
+            status_code=503,
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+    except PromptTooLong as e:
+        # 预检发现输入超过模型上限，且请求未指定截断策略
+        return JSONResponse(
+            content={"error": "Prompt too long", "model": e.model_name,
+                     "estimated_tokens": e.estimated_tokens, "max_input_length": e.max_input_tokens},
+            status_code=413,
+        )
+    except DeadlineExceeded as e:
+        # 截止时间内无法完成（排队、上游调用或降级时剩余时间耗尽）
+        return deadline_exceeded_response(e)
     except ValueError as e:
         return JSONResponse(
             content={
@@ -520,24 +738,24 @@ def start_plugin_hot_reload(app, interval=None):
                     scan_and_register_plugins(app)
                     last_dir_mtime = current_mtime
             except Exception as e:
-                print(f"[PluginHotReload] Error: {e}")
+                logger.warning("[PluginHotReload] Error: %s", e)
             time.sleep(interval)
     t = threading.Thread(target=reload_loop, daemon=True)
     t.start()
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def dynamic_router(request: Request, path: str):
-    print(f"[dynamic_router] 收到请求: {request.method} /{path}", flush=True)
-    print(f"[dynamic_router] service_registry keys: {list(service_registry.keys())}", flush=True)
+    logger.debug("[dynamic_router] 收到请求: %s /%s", request.method, path)
+    logger.debug("[dynamic_router] service_registry keys: %s", list(service_registry.keys()))
     
     # 排除 /api 路径，让它们由其他路由处理
     if path.startswith("api/"):
-        print(f"[dynamic_router] 跳过 /api 路径: {path}", flush=True)
+        logger.debug("[dynamic_router] 跳过 /api 路径: %s", path)
         return JSONResponse(content={"error": "API path not handled by dynamic router"}, status_code=404)
     
     # 排除 /prompts 路径，让它们由 prompt_api 处理
     if path.startswith("prompts/"):
-        print(f"[dynamic_router] 跳过 /prompts 路径: {path}", flush=True)
+        logger.debug("[dynamic_router] 跳过 /prompts 路径: %s", path)
         return JSONResponse(content={"error": "Prompts path not handled by dynamic router"}, status_code=404)
     
     if path in service_registry:
@@ -550,20 +768,23 @@ async def dynamic_router(request: Request, path: str):
             headers = {k: v for k, v in request.headers.items() if k.lower() not in excluded_headers}
             body = await request.body()
             # 日志可选保留
-            print("[dynamic_router] method:", request.method)
-            print("[dynamic_router] headers:", headers)
-            print("[dynamic_router] body length:", len(body))
+            logger.debug("[dynamic_router] method: %s", request.method)
+            logger.debug("[dynamic_router] headers: %s", headers)
+            logger.debug("[dynamic_router] body length: %s", len(body))
             # 保证body为bytes类型
             if isinstance(body, str):
                 body = body.encode("utf-8")
             async with httpx.AsyncClient() as client:
-                proxy_request = client.build_request(
-                    method=request.method,
-                    url=url,
-                    headers=headers,
-                    content=body
-                )
-                response = await client.send(proxy_request)
+                with tracing.span("proxy", tracing.CLIENT, service=path, **{"http.url": url, "http.method": request.method}) as span:
+                    proxy_request = client.build_request(
+                        method=request.method,
+                        url=url,
+                        headers=tracing.inject_headers(headers),
+                        content=body
+                    )
+                    response = await client.send(proxy_request)
+                    if span is not None:
+                        span.set(**{"http.status_code": response.status_code})
                 
                 # 记录注册服务调用历史
                 try:
@@ -598,9 +819,9 @@ async def dynamic_router(request: Request, path: str):
                             "content": response_body
                         }
                     })
-                    print(f"[dynamic_router] History recorded for {path}")
+                    logger.debug("[dynamic_router] History recorded for %s", path)
                 except Exception as history_error:
-                    print(f"[dynamic_router] History recording error: {history_error}", flush=True)
+                    logger.warning("[dynamic_router] History recording error: %s", history_error)
                 
                 return Response(
                     content=response.content,
@@ -609,17 +830,23 @@ async def dynamic_router(request: Request, path: str):
                     media_type=response.headers.get("content-type")
                 )
         except Exception as e:
-            print(f"[dynamic_router] Proxy error: {e}\n{traceback.format_exc()}", flush=True)
+            logger.warning("[dynamic_router] Proxy error: %s", e, exc_info=True)
             return JSONResponse(content={"error": "Proxy error", "details": str(e)}, status_code=500)
     return JSONResponse(content={"error": "Not found"}, status_code=404)
 
 @app.middleware("http")
 async def add_request_id(request: Request, call_next):
     request.state.request_id = str(uuid.uuid4())
-    print(f"[middleware] 收到请求: {request.method} {request.url.path}", flush=True)
-    response = await call_next(request)
+    logger.debug("[middleware] 收到请求: %s %s", request.method, request.url.path)
+    # 服务端 span：沿用调用方的 traceparent，流式响应只计到响应头返回
+    with tracing.span(f"{request.method} {request.url.path}", tracing.SERVER, request.headers.get(tracing.TRACEPARENT_HEADER),
+                      **{"http.method": request.method, "http.target": request.url.path, "request_id": request.state.request_id}) as span:
+        response = await call_next(request)
+        if span is not None:
+            span.set(**{"http.status_code": response.status_code})
+            response.headers["X-Trace-ID"] = span.trace_id
     response.headers["X-Request-ID"] = request.state.request_id
-    print(f"[middleware] 响应状态: {response.status_code}", flush=True)
+    logger.debug("[middleware] 响应状态: %s", response.status_code)
     return response
 
 @app.get("/get_model_health")
@@ -677,9 +904,7 @@ def start_health_checker():
         global llm_manager
         if llm_manager is None:
             return
-        for m in llm_manager.models:
-            if m["name"] == model_name:
-                m.update(meta)
+        llm_manager.update_model_health(model_name, meta)
     def check_func(model):
         health_url = model.get("health_check")
         try:
@@ -756,18 +981,40 @@ async def service_discovery_list():
         "plugin_abilities": plugins
     })
 
-async def batch_concurrent(items, handler, max_concurrency=10):
-    sem = asyncio.Semaphore(max_concurrency)
-    async def sem_handler(item):
-        async with sem:
+async def batch_concurrent(items, handler, max_concurrency=None):
+    # max_concurrency 为 None 时跟随目标模型（未指定则为全部可路由模型）的实时自适应并发上限
+    first = items[0] if items and isinstance(items[0], dict) else {}
+    def current_limit():
+        if max_concurrency:
+            return max_concurrency
+        return llm_manager.concurrency_budget(first.get("model_name")) if llm_manager else 10
+    cond = asyncio.Condition()
+    running = 0
+    async def sem_handler(index, item):
+        with tracing.span("batch_item", index=index):
+            return await run_item(item)
+    async def run_item(item):
+        nonlocal running
+        wait_start = time.perf_counter()
+        async with cond:
+            await cond.wait_for(lambda: running < current_limit())
+            running += 1
+        tracing.set_attributes(wait_ms=round((time.perf_counter() - wait_start) * 1000, 3))
+        try:
             ctx = contextvars.copy_context()
             async def run_with_ctx():
                 if isinstance(item, dict):
                     llm_params = {}
-                    for k in ["model_name", "temperature", "tags", "biz_level", "prefer_cost", "session_id", "preferred_index", "top_p", "max_tokens", "stop"]:
+                    for k in ["model_name", "temperature", "tags", "biz_level", "prefer_cost", "session_id", "preferred_index", "top_p", "max_tokens", "stop", "hedge", "hedge_delay_ms", "race_n", "truncate"]:
                         if k in item:
                             llm_params[k] = item[k]
                     if llm_params:
+                        # 插件级截断策略来自外层上下文，单条参数未指定时沿用；截止时间始终沿用外层
+                        outer = llm_context.get({})
+                        if outer.get("truncate") and "truncate" not in llm_params:
+                            llm_params["truncate"] = outer["truncate"]
+                        if outer.get("deadline"):
+                            llm_params["deadline"] = outer["deadline"]
                         llm_context.set(llm_params)
                 if asyncio.iscoroutinefunction(handler):
                     return await handler(**item) if isinstance(item, dict) else await handler(item)
@@ -777,7 +1024,11 @@ async def batch_concurrent(items, handler, max_concurrency=10):
                 return await ctx.run(run_with_ctx)
             else:
                 return ctx.run(run_with_ctx)
-    return await asyncio.gather(*(sem_handler(item) for item in items))
+        finally:
+            async with cond:
+                running -= 1
+                cond.notify_all()
+    return await asyncio.gather(*(sem_handler(i, item) for i, item in enumerate(items)))
 
 history_records = []
 
@@ -879,17 +1130,20 @@ history_records = []
 
 
 @app.post("/plugin/invoke")
+@tracing.traced("plugin_invoke")
 async def plugin_invoke(
         plugin_name: str,
         model_name: str = Body(None),
         payload: dict = Body(None),
         batch_payload: list = Body(None),
         request: Request = None,
-        session_id: str = Cookie(None)
+        session_id: str = Cookie(None),
+        timeout_ms: int = Body(None)
 ):
     # --- 自动设置 LLM 路由上下文 ---
     llm_params = {}
-    print(f"当前传入的model_name: {model_name}")
+    tracing.set_attributes(plugin=plugin_name, batch_size=len(batch_payload) if batch_payload else 1)
+    logger.debug("当前传入的model_name: %s", model_name)
     # 优先从 session 读取 preferred_index
     sid = session_id or (request.cookies.get("session_id") if request else None)
     preferred_index = None
@@ -923,13 +1177,17 @@ async def plugin_invoke(
             first_item = batch_payload[0]
             # 只提取LLM相关参数，排除内容参数
             llm_related_keys = ["temperature", "top_p", "max_tokens", "stop", "tags", "biz_level", "prefer_cost",
-                                "user_id", "app_id"]
+                                "user_id", "app_id", "hedge", "hedge_delay_ms", "race_n", "truncate"]
             for key in llm_related_keys:
                 if key in first_item:
                     context_params[key] = first_item[key]
+        # 插件级截断策略（请求未显式指定时生效）
+        if "truncate" not in context_params and plugin_truncation_policy(plugin_name):
+            context_params["truncate"] = plugin_truncation_policy(plugin_name)
+        context_params["deadline"] = request_deadline("plugin_invoke", request, timeout_ms)
 
         llm_context.set(context_params)
-        print(f"========{context_params}=========")
+        logger.debug("========%s=========", context_params)
 
     if not PLUGINS_BATCH_DISPATCH_ENABLED:
         return JSONResponse(content={"error": "插件批量分发功能已关闭"}, status_code=403)
@@ -965,7 +1223,7 @@ async def plugin_invoke(
                 return {"result": result[0]["result"] if isinstance(result, list) and len(result) == 1 else result}
             return {"result": result}
         else:
-            results = await batch_concurrent(batch_payload, plugin_func, max_concurrency=5)
+            results = await batch_concurrent(batch_payload, plugin_func)
 
             # 记录历史
             history_records.append({
@@ -998,18 +1256,35 @@ def init_llm_manager():
     if llm_manager is None:
         llm_manager = MultiLLM()
         # 预先创建所有模型的同步客户端，减少首次调用延迟
-        print("[init_llm_manager] 开始预先创建所有模型的同步客户端...", flush=True)
+        logger.info("[init_llm_manager] 开始预先创建所有模型的同步客户端...")
         for i, model_info in enumerate(llm_manager.models):
             try:
                 # 只创建同步客户端，异步客户端按需创建
                 if model_info.get("sync_client") is None:
                     llm_manager._get_sync_client(model_info)
-                    print(f"[init_llm_manager] 成功创建同步客户端: {model_info['name']}", flush=True)
+                    logger.debug("[init_llm_manager] 成功创建同步客户端: %s", model_info['name'])
                         
             except Exception as e:
-                print(f"[init_llm_manager] 创建同步客户端失败: {model_info['name']}, 错误: {e}", flush=True)
+                logger.warning("[init_llm_manager] 创建同步客户端失败: %s, 错误: %s", model_info['name'], e)
         
-        print(f"[init_llm_manager] 同步客户端预创建完成，共处理 {len(llm_manager.models)} 个模型", flush=True)
+        logger.info("[init_llm_manager] 同步客户端预创建完成，共处理 %s 个模型", len(llm_manager.models))
+
+@app.on_event("startup")
+async def warm_up_llm_connections():
+    # 同步与异步连接池并行预热，首批请求不再承担 DNS/TCP/TLS 建连耗时
+    if llm_manager is None:
+        return
+    start = time.time()
+    sync_result, async_result = await asyncio.gather(
+        asyncio.to_thread(llm_manager.warm_up),
+        llm_manager.async_warm_up(),
+    )
+    logger.info("[warm_up_llm_connections] 连接预热完成，耗时 %.2fs，同步: %s，异步: %s", time.time() - start, sync_result, async_result)
+
+@app.on_event("shutdown")
+async def close_llm_connections():
+    if llm_manager is not None:
+        await llm_manager.aclose()
 
 @app.get("/llm_status")
 def get_llm_status(model: str = Query(None)):
@@ -1017,6 +1292,19 @@ def get_llm_status(model: str = Query(None)):
     global llm_manager
     import core.statistics
     from datetime import datetime, timedelta
+    # 各分支共用的运行时组件状态
+    extras = {
+        "cache": llm_manager.response_cache.stats() if llm_manager.response_cache else None,
+        "single_flight": llm_manager.single_flight.stats() if llm_manager.single_flight else None,
+        "admission": llm_manager.admission.snapshot() if llm_manager.admission else None,
+        "circuit_breakers": llm_manager.circuit_breakers.snapshot() if llm_manager.circuit_breakers else None,
+        "http_pools": llm_manager.client_pool.stats() if llm_manager.client_pool else None,
+        "concurrency_limits": llm_manager.concurrency_limits.snapshot() if llm_manager.concurrency_limits else None,
+        "bandit": llm_manager.bandit.snapshot() if llm_manager.bandit else None,
+        "retry": llm_manager.retry_policy.snapshot() if llm_manager.retry_policy else None,
+        "logging": logging_stats(),
+        "tracing": tracing.exporter.snapshot(),
+    }
     try:
         history = getattr(core.statistics, 'model_call_history', None)
         if history:
@@ -1036,16 +1324,16 @@ def get_llm_status(model: str = Query(None)):
                 if t in dates:
                     idx = dates.index(t)
                     calls[idx] += 1
-            return {"llm_status": llm_manager.llm_status, "dates": dates, "calls": calls}
+            return {"llm_status": llm_manager.llm_status, "dates": dates, "calls": calls, **extras}
         else:
             # 没有历史，直接返回累计
             if model:
                 total = core.statistics.model_hit_counter.get(model, 0)
             else:
                 total = sum(core.statistics.model_hit_counter.values())
-            return {"llm_status": llm_manager.llm_status, "dates": ["累计"], "calls": [total]}
+            return {"llm_status": llm_manager.llm_status, "dates": ["累计"], "calls": [total], **extras}
     except Exception as e:
-        return {"llm_status": llm_manager.llm_status, "dates": [], "calls": []}
+        return {"llm_status": llm_manager.llm_status, "dates": [], "calls": [], **extras}
 
 def load_llm_models():
     with open(LLM_YAML_PATH, 'r', encoding='utf-8') as f:
@@ -1067,7 +1355,7 @@ def add_llm(model: dict = Body(...)):
     qps = meta.get('qps', model.get('qps', 0))
     cost = meta.get('cost', model.get('cost', 0.0))
     # 兼容前端传来的高级元数据字段
-    max_input_length = model.get('max_input_length', meta.get('max_input_length', 2048))
+    max_input_length = model.get('max_input_length', meta.get('max_input_length', 0))
     supported_tasks = model.get('supported_tasks', meta.get('supported_tasks', []))
     languages = model.get('languages', meta.get('languages', []))
     effect_score = model.get('effect_score', meta.get('effect_score', 5.0))
@@ -1094,9 +1382,9 @@ def add_llm(model: dict = Body(...)):
         return JSONResponse(content={'error': '模型已存在'}, status_code=400)
     models.append(model)
     save_llm_models(models)
-    # 热重载
-    if hasattr(globals(), 'llm_manager') and llm_manager:
-        llm_manager.__init__()
+    # 热重载：原子替换模型注册表，进行中的请求继续使用旧快照
+    if llm_manager:
+        llm_manager.reload()
     return {'success': True}
 
 @app.post('/api/llm/update')
@@ -1106,7 +1394,7 @@ def update_llm(model: dict = Body(...)):
         if m['name'] == model['name']:
             # 兼容前端传来的高级元数据字段
             meta = m.get('meta', {})
-            meta['max_input_length'] = model.get('max_input_length', meta.get('max_input_length', 2048))
+            meta['max_input_length'] = model.get('max_input_length', meta.get('max_input_length', 0))
             meta['supported_tasks'] = model.get('supported_tasks', meta.get('supported_tasks', []))
             meta['languages'] = model.get('languages', meta.get('languages', []))
             meta['effect_score'] = model.get('effect_score', meta.get('effect_score', 5.0))
@@ -1125,8 +1413,8 @@ def update_llm(model: dict = Body(...)):
             m['url'] = model.get('url', m.get('url', ''))
             m['key'] = model.get('key', m.get('key', ''))
             save_llm_models(models)
-            if hasattr(globals(), 'llm_manager') and llm_manager:
-                llm_manager.__init__()
+            if llm_manager:
+                llm_manager.reload()
             return {'success': True}
     return JSONResponse(content={'error': '模型不存在'}, status_code=404)
 
@@ -1135,8 +1423,8 @@ def delete_llm(model: dict = Body(...)):
     models = load_llm_models()
     models = [m for m in models if m['name'] != model['name']]
     save_llm_models(models)
-    if hasattr(globals(), 'llm_manager') and llm_manager:
-        llm_manager.__init__()
+    if llm_manager:
+        llm_manager.reload()
     return {'success': True}
 
 @app.get("/api/readme/sections")
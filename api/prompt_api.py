@@ -4,6 +4,8 @@ import os
 
 from filelock import FileLock
 
+from core.logging_config import logger
+
 PROMPT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config_prompts')
 router = APIRouter()
 
@@ -77,13 +79,13 @@ def save_prompt_file(name: str = Body(...), content: str = Body(...)):
 
                 if os.path.exists(backup_path):
                     os.remove(backup_path)
-                    print(f"[save_prompt_file] 删除旧备份: {backup_name}", flush=True)
+                    logger.debug("[save_prompt_file] 删除旧备份: %s", backup_name)
 
                 with open(backup_path, 'w', encoding='utf-8') as f:
                     f.write(old_content)
-                print(f"[save_prompt_file] create backup: {backup_name}", flush=True)
+                logger.info("[save_prompt_file] create backup: %s", backup_name)
             except Exception as e:
-                print(f"[save_prompt_file] create backup failed: {str(e)}", flush=True)
+                logger.warning("[save_prompt_file] create backup failed: %s", e)
 
         # Save new content
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -124,33 +126,33 @@ def new_prompt_file_noapi(name: str = Body(...), content: str = Body(...)):
 
 @router.post('/prompts/delete')
 def delete_prompt_file(request: dict = Body(...)):
-    print(f"[delete_prompt_file] received delete request: {request}", flush=True)
+    logger.debug("[delete_prompt_file] received delete request: %s", request)
     
     # 从请求体中提取文件名
     name = request.get('name')
     if not name:
-        print(f"[delete_prompt_file] missing 'name' in body", flush=True)
+        logger.warning("[delete_prompt_file] missing 'name' in body")
         return JSONResponse(status_code=422, content={'error': 'Missing name field in request body'})
     
-    print(f"[delete_prompt_file] file name: {name}", flush=True)
+    logger.debug("[delete_prompt_file] file name: %s", name)
     
     # 添加文件名验证
     if not name.strip():
-        print(f"[delete_prompt_file] empty file name", flush=True)
+        logger.warning("[delete_prompt_file] empty file name")
         return JSONResponse(status_code=422, content={'error': 'File name cannot be empty'})
     
     # 检查文件名是否包含非法字符
     import re
     if re.search(r'[<>:"/\\|?*]', name):
-        print(f"[delete_prompt_file] invalid chars in name: {name}", flush=True)
+        logger.warning("[delete_prompt_file] invalid chars in name: %s", name)
         return JSONResponse(status_code=422, content={'error': 'File name contains invalid characters'})
     
     file_path = os.path.join(PROMPT_DIR, name)
-    print(f"[delete_prompt_file] file path: {file_path}", flush=True)
-    print(f"[delete_prompt_file] exists: {os.path.isfile(file_path)}", flush=True)
+    logger.debug("[delete_prompt_file] file path: %s", file_path)
+    logger.debug("[delete_prompt_file] exists: %s", os.path.isfile(file_path))
     
     if not os.path.isfile(file_path):
-        print(f"[delete_prompt_file] file not found: {file_path}", flush=True)
+        logger.warning("[delete_prompt_file] file not found: %s", file_path)
         return JSONResponse(status_code=404, content={'error': 'File not found'})
     
     try:
@@ -165,19 +167,19 @@ def delete_prompt_file(request: dict = Body(...)):
         # 如果备份文件已存在，先删除
         if os.path.exists(backup_path):
             os.remove(backup_path)
-            print(f"[delete_prompt_file] 删除旧备份: {backup_name}", flush=True)
+            logger.debug("[delete_prompt_file] 删除旧备份: %s", backup_name)
         
         # 创建新备份
         with open(backup_path, 'w', encoding='utf-8') as f:
             f.write(content)
-        print(f"[delete_prompt_file] 创建备份: {backup_name}", flush=True)
+        logger.info("[delete_prompt_file] 创建备份: %s", backup_name)
         
         # Delete source file
         os.remove(file_path)
-        print(f"[delete_prompt_file] deleted: {name}", flush=True)
+        logger.info("[delete_prompt_file] deleted: %s", name)
         return {'status': 'deleted', 'name': name, 'backup': backup_name}
     except Exception as e:
-        print(f"[delete_prompt_file] delete failed: {str(e)}", flush=True)
+        logger.error("[delete_prompt_file] delete failed: %s", e)
         return JSONResponse(status_code=500, content={'error': f'Failed to delete file: {str(e)}'})
 
 @router.post('/delete')
@@ -186,7 +188,7 @@ def delete_prompt_file_noapi(name: str = Body(...)):
 
 @router.post('/prompts/restore')
 def restore_backup_file(request: dict = Body(...)):
-    print(f"[restore_backup_file] received restore request: {request}", flush=True)
+    logger.debug("[restore_backup_file] received restore request: %s", request)
     
     # 从请求体中提取备份文件名和原文件名
     backup_name = request.get('backup_name')
@@ -194,28 +196,28 @@ def restore_backup_file(request: dict = Body(...)):
     content = request.get('content')
     
     if not backup_name or not original_name or content is None:
-        print(f"[restore_backup_file] missing required fields", flush=True)
+        logger.warning("[restore_backup_file] missing required fields")
         return JSONResponse(status_code=422, content={'error': 'Missing required fields: backup_name, original_name, content'})
     
-    print(f"[restore_backup_file] backup: {backup_name}, original: {original_name}", flush=True)
+    logger.debug("[restore_backup_file] backup: %s, original: %s", backup_name, original_name)
     
     # 验证文件名
     import re
     if re.search(r'[<>:"/\\|?*]', original_name):
-        print(f"[restore_backup_file] 原文件名包含非法字符: {original_name}", flush=True)
+        logger.warning("[restore_backup_file] 原文件名包含非法字符: %s", original_name)
         return JSONResponse(status_code=422, content={'error': 'Original file name contains invalid characters'})
     
     try:
         # 检查备份文件是否存在
         backup_path = os.path.join(PROMPT_DIR, backup_name)
         if not os.path.isfile(backup_path):
-            print(f"[restore_backup_file] backup not found: {backup_path}", flush=True)
+            logger.warning("[restore_backup_file] backup not found: %s", backup_path)
             return JSONResponse(status_code=404, content={'error': 'Backup file not found'})
         
         # 检查原文件是否存在，如果存在则先备份
         original_path = os.path.join(PROMPT_DIR, original_name)
         if os.path.isfile(original_path):
-            print(f"[restore_backup_file] original exists, creating pre-restore backup", flush=True)
+            logger.debug("[restore_backup_file] original exists, creating pre-restore backup")
             # Use simplified english suffix
             pre_restore_backup_name = f"{original_name}_pre_restore_backup"
             pre_restore_backup_path = os.path.join(PROMPT_DIR, pre_restore_backup_name)
@@ -223,7 +225,7 @@ def restore_backup_file(request: dict = Body(...)):
             # 如果恢复前备份已存在，先删除
             if os.path.exists(pre_restore_backup_path):
                 os.remove(pre_restore_backup_path)
-                print(f"[restore_backup_file] remove old pre-restore backup: {pre_restore_backup_name}", flush=True)
+                logger.debug("[restore_backup_file] remove old pre-restore backup: %s", pre_restore_backup_name)
             
             # 读取原文件内容并创建备份
             with open(original_path, 'r', encoding='utf-8') as f:
@@ -232,25 +234,25 @@ def restore_backup_file(request: dict = Body(...)):
             with open(pre_restore_backup_path, 'w', encoding='utf-8') as f:
                 f.write(original_content)
             
-            print(f"[restore_backup_file] created pre-restore backup: {pre_restore_backup_name}", flush=True)
+            logger.info("[restore_backup_file] created pre-restore backup: %s", pre_restore_backup_name)
         
         # Restore file
         with open(original_path, 'w', encoding='utf-8') as f:
             f.write(content)
         
-        print(f"[restore_backup_file] restored: {original_name}", flush=True)
+        logger.info("[restore_backup_file] restored: %s", original_name)
         
         # Remove backup file
         os.remove(backup_path)
-        print(f"[restore_backup_file] removed backup: {backup_name}", flush=True)
+        logger.info("[restore_backup_file] removed backup: %s", backup_name)
         
         return {'status': 'restored', 'original_name': original_name, 'backup_name': backup_name}
         
     except Exception as e:
-        print(f"[restore_backup_file] restore failed: {str(e)}", flush=True)
+        logger.error("[restore_backup_file] restore failed: %s", e)
         return JSONResponse(status_code=500, content={'error': f'Failed to restore file: {str(e)}'})
 
 @router.get('/test')
 def test_route():
-    print("[test_route] 测试路由被调用", flush=True)
+    logger.debug("[test_route] 测试路由被调用")
     return {"message": "test route works"} 
\ No newline at end of file
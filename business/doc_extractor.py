@@ -2,6 +2,7 @@ import os, re, json
 # from dotenv import load_dotenv
 import configparser
 from adapters.llm_adapter import MultiLLM
+from core.logging_config import logger
 import asyncio
 import ast # 导入ast模块
 
@@ -41,12 +42,12 @@ async def extract_info(article: str) -> dict:
     try:
         llm_instance = get_llm_instance()
         content_dict = await llm_instance.async_generate(prompt_)
-        print("llm.async_generate(prompt_) 返回类型：", type(content_dict), content_dict)
+        logger.debug("llm.async_generate(prompt_) 返回类型：%s %s", type(content_dict), content_dict)
         content = content_dict.get("result", "")
     except Exception as e:
-        print("大模型API调用失败：", e)
+        logger.warning("大模型API调用失败：%s", e)
         return {"error": str(e)}
-    print("原始返回内容：", content)
+    logger.debug("原始返回内容：%s", content)
     content = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip(), flags=re.MULTILINE)
     try:
         judge_result = json.loads(content)
@@ -57,15 +58,15 @@ async def extract_info(article: str) -> dict:
 def extract_info_async(article: str) -> dict:
     prompt_ = config.get('extractor_prompt', 'prompt')
     prompt_ = prompt_.replace("{article}", article)
-    print("最终发送给模型的prompt：", prompt_)
+    logger.debug("最终发送给模型的prompt：%s", prompt_)
     async def _inner():
         try:
             llm_instance = get_llm_instance()
             content = await llm_instance.async_generate(prompt_)
         except Exception as e:
-            print("大模型API异步调用失败：", e)
+            logger.warning("大模型API异步调用失败：%s", e)
             return {"error": str(e)}
-        print("原始返回内容：", content)
+        logger.debug("原始返回内容：%s", content)
         content_ = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip(), flags=re.MULTILINE)
         try:
             judge_result = json.loads(content_)
@@ -74,6 +75,80 @@ def extract_info_async(article: str) -> dict:
         return judge_result
     return _inner()
 
+def extract_json_text(content: str) -> str:
+    """从模型原始输出中截取 JSON 文本：优先按括号配平截取，找不到时退回去掉 markdown 代码块标记"""
+    # More robust JSON extraction: find the first '{' or '[' and the last '}' or ']'
+    json_start = -1
+    json_end = -1
+
+    # Find the first opening brace or bracket
+    for i, char in enumerate(content):
+        if char == '{' or char == '[':
+            json_start = i
+            break
+
+    # Find the last closing brace or bracket, searching forwards from the start
+    # This balance-based approach is better for nested structures
+    if json_start != -1:
+        balance = 0
+        for i in range(json_start, len(content)):
+            if content[i] == '{' or content[i] == '[':
+                balance += 1
+            elif content[i] == '}' or content[i] == ']':
+                balance -= 1
+
+            # If balance is zero and we see a closing character matching the potential root level
+            # This assumes the main JSON structure is at the outermost level found
+            if balance == 0 and (content[i] == '}' or content[i] == ']'):
+                json_end = i + 1 # Include the closing character
+                # Optional: could continue searching for the absolute last closing char if needed
+                # but breaking here assumes the first balanced structure is the target.
+                # If nested JSON is expected at the top level, this needs adjustment.
+                # For typical single JSON object/array output, this should work.
+                # To be safer, let's continue to find the absolute last balanced structure
+                # Store potential end and keep searching
+                # json_end = i + 1 # Store potential end
+                pass # Continue search to find the last one
+
+        # After the forward pass, json_end will hold the end of the last balanced structure found
+        # If balance is still not zero, the JSON is likely malformed or incomplete
+        if balance != 0 or json_end == -1:
+            logger.warning("[extract_info_with_history] JSON balance mismatch or end not found by balancing. JSON may be incomplete or malformed.")
+            # In case of malformed JSON, json_end might still be -1 or point to an incomplete structure
+            # As a fallback, we can try finding the absolute last closing brace/bracket again,
+            # but the balance check is a stronger indicator of a valid structure.
+            # Let's rely on the balance check and potentially fail if not balanced.
+            # If balance != 0, it's likely not valid JSON anyway.
+            pass # No fallback to last brace/bracket if balance is off, rely on balance
+
+    if json_start != -1 and json_end != -1 and json_end > json_start:
+        # Extract the potential JSON string
+        potential_json_str = content[json_start:json_end]
+        logger.debug("[extract_info_with_history] Extracted potential JSON content based on braces/brackets: %s", potential_json_str)
+
+        # Further clean by stripping leading/trailing whitespace and potentially problematic non-JSON characters
+        # This regex tries to match leading/trailing whitespace and non-brace/bracket characters
+        # It's complex and might need adjustment based on actual model outputs
+        # A simpler approach: just strip whitespace after extraction
+        content_ = potential_json_str.strip()
+        logger.debug("[extract_info_with_history] Trimmed whitespace after extraction: %s", content_)
+
+        # Optional: More aggressive cleaning if still failing, e.g., remove characters before first '{' or '['
+        # import re
+        # match = re.search(r'[{[\].*?}[\]]', content, re.DOTALL)
+        # if match:
+        #    content_ = match.group(0)
+        # else:
+        #    content_ = potential_json_str.strip()
+
+    else:
+        # If no clear JSON structure found by braces/brackets, fall back to markdown cleaning
+        logger.debug("[extract_info_with_history] No clear JSON structure found based on braces/brackets. Falling back to markdown cleaning.")
+        content_ = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip(), flags=re.MULTILINE)
+
+    return content_
+
+
 def extract_info_with_history(
     article: str,
     session_id: str,
@@ -82,11 +157,11 @@ def extract_info_with_history(
     user_prompt_template: str | None = None,
     preferred_index: int | None = None
 ) -> dict:
-    print(f"[extract_info_with_history] 开始处理 session_id: {session_id}", flush=True)
+    logger.debug("[extract_info_with_history] 开始处理 session_id: %s", session_id)
 
     # Retrieve the preferred model index for this session
     # preferred_index = session_preferred_models.get(session_id)
-    print(f"[extract_info_with_history] Retrieved preferred_index for session {session_id}: {preferred_index}", flush=True)
+    logger.debug("[extract_info_with_history] Retrieved preferred_index for session %s: %s", session_id, preferred_index)
 
     llm_instance = get_llm_instance()
     # Store the original current model index
@@ -99,7 +174,7 @@ def extract_info_with_history(
             # Temporarily set the global current model to the preferred index
             llm_instance.current = preferred_index
             used_preferred_model = True
-            print(f"[extract_info_with_history] Temporarily set llm.current to preferred_index: {llm_instance.current}", flush=True)
+            logger.debug("[extract_info_with_history] Temporarily set llm.current to preferred_index: %s", llm_instance.current)
 
         # Determine the system prompt to use
         final_system_prompt = system_prompt
@@ -107,10 +182,10 @@ def extract_info_with_history(
         # Determine the user prompt template to use
         if user_prompt_template is not None:
             final_user_prompt_template = user_prompt_template
-            print("[extract_info_with_history] Using provided user_prompt_template.", flush=True)
+            logger.debug("[extract_info_with_history] Using provided user_prompt_template.")
         else:
             final_user_prompt_template = config.get('extractor_prompt', 'prompt')
-            print("[extract_info_with_history] Using default user_prompt_template from prompt.ini.", flush=True)
+            logger.debug("[extract_info_with_history] Using default user_prompt_template from prompt.ini.")
 
         # Build history dialogue string
         history_str = ""
@@ -126,7 +201,7 @@ def extract_info_with_history(
         else:
             user_prompt_content = final_user_prompt_template + history_str + f"当前要抽取的资讯原文如下：\n{article}"
 
-        print("[extract_info_with_history] Final user prompt content for model:\n---\n" + user_prompt_content + "\n---\n", flush=True)
+        logger.debug("[extract_info_with_history] Final user prompt content for model:\n---\n%s\n---\n", user_prompt_content)
 
         # Implement retry logic here
         max_retries = len(llm_instance.models)
@@ -134,119 +209,52 @@ def extract_info_with_history(
 
         for attempt in range(max_retries):
             try:
-                print(f"[extract_info_with_history] Attempt {attempt + 1}/{max_retries}: Calling llm.generate with current model (Index: {llm_instance.current})...", flush=True)
+                logger.debug("[extract_info_with_history] Attempt %s/%s: Calling llm.generate with current model (Index: %s)...", attempt + 1, max_retries, llm_instance.current)
                 # Call llm.generate without model_index parameter
                 content = llm_instance.generate(
                     prompt=user_prompt_content,
                     system_prompt=final_system_prompt,
                 )
-                print("[extract_info_with_history] llm.generate call completed successfully.", flush=True)
+                logger.debug("[extract_info_with_history] llm.generate call completed successfully.")
 
                 # If successful, break the retry loop
                 break
 
             except Exception as e:
                 last_exception = e
-                print(f"[extract_info_with_history] Attempt {attempt + 1}/{max_retries}: LLM API call failed with current model (Index: {llm_instance.current}): {e}", flush=True)
+                logger.warning("[extract_info_with_history] Attempt %s/%s: LLM API call failed with current model (Index: %s): %s", attempt + 1, max_retries, llm_instance.current, e)
                 # On failure, switch to the next model for the next attempt
                 if attempt < max_retries - 1:
-                    print(f"[extract_info_with_history] Switching to next model using llm._next()...", flush=True)
+                    logger.info("[extract_info_with_history] Switching to next model using llm._next()...")
                     llm_instance._next()
 
         # If the loop completes without success, raise the last exception
         else:
-            print("[extract_info_with_history] All retry attempts failed.", flush=True)
+            logger.warning("[extract_info_with_history] All retry attempts failed.")
             raise last_exception or Exception("All model attempts failed.")
 
-        print("[extract_info_with_history] Raw response content:\n---\n" + content + "\n---\n", flush=True)
-
-        # More robust JSON extraction: find the first '{' or '[' and the last '}' or ']'
-        json_start = -1
-        json_end = -1
+        logger.debug("[extract_info_with_history] Raw response content:\n---\n%s\n---\n", content)
 
-        # Find the first opening brace or bracket
-        for i, char in enumerate(content):
-            if char == '{' or char == '[':
-                json_start = i
-                break
-
-        # Find the last closing brace or bracket, searching forwards from the start
-        # This balance-based approach is better for nested structures
-        if json_start != -1:
-            balance = 0
-            for i in range(json_start, len(content)):
-                if content[i] == '{' or content[i] == '[':
-                    balance += 1
-                elif content[i] == '}' or content[i] == ']':
-                    balance -= 1
-
-                # If balance is zero and we see a closing character matching the potential root level
-                # This assumes the main JSON structure is at the outermost level found
-                if balance == 0 and (content[i] == '}' or content[i] == ']'):
-                    json_end = i + 1 # Include the closing character
-                    # Optional: could continue searching for the absolute last closing char if needed
-                    # but breaking here assumes the first balanced structure is the target.
-                    # If nested JSON is expected at the top level, this needs adjustment.
-                    # For typical single JSON object/array output, this should work.
-                    # To be safer, let's continue to find the absolute last balanced structure
-                    # Store potential end and keep searching
-                    # json_end = i + 1 # Store potential end
-                    pass # Continue search to find the last one
-
-            # After the forward pass, json_end will hold the end of the last balanced structure found
-            # If balance is still not zero, the JSON is likely malformed or incomplete
-            if balance != 0 or json_end == -1:
-                print("[extract_info_with_history] Warning: JSON balance mismatch or end not found by balancing. JSON may be incomplete or malformed.", flush=True)
-                # In case of malformed JSON, json_end might still be -1 or point to an incomplete structure
-                # As a fallback, we can try finding the absolute last closing brace/bracket again,
-                # but the balance check is a stronger indicator of a valid structure.
-                # Let's rely on the balance check and potentially fail if not balanced.
-                # If balance != 0, it's likely not valid JSON anyway.
-                pass # No fallback to last brace/bracket if balance is off, rely on balance
-
-        if json_start != -1 and json_end != -1 and json_end > json_start:
-            # Extract the potential JSON string
-            potential_json_str = content[json_start:json_end]
-            print("[extract_info_with_history] Extracted potential JSON content based on braces/brackets:", potential_json_str, flush=True)
-
-            # Further clean by stripping leading/trailing whitespace and potentially problematic non-JSON characters
-            # This regex tries to match leading/trailing whitespace and non-brace/bracket characters
-            # It's complex and might need adjustment based on actual model outputs
-            # A simpler approach: just strip whitespace after extraction
-            content_ = potential_json_str.strip()
-            print("[extract_info_with_history] Trimmed whitespace after extraction:", content_, flush=True)
-
-            # Optional: More aggressive cleaning if still failing, e.g., remove characters before first '{' or '['
-            # import re
-            # match = re.search(r'[{[\].*?}[\]]', content, re.DOTALL)
-            # if match:
-            #    content_ = match.group(0)
-            # else:
-            #    content_ = potential_json_str.strip()
-
-        else:
-            # If no clear JSON structure found by braces/brackets, fall back to markdown cleaning
-            print("[extract_info_with_history] No clear JSON structure found based on braces/brackets. Falling back to markdown cleaning.", flush=True)
-            content_ = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip(), flags=re.MULTILINE)
+        content_ = extract_json_text(content)
 
         # print("[extract_info_with_history] Cleaned content:\n---\n" + content_ + "\n---\n", flush=True) # Original print
-        print("[extract_info_with_history] Final content for parsing:\n---\n" + content_ + "\n---\n", flush=True)
+        logger.debug("[extract_info_with_history] Final content for parsing:\n---\n%s\n---\n", content_)
 
         try:
-            print("[extract_info_with_history] Attempting JSON parse...", flush=True)
+            logger.debug("[extract_info_with_history] Attempting JSON parse...")
             judge_result = json.loads(content_)
-            print("[extract_info_with_history] JSON parse successful.", flush=True)
+            logger.debug("[extract_info_with_history] JSON parse successful.")
         except Exception as json_e:
-            print(f"[extract_info_with_history] JSON parse failed: {json_e}. Attempting ast.literal_eval...", flush=True)
+            logger.info("[extract_info_with_history] JSON parse failed: %s. Attempting ast.literal_eval...", json_e)
             try:
                 judge_result = ast.literal_eval(content_)
-                print("[extract_info_with_history] ast.literal_eval parse successful.", flush=True)
+                logger.debug("[extract_info_with_history] ast.literal_eval parse successful.")
             except Exception as e_ast:
-                print("[extract_info_with_history] ast.literal_eval parse also failed:", e_ast, flush=True)
+                logger.warning("[extract_info_with_history] ast.literal_eval parse also failed: %s", e_ast)
                 # Return a structured error indicating parsing failure
                 judge_result = {"score": 0, "advice": "无法解析模型返回结果，请检查格式。", "error": f"Parsing Error: JSON failed with '{str(json_e)}', literal_eval failed with '{str(e_ast)}'. Content: '{content_[:100]}...'"}
 
-        print("[extract_info_with_history] Returning result:", judge_result, flush=True)
+        logger.debug("[extract_info_with_history] Returning result: %s", judge_result)
         return judge_result
     finally:
         # Restore the original current model index
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class AdmissionRejected(Exception):
+    """模型并发已满且排队失败（队列已满或等待超时），调用方应返回 429 或切换到其他模型"""
+    def __init__(self, model_name: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"Model {model_name} admission rejected: {reason}")
+        self.model_name = model_name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop=None, future=None):
+        self.event = threading.Event() if loop is None else None
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ModelAdmission:
+    def __init__(self, model_name: str, max_concurrency: int, max_queue: int = 100, max_wait_sec: float = 30.0):
+        """
+        单个模型的准入控制：最多 max_concurrency 个上游调用同时进行，
+        超出的调用方进入 FIFO 队列（最多 max_queue 个），最长等待 max_wait_sec 秒。
+        同时支持线程（同步调用）与协程（异步调用）排队，释放时按先来先到移交名额。
+        """
+        self.model_name = model_name
+        self.limit = max(1, int(max_concurrency))
+        self.max_queue = max_queue
+        self.max_wait_sec = max_wait_sec
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _try_enter(self):
+        # 调用方需持有 self.lock；有人排队时新来者不能插队
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected(self.model_name, "queue_full")
+        return False
+
+    def _record_wait(self, wait_ms):
+        self.admitted += 1
+        self.queued += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def _abandon(self, waiter):
+        # 调用方需持有 self.lock；返回 True 表示在放弃前已被授予名额
+        if waiter.granted:
+            return True
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+        return False
+
+    def acquire(self, timeout: float | None = None) -> float:
+        """同步获取名额，返回排队等待时间（ms）"""
+        timeout = self.max_wait_sec if timeout is None else timeout
+        with self.lock:
+            if self._try_enter():
+                return 0.0
+            waiter = _Waiter()
+            self.waiters.append(waiter)
+        t0 = time.monotonic()
+        waiter.event.wait(timeout)
+        wait_ms = (time.monotonic() - t0) * 1000
+        with self.lock:
+            if not self._abandon(waiter):
+                self.rejected_timeout += 1
+                raise AdmissionRejected(self.model_name, "queue_timeout")
+            self._record_wait(wait_ms)
+        return wait_ms
+
+    async def acquire_async(self, timeout: float | None = None) -> float:
+        """异步获取名额，排队期间不阻塞事件循环，返回排队等待时间（ms）"""
+        timeout = self.max_wait_sec if timeout is None else timeout
+        with self.lock:
+            if self._try_enter():
+                return 0.0
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop, loop.create_future())
+            self.waiters.append(waiter)
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self.lock:
+                granted = self._abandon(waiter)
+            if granted:
+                self.release()
+            raise
+        wait_ms = (time.monotonic() - t0) * 1000
+        with self.lock:
+            if not self._abandon(waiter):
+                self.rejected_timeout += 1
+                raise AdmissionRejected(self.model_name, "queue_timeout")
+            self._record_wait(wait_ms)
+        return wait_ms
+
+    def release(self):
+        with self.lock:
+            # 名额直接移交给队首等待者，active 不变
+            if self.waiters and self.active <= self.limit:
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+                return
+            self.active -= 1
+
+    def set_limit(self, limit: int):
+        """调整并发上限；调大时立即唤醒排队者"""
+        with self.lock:
+            self.limit = max(1, int(limit))
+            while self.waiters and self.active < self.limit:
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+                self.active += 1
+                waiter.wake()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "queue_depth": len(self.waiters),
+                "max_queue": self.max_queue,
+                "max_wait_ms": self.max_wait_sec * 1000,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_queue_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+                "avg_queue_wait_ms": self.total_wait_ms / self.queued if self.queued else 0.0,
+                "peak_queue_wait_ms": self.max_wait_ms,
+            }
+
+
+class AdmissionController:
+    def __init__(self):
+        self.gates = {}  # model_name -> ModelAdmission
+        self.lock = threading.Lock()
+
+    def configure(self, model_name: str, max_concurrency: int, max_queue: int = 100, max_wait_sec: float = 30.0):
+        with self.lock:
+            gate = self.gates.get(model_name)
+            if gate is None:
+                self.gates[model_name] = ModelAdmission(model_name, max_concurrency, max_queue, max_wait_sec)
+            else:
+                gate.max_queue = max_queue
+                gate.max_wait_sec = max_wait_sec
+                gate.set_limit(max_concurrency)
+
+    def remove(self, model_name: str):
+        with self.lock:
+            self.gates.pop(model_name, None)
+
+    def get(self, model_name: str):
+        return self.gates.get(model_name)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            gates = list(self.gates.items())
+        return {name: gate.snapshot() for name, gate in gates}
@@ -0,0 +1,169 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from core.logging_config import logger
+
+THOMPSON = "thompson"
+UCB = "ucb"
+BANDIT_POLICIES = (THOMPSON, UCB)
+
+
+def bucket_key(tags, biz_level) -> str:
+    """(tags, biz_level) 分桶的持久化键，tags 需已排序去重"""
+    return f"{','.join(tags or ())}|{biz_level or ''}"
+
+
+class BanditRouter:
+    def __init__(self, policy: str = THOMPSON, state_path: str | None = None, discount: float = 0.995,
+                 latency_ref_ms: float = 2000.0, cost_ref: float = 0.05, weights=(0.4, 0.3, 0.3),
+                 ucb_c: float = 1.0, save_interval_sec: float = 30.0, save_every: int = 1000, seed: int | None = None):
+        """
+        按 (tags, biz_level) 分桶的多臂老虎机路由，在硬性过滤后的候选里决定先后顺序：
+        - thompson：每个模型的奖励视为 Beta(1 + 成功质量, 1 + 失败质量)，每次路由采样一次排序
+        - ucb：平均奖励 + ucb_c * sqrt(2 ln N / n)，未试过的模型优先
+        奖励 ∈ [0, 1]：失败为 0，成功时为延迟、单位成本、meta.effect_score 三项得分按 weights 加权。
+        每次更新前按 discount 衰减该模型的历史（约 1/(1-discount) 次的有效窗口），上游变化后能重新收敛。
+        状态由后台线程每 save_interval_sec 秒或每 save_every 次更新写入 state_path（JSON），进程退出时再写一次，
+        请求路径上的 record 不做文件 I/O；启动时加载。seed 固定 thompson 采样序列（测试、回放用）。
+        """
+        if policy not in BANDIT_POLICIES:
+            raise ValueError(f"Unknown bandit policy: {policy}")
+        self.policy = policy
+        self.state_path = state_path
+        self.discount = discount
+        self.latency_ref_ms = latency_ref_ms
+        self.cost_ref = cost_ref
+        self.weights = weights
+        self.ucb_c = ucb_c
+        self.save_interval_sec = save_interval_sec
+        self.save_every = max(1, int(save_every))
+        self.rng = np.random.default_rng(seed)  # 实例自有随机源，不受全局 np.random 状态影响
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.buckets = {}  # bucket_key -> {model_name: [成功质量, 失败质量]}
+        self.updates = 0
+        self.unsaved = 0  # 上次写入后的更新次数
+        self.dirty = False
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.load()
+
+    def reward(self, success: bool, latency_ms: float = 0.0, cost: float = 0.0, effect_score: float = 5.0) -> float:
+        if not success:
+            return 0.0
+        w_latency, w_cost, w_effect = self.weights
+        latency_score = self.latency_ref_ms / (self.latency_ref_ms + max(0.0, latency_ms))  # 参考延迟处为 0.5
+        cost_score = self.cost_ref / (self.cost_ref + max(0.0, cost or 0.0)) if self.cost_ref > 0 else 1.0
+        effect = min(max((effect_score or 0.0) / 10.0, 0.0), 1.0)  # effect_score 为 0~10 分
+        return (w_latency * latency_score + w_cost * cost_score + w_effect * effect) / (sum(self.weights) or 1.0)
+
+    def order(self, bucket: str, names: list) -> list:
+        """返回 names 的下标排列（最优在前）"""
+        if len(names) < 2:
+            return list(range(len(names)))
+        with self.lock:
+            arms = self.buckets.get(bucket, {})
+            mass = np.array([arms.get(name, (0.0, 0.0)) for name in names], dtype=np.float64)
+            if self.policy == THOMPSON:
+                # Generator 不是线程安全的，采样同样在锁内完成
+                score = self.rng.beta(1.0 + mass[:, 0], 1.0 + mass[:, 1])
+        if self.policy == UCB:
+            good, bad = mass[:, 0], mass[:, 1]
+            n = good + bad
+            total = n.sum()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                score = np.where(n > 0, good / n + self.ucb_c * np.sqrt(2 * math.log(max(total, 1.0)) / n), np.inf)
+        return np.argsort(-score, kind="stable").tolist()
+
+    def record(self, bucket: str, model_name: str, reward: float):
+        """记录一次路由结果（reward ∈ [0, 1]）"""
+        reward = min(max(reward, 0.0), 1.0)
+        with self.lock:
+            arm = self.buckets.setdefault(bucket, {}).setdefault(model_name, [0.0, 0.0])
+            arm[0] = arm[0] * self.discount + reward
+            arm[1] = arm[1] * self.discount + (1.0 - reward)
+            self.updates += 1
+            self.unsaved += 1
+            self.dirty = True
+            due = self.unsaved >= self.save_every
+        if self.state_path:
+            self._ensure_started()
+            if due:
+                self.wakeup.set()
+
+    def _ensure_started(self):
+        if self.thread is None:
+            with self.save_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="bandit-saver", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.save)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.save_interval_sec)
+            self.wakeup.clear()
+            self.save()
+
+    def remove_model(self, model_name: str):
+        with self.lock:
+            for arms in self.buckets.values():
+                arms.pop(model_name, None)
+            self.dirty = True
+
+    def load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.buckets = {
+                bucket: {name: [float(arm[0]), float(arm[1])] for name, arm in arms.items()}
+                for bucket, arms in state.get("buckets", {}).items()
+            }
+            logger.info("[BanditRouter] 已加载路由状态 %s：%d 个分桶", self.state_path, len(self.buckets))
+        except Exception as e:
+            logger.warning("[BanditRouter] 加载路由状态失败，从头学习: %s", e)
+            self.buckets = {}
+
+    def save(self):
+        """写入状态文件（先写临时文件再替换，进程中途退出不会留下半截 JSON）"""
+        if not self.state_path:
+            return
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                state = {
+                    "policy": self.policy,
+                    "saved_at": time.time(),
+                    "buckets": {bucket: {name: list(arm) for name, arm in arms.items()} for bucket, arms in self.buckets.items()},
+                }
+                self.dirty = False
+                self.unsaved = 0
+            tmp_path = f"{self.state_path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f, ensure_ascii=False)
+                os.replace(tmp_path, self.state_path)
+            except Exception as e:
+                with self.lock:
+                    self.dirty = True
+                logger.warning("[BanditRouter] 保存路由状态失败: %s", e)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            buckets = {
+                bucket: {
+                    name: {"mean_reward": round(good / (good + bad), 4) if good + bad else None, "weight": round(good + bad, 2)}
+                    for name, (good, bad) in arms.items()
+                }
+                for bucket, arms in self.buckets.items()
+            }
+            return {"policy": self.policy, "updates": self.updates, "buckets": buckets}
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """模型熔断中（或半开状态下已有探测请求在进行），调用方应立即切换到其他模型或返回 503"""
+    def __init__(self, model_name: str, retry_after: float = 1.0):
+        super().__init__(f"Model {model_name} circuit is open")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, model_name: str, failure_threshold: int = 5, failure_rate_threshold: float = 0.5,
+                 window: int = 20, min_calls: int = 10, cooldown_sec: float = 30.0):
+        """
+        单个模型的熔断器：
+        - closed：正常放行；连续失败 failure_threshold 次，或最近 window 次调用中
+          （至少 min_calls 次）失败率达到 failure_rate_threshold 时熔断
+        - open：直接拒绝，cooldown_sec 秒后进入 half_open
+        - half_open：只放行一个探测请求，成功则恢复 closed，失败则重新 open
+        """
+        self.model_name = model_name
+        self.failure_threshold = failure_threshold
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.cooldown_sec = cooldown_sec
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.outcomes = deque(maxlen=window)  # 1 表示失败
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.open_count = 0
+        self.rejected = 0
+        self.sink = None  # (RouteTable, row)：熔断截止时间写入路由表，路由时向量化判断
+
+    def bind(self, table, row):
+        with self.lock:
+            self.sink = (table, row)
+            self._publish()
+
+    def _publish(self):
+        # 调用方需持有 self.lock
+        if self.sink is None:
+            return
+        table, row = self.sink
+        if self.state == OPEN:
+            table.open_until[row] = self.opened_at + self.cooldown_sec
+        elif self.state == HALF_OPEN and self.probe_in_flight:
+            table.open_until[row] = float("inf")
+        else:
+            table.open_until[row] = 0.0
+
+    def _retry_after(self, now):
+        return max(0.0, self.opened_at + self.cooldown_sec - now)
+
+    def is_available(self) -> bool:
+        """只读判断（供路由筛选候选），不占用探测名额"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown_sec
+            return not self.probe_in_flight
+
+    def acquire(self) -> bool:
+        """调用上游前检查；被拒绝时抛出 CircuitOpen，返回值表示本次是否为半开探测请求"""
+        now = time.monotonic()
+        with self.lock:
+            if self.state == OPEN and now - self.opened_at >= self.cooldown_sec:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                self._publish()
+                return True
+            self.rejected += 1
+            retry_after = self._retry_after(now) if self.state == OPEN else 1.0
+        raise CircuitOpen(self.model_name, retry_after)
+
+    def record(self, success, probe: bool = False):
+        """记录调用结果；success 为 None 表示结果未知（如请求被取消），只释放探测名额"""
+        with self.lock:
+            if probe:
+                self.probe_in_flight = False
+                self._publish()
+            if success is None:
+                return
+            if self.state == HALF_OPEN:
+                if not probe:
+                    return  # 熔断前发出的旧请求，结果不影响探测
+                if success:
+                    self._close()
+                else:
+                    self._open()
+                return
+            if self.state == OPEN:
+                return
+            self.outcomes.append(0 if success else 1)
+            if success:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            failures = sum(self.outcomes)
+            if self.consecutive_failures >= self.failure_threshold or (
+                    len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate_threshold):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.open_count += 1
+        self._publish()
+
+    def _close(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.outcomes.clear()
+        self._publish()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "recent_failure_rate": sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0,
+                "retry_after_sec": round(self._retry_after(now), 3) if self.state == OPEN else 0.0,
+                "open_count": self.open_count,
+                "rejected": self.rejected,
+            }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self.breakers = {}  # model_name -> CircuitBreaker
+        self.lock = threading.Lock()
+
+    def configure(self, model_name: str, **settings):
+        with self.lock:
+            breaker = self.breakers.get(model_name)
+            if breaker is None:
+                self.breakers[model_name] = CircuitBreaker(model_name, **settings)
+                return
+            with breaker.lock:
+                for k, v in settings.items():
+                    if k == "window":
+                        breaker.outcomes = deque(breaker.outcomes, maxlen=v)
+                    else:
+                        setattr(breaker, k, v)
+
+    def remove(self, model_name: str):
+        with self.lock:
+            self.breakers.pop(model_name, None)
+
+    def get(self, model_name: str):
+        return self.breakers.get(model_name)
+
+    def is_available(self, model_name: str) -> bool:
+        breaker = self.breakers.get(model_name)
+        return breaker is None or breaker.is_available()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            breakers = list(self.breakers.items())
+        return {name: breaker.snapshot() for name, breaker in breakers}
@@ -0,0 +1,141 @@
+import math
+import threading
+import time
+from collections import deque
+
+# 采样结果
+SUCCESS = "success"
+OVERLOAD = "overload"  # 429、5xx、超时、连接失败：上游过载的信号
+IGNORE = "ignore"      # 4xx 等与负载无关的失败，只释放并发不调整上限
+
+LIMIT_HISTORY_SIZE = 100
+
+
+class AdaptiveLimit:
+    def __init__(self, model_name: str, initial: int, min_limit: int = 1, max_limit: int = 64,
+                 algorithm: str = "aimd", backoff_ratio: float = 0.9, latency_timeout_ms: float = 0.0,
+                 tolerance: float = 1.5, smoothing: float = 0.2, long_window: int = 600, on_change=None):
+        """
+        单个模型的自适应并发上限（参考 Netflix concurrency-limits）：
+        - aimd：成功且并发用到上限一半以上时 +1；429/5xx/超时（或延迟超过 latency_timeout_ms）时乘以 backoff_ratio
+        - gradient：比较长期基线延迟与当前延迟，延迟升高时按比例收缩，平稳时按 sqrt(limit) 探测性增长；过载信号同样乘性减小
+        上限变化时回调 on_change(int_limit)，由调用方同步到准入控制。
+        """
+        self.model_name = model_name
+        self.algorithm = algorithm
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.backoff_ratio = backoff_ratio
+        self.latency_timeout_ms = latency_timeout_ms
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.long_alpha = 2.0 / (long_window + 1)
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.config = (initial, min_limit, max_limit)
+        self.long_rtt = 0.0
+        self.samples = 0
+        self.overloads = 0
+        self.history = deque(maxlen=LIMIT_HISTORY_SIZE)  # (time.time(), limit, reason)
+        self.history.append((time.time(), int(self.limit), "init"))
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    def reset(self, initial: int, min_limit: int, max_limit: int):
+        """热重载时调用：配置变化则重置上限与边界，否则保留已学到的上限并重新下发"""
+        with self.lock:
+            if (initial, min_limit, max_limit) == self.config:
+                if self.on_change is not None:
+                    self.on_change(int(self.limit))
+                return
+            self.config = (initial, min_limit, max_limit)
+            self.min_limit = max(1, int(min_limit))
+            self.max_limit = max(self.min_limit, int(max_limit))
+            self._set(min(max(initial, self.min_limit), self.max_limit), "reconfigure")
+
+    def record(self, rtt_ms: float, in_flight: int, outcome: str = SUCCESS):
+        """一次上游调用结束时采样：rtt_ms 为上游耗时，in_flight 为本次调用开始时（含自身）的并发数"""
+        if outcome == IGNORE:
+            return
+        with self.lock:
+            self.samples += 1
+            if outcome == SUCCESS and self.latency_timeout_ms and rtt_ms > self.latency_timeout_ms:
+                outcome = OVERLOAD
+            if outcome == OVERLOAD:
+                self.overloads += 1
+                self._set(self.limit * self.backoff_ratio, "overload")
+            elif self.algorithm == "gradient":
+                self._gradient(rtt_ms, in_flight)
+            elif in_flight * 2 >= self.limit:
+                self._set(self.limit + 1, "increase")
+
+    def _gradient(self, rtt_ms, in_flight):
+        # 调用方需持有 self.lock
+        if rtt_ms <= 0:
+            return
+        self.long_rtt = rtt_ms if self.long_rtt == 0 else (1 - self.long_alpha) * self.long_rtt + self.long_alpha * rtt_ms
+        if self.long_rtt / rtt_ms > 2:
+            self.long_rtt *= 0.95  # 延迟明显变好时让基线更快跟上
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / rtt_ms))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        if new_limit > self.limit and in_flight * 2 < self.limit:
+            return  # 并发远未用满（应用侧受限），延迟信号不代表上游容量，不增长
+        self._set(self.limit * (1 - self.smoothing) + new_limit * self.smoothing, "gradient")
+
+    def _set(self, value, reason):
+        # 调用方需持有 self.lock；只有整数上限变化时才记录历史并回调
+        before = int(self.limit)
+        self.limit = min(max(float(value), self.min_limit), self.max_limit)
+        after = int(self.limit)
+        if after != before or reason == "reconfigure":
+            self.history.append((time.time(), after, reason))
+            if self.on_change is not None:
+                self.on_change(after)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "algorithm": self.algorithm,
+                "limit": int(self.limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "samples": self.samples,
+                "overloads": self.overloads,
+                "baseline_latency_ms": round(self.long_rtt, 1) if self.algorithm == "gradient" else None,
+                "history": [{"time": t, "limit": v, "reason": r} for t, v, r in self.history],
+            }
+
+
+class ConcurrencyLimitRegistry:
+    def __init__(self, algorithm: str = "aimd", **defaults):
+        self.algorithm = algorithm
+        self.defaults = defaults
+        self.limits = {}  # model_name -> AdaptiveLimit
+        self.lock = threading.Lock()
+
+    def configure(self, model_name: str, initial: int, min_limit: int, max_limit: int, on_change=None):
+        with self.lock:
+            limiter = self.limits.get(model_name)
+            if limiter is None:
+                limiter = self.limits[model_name] = AdaptiveLimit(
+                    model_name, initial, min_limit, max_limit, algorithm=self.algorithm, on_change=on_change, **self.defaults)
+                if on_change is not None:
+                    on_change(limiter.current)
+                return
+        limiter.on_change = on_change
+        limiter.reset(initial, min_limit, max_limit)
+
+    def remove(self, model_name: str):
+        with self.lock:
+            self.limits.pop(model_name, None)
+
+    def get(self, model_name: str):
+        return self.limits.get(model_name)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            limits = list(self.limits.items())
+        return {name: limiter.snapshot() for name, limiter in limits}
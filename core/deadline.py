@@ -0,0 +1,45 @@
+import time
+
+DEADLINE_MIN_REMAINING_MS = 50  # 剩余时间不足以完成一次上游往返时不再发起调用
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求截止时间已到（或剩余时间不足），不再发起新的上游调用、排队或降级，调用方应返回 504"""
+    def __init__(self, stage: str, model_name: str | None = None):
+        super().__init__(f"Request deadline exceeded at {stage}" + (f" (model {model_name})" if model_name else ""))
+        self.stage = stage
+        self.model_name = model_name
+
+
+def deadline_after(timeout_ms) -> float | None:
+    """相对超时（ms）换算成绝对截止时间（time.monotonic() 时间戳），未设置或 <= 0 时返回 None"""
+    if not timeout_ms or timeout_ms <= 0:
+        return None
+    return time.monotonic() + timeout_ms / 1000
+
+
+def remaining_sec(deadline) -> float | None:
+    """距截止时间的剩余秒数（可能为负），没有截止时间时返回 None"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(deadline, stage: str, model_name: str | None = None) -> float | None:
+    """返回剩余秒数；剩余不足 DEADLINE_MIN_REMAINING_MS 时抛出 DeadlineExceeded"""
+    remaining = remaining_sec(deadline)
+    if remaining is not None and remaining * 1000 < DEADLINE_MIN_REMAINING_MS:
+        raise DeadlineExceeded(stage, model_name)
+    return remaining
+
+
+def resolve_timeout_ms(header_value=None, field_value=None, default_ms=0) -> int:
+    """请求头与请求字段都可设置超时，取两者中较小的；都未设置时使用接口默认值（0 表示不限制）"""
+    values = []
+    for value in (header_value, field_value):
+        try:
+            value = int(float(value)) if value not in (None, "") else 0
+        except (TypeError, ValueError):
+            value = 0
+        if value > 0:
+            values.append(value)
+    return min(values) if values else default_ms
@@ -2,30 +2,172 @@ import threading
 import time
 from typing import Callable, Dict, Any
 
+QPS_BURST_SEC = 10  # 默认突发容量：允许瞬时消耗 max_qps * QPS_BURST_SEC 个请求
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def configure(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def retry_after(self) -> float:
+        # 距离下一个令牌可用的秒数（调用前需先 refill）
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 0.0
+
+
+class SlidingWindowCounter:
+    __slots__ = ("window", "start", "current", "previous")
+
+    def __init__(self, window: float, now: float):
+        self.window = window
+        self.start = now
+        self.current = 0
+        self.previous = 0
+
+    def _roll(self, now: float):
+        elapsed = now - self.start
+        if elapsed >= self.window:
+            # 超过两个窗口没有请求时，上一窗口计数清零
+            self.previous = self.current if elapsed < 2 * self.window else 0
+            self.current = 0
+            self.start = now - (elapsed % self.window)
+
+    def add(self, now: float, n: int = 1):
+        self._roll(now)
+        self.current += n
+
+    def count(self, now: float) -> float:
+        # 用上一窗口按剩余比例加权近似滑动窗口内的请求数
+        self._roll(now)
+        weight = 1 - (now - self.start) / self.window
+        return self.previous * weight + self.current
+
+
 class QPSMonitor:
-    def __init__(self, window_sec=60):
+    def __init__(self, window_sec=60, burst_sec=QPS_BURST_SEC):
+        """
+        O(1) 的 QPS 统计与限流：
+        - 统计：每个模型一个滑动窗口计数器（当前窗口 + 上一窗口加权），record/get_qps 均为 O(1)
+        - 限流：令牌桶（速率 = qps，容量 = qps * burst_sec），支持突发；
+          可按模型、user_id、app_id 三个维度分别配置，acquire 时同时检查
+        """
         self.window_sec = window_sec
-        self.model_stats = {}  # model_name -> [timestamps]
+        self.burst_sec = burst_sec
+        self.model_stats = {}  # model_name -> SlidingWindowCounter
+        self.buckets = {}      # (scope, key) -> TokenBucket
+        self.quotas = {"user": {}, "app": {}}  # scope -> {id 或 "*": (qps, burst)}
         self.lock = threading.Lock()
 
+    def set_quota(self, scope: str, key: str, qps: float, burst: float | None = None):
+        """配置 user/app 维度的配额，key 为 "*" 时作为该维度的默认值"""
+        with self.lock:
+            self.quotas[scope][key] = (qps, burst)
+
+    def load_quotas(self, config: dict):
+        """从配置加载配额：{"users": {id: {"qps": 5, "burst": 10}}, "apps": {...}}"""
+        for scope, section in (("user", "users"), ("app", "apps")):
+            for key, item in (config.get(section) or {}).items():
+                self.set_quota(scope, str(key), float(item.get("qps", 0)), item.get("burst"))
+
+    def _bucket(self, scope: str, key: str, qps: float, burst: float | None, now: float) -> TokenBucket:
+        # 调用方需持有 self.lock
+        capacity = burst if burst else max(qps * self.burst_sec, 1.0)
+        bucket = self.buckets.get((scope, key))
+        if bucket is None:
+            bucket = self.buckets[(scope, key)] = TokenBucket(qps, capacity, now)
+        elif bucket.rate != qps or bucket.capacity != capacity:
+            bucket.configure(qps, capacity)
+        bucket.refill(now)
+        return bucket
+
+    def _limits(self, model_name, max_qps, burst, user_id, app_id):
+        limits = []
+        if max_qps and max_qps > 0:
+            limits.append(("model", model_name, max_qps, burst))
+        for scope, key in (("user", user_id), ("app", app_id)):
+            if key is None:
+                continue
+            quota = self.quotas[scope].get(key) or self.quotas[scope].get("*")
+            if quota and quota[0] > 0:
+                limits.append((scope, key, quota[0], quota[1]))
+        return limits
+
+    def acquire(self, model_name: str, max_qps: float = 0, user_id: str | None = None, app_id: str | None = None, burst: float | None = None):
+        """
+        原子地检查并消耗模型/用户/应用三个维度的令牌，成功时同时记录一次调用。
+        返回 (allowed, limited_scope, retry_after_sec)。
+        """
+        now = time.time()
+        with self.lock:
+            buckets = [(scope, self._bucket(scope, key, qps, b, now)) for scope, key, qps, b in self._limits(model_name, max_qps, burst, user_id, app_id)]
+            for scope, bucket in buckets:
+                if bucket.tokens < 1:
+                    return False, scope, bucket.retry_after()
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+            self._count(model_name, now)
+        return True, None, 0.0
+
+    def acquire_quota(self, user_id: str | None = None, app_id: str | None = None, n: int = 1):
+        """
+        原子地一次消耗 n 个用户/应用维度的令牌（批量接口按条目数计），不足时都不消耗。
+        返回 (allowed, limited_scope, retry_after_sec)；n 超过桶容量（永远等不到）时 retry_after_sec 为 None。
+        """
+        now = time.time()
+        with self.lock:
+            buckets = [(scope, self._bucket(scope, key, qps, b, now)) for scope, key, qps, b in self._limits(None, 0, None, user_id, app_id)]
+            for scope, bucket in buckets:
+                if bucket.capacity < n:
+                    return False, scope, None
+                if bucket.tokens < n:
+                    return False, scope, (n - bucket.tokens) / bucket.rate
+            for _, bucket in buckets:
+                bucket.tokens -= n
+        return True, None, 0.0
+
+    def _count(self, model_name: str, now: float):
+        counter = self.model_stats.get(model_name)
+        if counter is None:
+            counter = self.model_stats[model_name] = SlidingWindowCounter(self.window_sec, now)
+        counter.add(now)
+
     def record(self, model_name: str):
         now = time.time()
         with self.lock:
-            if model_name not in self.model_stats:
-                self.model_stats[model_name] = []
-            self.model_stats[model_name].append(now)
-            # 清理过期
-            self.model_stats[model_name] = [t for t in self.model_stats[model_name] if now - t <= self.window_sec]
+            self._count(model_name, now)
+            bucket = self.buckets.get(("model", model_name))
+            if bucket is not None:
+                bucket.refill(now)
+                bucket.tokens -= 1
 
     def get_qps(self, model_name: str) -> float:
         now = time.time()
         with self.lock:
-            times = self.model_stats.get(model_name, [])
-            times = [t for t in times if now - t <= self.window_sec]
-            return len(times) / self.window_sec if self.window_sec > 0 else 0.0
+            counter = self.model_stats.get(model_name)
+            if counter is None or self.window_sec <= 0:
+                return 0.0
+            return counter.count(now) / self.window_sec
 
-    def is_limited(self, model_name: str, max_qps: float) -> bool:
-        return self.get_qps(model_name) > max_qps if max_qps > 0 else False
+    def is_limited(self, model_name: str, max_qps: float, burst: float | None = None) -> bool:
+        if not max_qps or max_qps <= 0:
+            return False
+        now = time.time()
+        with self.lock:
+            return self._bucket("model", model_name, max_qps, burst, now).tokens < 1
 
 class HealthChecker:
     def __init__(self, get_models: Callable[[], list], update_model_meta: Callable[[str, Dict[str, Any]], None], check_func: Callable[[Dict[str, Any]], bool], min_interval=10, max_interval=600):
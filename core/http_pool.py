@@ -0,0 +1,196 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, Timeout
+
+from core.logging_config import logger
+
+try:
+    import h2  # noqa: F401  HTTP/2 需要 httpx[http2]
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+UPSTREAM_READ_TIMEOUT_SEC = 600.0  # 与 openai SDK 默认超时一致
+
+
+class _PoolEntry:
+    def __init__(self, url, key):
+        self.url = url
+        self.key = key
+        self.demand = {}  # model_name -> max_concurrency
+        self.size = 0     # 已创建客户端的连接池大小，0 表示尚未创建
+        self.sync_client = None
+        self.async_client = None
+        self.sync_http = None
+        self.async_http = None
+        self.retired = []  # 扩容前的旧 httpx 客户端，可能仍有请求在使用，关闭连接池时统一关闭
+
+    def required_size(self, min_size):
+        return max(min_size, sum(self.demand.values()))
+
+
+class UpstreamClientPool:
+    def __init__(self, keepalive_expiry_sec=30.0, max_keepalive=0, http2=False, connect_timeout_sec=10.0, min_size=4, max_retries=2):
+        """
+        按 (url, key) 共享的上游客户端：同一地址、同一密钥的模型共用一个 OpenAI/AsyncOpenAI 及其 httpx 连接池。
+        - 连接池大小 = 共享该池的各模型 max_concurrency 之和（不低于 min_size），模型增加后按需扩容
+        - keep-alive 空闲连接保留 keepalive_expiry_sec 秒；max_keepalive 为 0 时与连接池大小相同
+        - http2=True 且安装了 h2 时启用 HTTP/2，否则退回 HTTP/1.1
+        - max_retries 传给 OpenAI 客户端（SDK 自身的重试次数；由上层重试策略接管时为 0）
+        """
+        self.keepalive_expiry_sec = keepalive_expiry_sec
+        self.max_keepalive = max_keepalive
+        self.http2 = http2 and HTTP2_AVAILABLE
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("[UpstreamClientPool] 未安装 h2（pip install 'httpx[http2]'），退回 HTTP/1.1")
+        self.connect_timeout_sec = connect_timeout_sec
+        self.min_size = min_size
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.entries = {}  # (url, key) -> _PoolEntry
+        self.assignments = {}  # model_name -> (url, key)
+
+    def register(self, model_name, url, key, max_concurrency):
+        """登记（或更新）模型对连接池的需求；地址或密钥变化时从旧池移除"""
+        with self.lock:
+            pool_key = (url, key)
+            old_key = self.assignments.get(model_name)
+            if old_key is not None and old_key != pool_key:
+                self._release(model_name, old_key)
+            entry = self.entries.get(pool_key)
+            if entry is None:
+                entry = self.entries[pool_key] = _PoolEntry(url, key)
+            entry.demand[model_name] = max(1, int(max_concurrency or 1))
+            self.assignments[model_name] = pool_key
+
+    def unregister(self, model_name):
+        with self.lock:
+            pool_key = self.assignments.pop(model_name, None)
+            if pool_key is not None:
+                self._release(model_name, pool_key)
+
+    def _release(self, model_name, pool_key):
+        # 调用方需持有 self.lock；不再被任何模型使用的池保留到 close()，避免打断进行中的请求
+        entry = self.entries.get(pool_key)
+        if entry is not None:
+            entry.demand.pop(model_name, None)
+
+    def _limits(self, size):
+        max_keepalive = min(self.max_keepalive, size) if self.max_keepalive else size
+        return httpx.Limits(max_connections=size, max_keepalive_connections=max_keepalive,
+                            keepalive_expiry=self.keepalive_expiry_sec)
+
+    def _timeout(self):
+        return Timeout(UPSTREAM_READ_TIMEOUT_SEC, connect=self.connect_timeout_sec)
+
+    def _entry(self, url, key):
+        # 调用方需持有 self.lock；需求超过当前池大小时重建客户端（旧客户端延后关闭）
+        entry = self.entries.get((url, key))
+        if entry is None:
+            entry = self.entries[(url, key)] = _PoolEntry(url, key)
+        size = entry.required_size(self.min_size)
+        if entry.size and size > entry.size:
+            entry.retired.extend(c for c in (entry.sync_http, entry.async_http) if c is not None)
+            entry.sync_client = entry.async_client = entry.sync_http = entry.async_http = None
+            entry.size = 0
+        return entry, size
+
+    def sync_client(self, url, key) -> OpenAI:
+        with self.lock:
+            entry, size = self._entry(url, key)
+            if entry.sync_client is None:
+                entry.sync_http = DefaultHttpxClient(limits=self._limits(size), timeout=self._timeout(), http2=self.http2)
+                entry.sync_client = OpenAI(base_url=url, api_key=key, http_client=entry.sync_http, max_retries=self.max_retries)
+                entry.size = size
+            return entry.sync_client
+
+    def async_client(self, url, key) -> AsyncOpenAI:
+        with self.lock:
+            entry, size = self._entry(url, key)
+            if entry.async_client is None:
+                entry.async_http = DefaultAsyncHttpxClient(limits=self._limits(size), timeout=self._timeout(), http2=self.http2)
+                entry.async_client = AsyncOpenAI(base_url=url, api_key=key, http_client=entry.async_http, max_retries=self.max_retries)
+                entry.size = size
+            return entry.async_client
+
+    def _active_entries(self):
+        with self.lock:
+            return [e for e in self.entries.values() if e.demand]
+
+    @staticmethod
+    def _warm_up_request(entry):
+        # 任意响应（包括 401/404）都说明 DNS、TCP、TLS 已完成，连接会留在 keep-alive 池中
+        return "GET", entry.url.rstrip("/") + "/models", {"Authorization": f"Bearer {entry.key}"}
+
+    def warm_up(self, connections=1, timeout_sec=5.0) -> dict:
+        """并行为每个同步连接池预建 connections 个连接，返回 {url: 成功连接数}"""
+        jobs = []
+        for entry in self._active_entries():
+            self.sync_client(entry.url, entry.key)
+            jobs.extend([entry] * connections)
+        if not jobs:
+            return {}
+
+        def connect(entry):
+            method, url, headers = self._warm_up_request(entry)
+            try:
+                entry.sync_http.request(method, url, headers=headers, timeout=timeout_sec)
+                return entry.url, True
+            except Exception as e:
+                logger.warning("[UpstreamClientPool.warm_up] %s 预热失败: %s", entry.url, e)
+                return entry.url, False
+
+        result = {}
+        with ThreadPoolExecutor(max_workers=min(32, len(jobs))) as executor:
+            for url, ok in executor.map(connect, jobs):
+                result[url] = result.get(url, 0) + int(ok)
+        return result
+
+    async def async_warm_up(self, connections=1, timeout_sec=5.0) -> dict:
+        """并行为每个异步连接池预建 connections 个连接，返回 {url: 成功连接数}"""
+        jobs = []
+        for entry in self._active_entries():
+            self.async_client(entry.url, entry.key)
+            jobs.extend([entry] * connections)
+
+        async def connect(entry):
+            method, url, headers = self._warm_up_request(entry)
+            try:
+                await entry.async_http.request(method, url, headers=headers, timeout=timeout_sec)
+                return entry.url, True
+            except Exception as e:
+                logger.warning("[UpstreamClientPool.async_warm_up] %s 预热失败: %s", entry.url, e)
+                return entry.url, False
+
+        result = {}
+        for url, ok in await asyncio.gather(*(connect(e) for e in jobs)):
+            result[url] = result.get(url, 0) + int(ok)
+        return result
+
+    def stats(self) -> list:
+        """各连接池的概况（不包含密钥）"""
+        with self.lock:
+            return [{
+                "url": e.url,
+                "models": sorted(e.demand),
+                "pool_size": e.size or e.required_size(self.min_size),
+                "created": e.size > 0,
+                "http2": self.http2,
+            } for e in self.entries.values() if e.demand]
+
+    async def aclose(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+            self.assignments.clear()
+        for entry in entries:
+            for http in [entry.sync_http, entry.async_http] + entry.retired:
+                if http is None:
+                    continue
+                if hasattr(http, "aclose"):
+                    await http.aclose()
+                else:
+                    http.close()
@@ -0,0 +1,122 @@
+import math
+import threading
+import time
+from array import array
+
+SKETCH_RELATIVE_ACCURACY = 0.01  # 分位数相对误差 1%
+SKETCH_MIN_MS = 0.1
+SKETCH_MAX_MS = 24 * 3600 * 1000.0
+
+
+class LatencySketch:
+    __slots__ = ("gamma", "log_gamma", "offset", "counts", "count", "total", "max_value")
+
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY, min_ms=SKETCH_MIN_MS, max_ms=SKETCH_MAX_MS):
+        """
+        对数分桶的延迟直方图（DDSketch/HDR 思路）：第 i 个桶覆盖 (gamma^(i-1), gamma^i]，
+        任意分位数的相对误差不超过 relative_accuracy。桶数固定（默认约 1000 个），内存有界，
+        记录一次 O(1)，查询分位数 O(桶数)。
+        """
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.offset = math.ceil(math.log(min_ms) / self.log_gamma)
+        size = math.ceil(math.log(max_ms) / self.log_gamma) - self.offset + 1
+        self.counts = array("I", bytes(4 * size))
+        self.count = 0
+        self.total = 0.0
+        self.max_value = 0.0
+
+    def record(self, value_ms: float):
+        index = math.ceil(math.log(max(value_ms, SKETCH_MIN_MS)) / self.log_gamma) - self.offset
+        self.counts[min(max(index, 0), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max_value = max(self.max_value, value_ms)
+
+    def clear(self):
+        self.counts = array("I", bytes(4 * len(self.counts)))
+        self.count = 0
+        self.total = 0.0
+        self.max_value = 0.0
+
+    def value_at(self, index: int) -> float:
+        # 桶的代表值：使相对误差最小的桶中点
+        return 2 * self.gamma ** (index + self.offset) / (self.gamma + 1)
+
+
+def merged_quantiles(sketches, quantiles):
+    """在若干个同参数的 sketch 上联合计算分位数，返回与 quantiles 等长的列表（无数据时为 0.0）"""
+    total = sum(s.count for s in sketches)
+    if not total:
+        return [0.0 for _ in quantiles]
+    first = sketches[0]
+    counts = first.counts if len(sketches) == 1 else [sum(c) for c in zip(*(s.counts for s in sketches))]
+    max_value = max(s.max_value for s in sketches)
+    ranks = [q * (total - 1) for q in quantiles]
+    results = [None] * len(quantiles)
+    seen = 0
+    pending = 0
+    for index, c in enumerate(counts):
+        if not c:
+            continue
+        seen += c
+        while pending < len(ranks) and seen > ranks[pending]:
+            results[pending] = min(first.value_at(index), max_value)
+            pending += 1
+        if pending == len(ranks):
+            break
+    return results
+
+
+class RollingLatencySketch:
+    def __init__(self, window_sec: float = 300.0):
+        """
+        按时间滚动的延迟分位数：保留当前窗口与上一窗口两个 sketch，查询时合并，
+        因此分位数反映的是最近 window_sec ~ 2*window_sec 秒内的请求。
+        """
+        self.window_sec = window_sec
+        self.lock = threading.Lock()
+        self.current = LatencySketch()
+        self.previous = LatencySketch()
+        self.started = time.monotonic()
+        self._cache = None  # 上次查询结果，有新数据时失效
+
+    def _roll(self, now):
+        # 调用方需持有 self.lock
+        elapsed = now - self.started
+        if elapsed < self.window_sec:
+            return
+        self.previous, self.current = self.current, self.previous
+        self.current.clear()
+        if elapsed >= 2 * self.window_sec:
+            self.previous.clear()
+        self.started = now
+        self._cache = None
+
+    def record(self, value_ms: float):
+        with self.lock:
+            self._roll(time.monotonic())
+            self.current.record(value_ms)
+            self._cache = None
+
+    def percentiles(self) -> dict:
+        """返回 {"p50", "p95", "p99", "max", "count"}（ms）"""
+        with self.lock:
+            self._roll(time.monotonic())
+            if self._cache is None:
+                sketches = [self.current, self.previous]
+                p50, p95, p99 = merged_quantiles(sketches, (0.5, 0.95, 0.99))
+                self._cache = {
+                    "p50": p50,
+                    "p95": p95,
+                    "p99": p99,
+                    "max": max(s.max_value for s in sketches),
+                    "count": sum(s.count for s in sketches),
+                }
+            return dict(self._cache)
+
+    def quantile(self, q: float) -> float:
+        if q in (0.5, 0.95, 0.99):
+            return self.percentiles()["p%d" % round(q * 100)]
+        with self.lock:
+            return merged_quantiles([self.current, self.previous], (q,))[0]
@@ -1,31 +1,191 @@
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
 import sys
-import json
+
+try:
+    import orjson  # 可选：pip install orjson，比标准库 json 快数倍
+except ImportError:
+    orjson = None
+
+LOG_LEVEL = os.getenv("LLM_LOG_LEVEL", "INFO").upper()
+LOG_PATH = os.getenv("LLM_LOG_PATH", "llm_service.log")
+LOG_MAX_BYTES = int(os.getenv("LLM_LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # 单个日志文件上限，0 表示不轮转
+LOG_BACKUP_COUNT = int(os.getenv("LLM_LOG_BACKUP_COUNT", "5"))
+LOG_COMPRESS = os.getenv("LLM_LOG_COMPRESS", "1") == "1"  # 轮转出的旧文件 gzip 压缩
+LOG_STDOUT = os.getenv("LLM_LOG_STDOUT", "1") == "1"
+# 异步日志：请求线程只把记录放进有界队列，格式化与写盘都在后台线程；队列满时丢弃并计数，不阻塞请求
+LOG_ASYNC = os.getenv("LLM_LOG_ASYNC", "1") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("LLM_LOG_QUEUE_SIZE", "10000"))
+# 按事件采样："llm_generate=0.1,llm_cache_hit=0.01"，未列出的事件全部保留；WARNING 以上与 success=False 的记录始终保留
+LOG_SAMPLING = os.getenv("LLM_LOG_SAMPLING", "")
+# 模型 meta 在日志中的详略：full 为完整 meta，brief 只保留常用字段，off 不记录
+LOG_MODEL_META = os.getenv("LLM_LOG_MODEL_META", "brief")
+BRIEF_META_FIELDS = ("vendor", "tags", "cost", "effect_score")
+LOG_HTTPX_LEVEL = os.getenv("LLM_LOG_HTTPX_LEVEL", "WARNING").upper()  # httpx 每个请求一条 INFO，默认关闭
+
+
+def parse_sampling(spec: str) -> dict:
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def model_meta_for_log(meta: dict | None):
+    """按 LLM_LOG_MODEL_META 裁剪写入日志的模型 meta"""
+    if LOG_MODEL_META == "full":
+        return meta or {}
+    if LOG_MODEL_META == "off" or not meta:
+        return None
+    return {k: meta[k] for k in BRIEF_META_FIELDS if k in meta}
+
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
         log_record = {
             "level": record.levelname,
             "time": self.formatTime(record, self.datefmt),
-            "msg": record.getMessage(),
+            # logger.info({...}) 的字典原样写入，不再经过 str() 变成 Python repr
+            "msg": record.msg if isinstance(record.msg, dict) else record.getMessage(),
             "module": record.module,
             "funcName": record.funcName,
             "lineno": record.lineno,
         }
         if hasattr(record, "extra"):
             log_record.update(record.extra)
-        return json.dumps(log_record, ensure_ascii=False)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_record["exc"] = record.exc_text
+        return dumps(log_record)
+
+
+class EventSampler(logging.Filter):
+    def __init__(self, rates: dict):
+        """按 msg 字典的 event 字段采样，在请求线程入队前执行，被丢弃的记录不产生任何格式化开销"""
+        super().__init__()
+        self.rates = rates
+        self.random = random.Random()
+        self.dropped = {}
+
+    def filter(self, record):
+        if not self.rates or record.levelno >= logging.WARNING or not isinstance(record.msg, dict):
+            return True
+        keep = getattr(record, "sampled", None)  # 同步模式下挂在多个 handler 上，同一条记录只决定一次
+        if keep is None:
+            keep = record.sampled = self._decide(record.msg)
+        return keep
+
+    def _decide(self, msg):
+        rate = self.rates.get(msg.get("event"))
+        if rate is None or rate >= 1.0 or msg.get("success") is False:
+            return True
+        if self.random.random() < rate:
+            return True
+        event = msg.get("event")
+        self.dropped[event] = self.dropped.get(event, 0) + 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        """只做入队：不在请求线程格式化（字典 msg 浅拷贝后交给后台线程），队列满时丢弃"""
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        elif record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # traceback 对象不跨线程保留，异常文本在这里生成（只发生在出错路径上）
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _file_handler():
+    if LOG_MAX_BYTES > 0:
+        handler = logging.handlers.RotatingFileHandler(
+            LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+        if LOG_COMPRESS:
+            handler.namer = lambda name: f"{name}.gz"
+            handler.rotator = _gzip_rotator
+        return handler
+    return logging.FileHandler(LOG_PATH, encoding="utf-8")
+
+
+sampler = EventSampler(parse_sampling(LOG_SAMPLING))
+queue_handler = None
+listener = None
+
 
 def setup_logging():
-    # 控制台输出
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(JsonFormatter())
-    # 文件输出
-    file_handler = logging.FileHandler("llm_service.log", encoding="utf-8")
-    file_handler.setFormatter(JsonFormatter())
+    global queue_handler, listener
+    formatter = JsonFormatter()
+    handlers = []
+    if LOG_STDOUT:
+        # 控制台输出
+        handlers.append(logging.StreamHandler(sys.stdout))
+    # 文件输出（按大小轮转，旧文件压缩）
+    handlers.append(_file_handler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
     root = logging.getLogger()
-    root.setLevel(logging.INFO)
-    root.handlers = [stream_handler, file_handler]
+    root.setLevel(LOG_LEVEL)
+    if LOG_ASYNC:
+        queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        queue_handler.addFilter(sampler)
+        listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # 退出时写完队列中剩余的记录
+        root.handlers = [queue_handler]
+    else:
+        for handler in handlers:
+            handler.addFilter(sampler)
+        root.handlers = handlers
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(LOG_HTTPX_LEVEL)
+
+
+def logging_stats() -> dict:
+    return {
+        "async": LOG_ASYNC,
+        "queue_size": queue_handler.queue.qsize() if queue_handler is not None else 0,
+        "queue_dropped": queue_handler.dropped if queue_handler is not None else 0,
+        "sampled_out": dict(sampler.dropped),
+    }
+
 
 setup_logging()
-logger = logging.getLogger("llm_service") 
\ No newline at end of file
+logger = logging.getLogger("llm_service")
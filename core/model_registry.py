@@ -0,0 +1,81 @@
+import threading
+from types import MappingProxyType
+
+
+class RegistrySnapshot:
+    __slots__ = ("models", "by_name", "positions", "by_tag", "by_vendor", "version")
+
+    def __init__(self, models, version: int = 0):
+        """
+        模型注册表的只读快照：构建完成后不再修改，读者拿到引用即可无锁访问。
+        - models: 按配置顺序排列的模型条目（tuple）
+        - by_name / positions: 名称 -> 条目 / 下标
+        - by_tag / by_vendor: 标签、厂商 -> 模型名集合
+        """
+        self.models = tuple(models)
+        self.version = version
+        self.by_name = MappingProxyType({m['name']: m for m in self.models})
+        self.positions = MappingProxyType({m['name']: i for i, m in enumerate(self.models)})
+        by_tag = {}
+        by_vendor = {}
+        for m in self.models:
+            meta = m.get('meta', {})
+            for tag in m.get('tags') or meta.get('tags') or []:
+                by_tag.setdefault(tag, set()).add(m['name'])
+            vendor = meta.get('vendor')
+            if vendor:
+                by_vendor.setdefault(vendor, set()).add(m['name'])
+        self.by_tag = MappingProxyType({k: frozenset(v) for k, v in by_tag.items()})
+        self.by_vendor = MappingProxyType({k: frozenset(v) for k, v in by_vendor.items()})
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def index_of(self, name):
+        return self.positions.get(name)
+
+    def names_with_tags(self, tags) -> frozenset:
+        """同时具备所有标签的模型名集合"""
+        names = None
+        for tag in tags:
+            tagged = self.by_tag.get(tag, frozenset())
+            names = tagged if names is None else names & tagged
+            if not names:
+                return frozenset()
+        return frozenset(self.by_name) if names is None else names
+
+    def names_by_vendor(self, vendor) -> frozenset:
+        return self.by_vendor.get(vendor, frozenset())
+
+
+class ModelRegistry:
+    def __init__(self, models=()):
+        """
+        写时复制的模型注册表：每次变更都基于当前快照构建新快照，再整体替换引用。
+        读者（路由、调用热路径）只读 self.snapshot，永远不会看到重建到一半的索引。
+        """
+        self.lock = threading.Lock()  # 只串行化写者
+        self.snapshot = RegistrySnapshot(models)
+
+    def replace(self, models) -> RegistrySnapshot:
+        with self.lock:
+            self.snapshot = RegistrySnapshot(models, self.snapshot.version + 1)
+            return self.snapshot
+
+    def add(self, model) -> bool:
+        with self.lock:
+            current = self.snapshot
+            if model['name'] in current.by_name:
+                return False
+            self.snapshot = RegistrySnapshot(current.models + (model,), current.version + 1)
+            return True
+
+    def remove(self, name):
+        """移除模型，返回被移除的条目（不存在时返回 None）"""
+        with self.lock:
+            current = self.snapshot
+            model = current.by_name.get(name)
+            if model is None:
+                return None
+            self.snapshot = RegistrySnapshot([m for m in current.models if m['name'] != name], current.version + 1)
+            return model
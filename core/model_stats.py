@@ -0,0 +1,167 @@
+import threading
+import time
+from array import array
+
+from core.latency_sketch import RollingLatencySketch
+
+ROUTING_QUANTILE = 0.95  # 路由评分使用的上游延迟分位数
+ROUTING_QUANTILE_INTERVAL_SEC = 1.0
+TOKEN_CALIBRATION_MIN_TOKENS = 32  # 估算值太小时格式开销占比大，不参与校准
+TOKEN_CALIBRATION_ALPHA = 0.05
+TOKEN_FACTOR_RANGE = (0.25, 4.0)
+
+
+class ModelStats:
+    __slots__ = (
+        "lock", "max_concurrency", "healthy", "cost", "current_concurrency",
+        "call_count", "error_count", "latency", "latency_alpha",
+        "_errors", "_error_pos", "_error_len", "_error_sum",
+        "upstream_latency", "queue_latency", "e2e_latency",
+        "_sink", "_routing_latency", "_quantile_at",
+        "token_factor", "token_samples",
+    )
+
+    def __init__(self, max_concurrency=2, healthy=True, cost=0.0, error_window=20, latency_window_sec=300.0, latency_alpha=0.3):
+        """
+        单个模型的运行时统计，所有更新都在锁内完成（事件循环与线程池线程会同时调用）。
+        - 错误率：定长环形缓冲 + 运行计数，记录一次 O(1)
+        - 延迟：滑动平均（EWMA），以及上游 / 排队 / 端到端三类耗时的滚动分位数 sketch
+        """
+        self.lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.healthy = healthy
+        self.cost = cost
+        self.current_concurrency = 0
+        self.call_count = 0
+        self.error_count = 0
+        self.latency = 0.0  # ms，滑动平均
+        self.latency_alpha = latency_alpha
+        self._errors = array("b", bytes(error_window))  # 1 表示失败
+        self._error_pos = 0
+        self._error_len = 0
+        self._error_sum = 0
+        self.upstream_latency = RollingLatencySketch(latency_window_sec)  # 上游调用耗时
+        self.queue_latency = RollingLatencySketch(latency_window_sec)     # 准入排队耗时
+        self.e2e_latency = RollingLatencySketch(latency_window_sec)       # 排队 + 上游 + 统计的总耗时
+        self._sink = None  # (RouteTable, row)：路由表中对应的行，实时列由这里写入
+        self._routing_latency = 0.0
+        self._quantile_at = 0.0
+        self.token_factor = 1.0  # 实际 prompt_tokens / 估算值 的滑动平均，用于校准离线 token 估算
+        self.token_samples = 0
+
+    @property
+    def error_rate(self) -> float:
+        return self._error_sum / self._error_len if self._error_len else 0.0
+
+    def bind(self, table, row):
+        """绑定到路由表的一行，并写入当前值"""
+        with self.lock:
+            self._sink = (table, row)
+            self._publish()
+
+    def _publish(self):
+        # 调用方需持有 self.lock；写入的都是绝对值，重新绑定期间丢失的更新会在下次写入时自愈
+        if self._sink is None:
+            return
+        table, row = self._sink
+        table.error_rate[row] = self.error_rate
+        table.max_concurrency[row] = self.max_concurrency
+        table.concurrency[row] = self.current_concurrency
+        table.latency[row] = self._routing_latency or self.latency
+        table.token_factor[row] = self.token_factor
+
+    def set_max_concurrency(self, limit):
+        """自适应并发上限变化时更新（路由的“并发未满”判断随之变化）"""
+        with self.lock:
+            self.max_concurrency = limit
+            self._publish()
+
+    def begin(self):
+        """发起一次上游调用"""
+        with self.lock:
+            self.current_concurrency += 1
+            self.call_count += 1
+            self._publish()
+
+    def end(self):
+        with self.lock:
+            self.current_concurrency -= 1
+            self._publish()
+
+    def _push_outcome(self, failed: int):
+        # 调用方需持有 self.lock
+        window = len(self._errors)
+        if self._error_len == window:
+            self._error_sum -= self._errors[self._error_pos]
+        else:
+            self._error_len += 1
+        self._errors[self._error_pos] = failed
+        self._error_sum += failed
+        self._error_pos = (self._error_pos + 1) % window
+
+    def record_success(self, latency_ms: float, queue_ms: float | None = None, e2e_ms: float | None = None):
+        with self.lock:
+            self._push_outcome(0)
+            self.latency = latency_ms if self.latency == 0 else (self.latency_alpha * latency_ms + (1 - self.latency_alpha) * self.latency)
+        self.upstream_latency.record(latency_ms)
+        if queue_ms is not None:
+            self.queue_latency.record(queue_ms)
+        if e2e_ms is not None:
+            self.e2e_latency.record(e2e_ms)
+        # 路由使用的尾延迟最多每 ROUTING_QUANTILE_INTERVAL_SEC 秒重算一次
+        now = time.monotonic()
+        routing_latency = None
+        if now - self._quantile_at >= ROUTING_QUANTILE_INTERVAL_SEC:
+            routing_latency = self.upstream_latency.quantile(ROUTING_QUANTILE)
+        with self.lock:
+            if routing_latency is not None:
+                self._routing_latency = routing_latency
+                self._quantile_at = now
+            self._publish()
+
+    def record_failure(self):
+        with self.lock:
+            self._push_outcome(1)
+            self.error_count += 1
+            self._publish()
+
+    def record_prompt_tokens(self, estimated: int, actual):
+        """记录估算与上游返回的实际 prompt_tokens，更新该模型的估算校准系数"""
+        if not actual or estimated < TOKEN_CALIBRATION_MIN_TOKENS:
+            return
+        ratio = min(max(actual / estimated, TOKEN_FACTOR_RANGE[0]), TOKEN_FACTOR_RANGE[1])
+        with self.lock:
+            self.token_factor = ratio if self.token_samples == 0 else (
+                TOKEN_CALIBRATION_ALPHA * ratio + (1 - TOKEN_CALIBRATION_ALPHA) * self.token_factor)
+            self.token_samples += 1
+            self._publish()
+
+    def latency_quantile(self, q: float) -> float:
+        """最近成功调用的上游延迟分位数（ms），无数据时为 0"""
+        return self.upstream_latency.quantile(q)
+
+    def snapshot(self) -> dict:
+        """与原 llm_status 单个模型条目的字段保持一致，另附三类耗时的分位数"""
+        upstream = self.upstream_latency.percentiles()
+        percentiles = {
+            'upstream': upstream,
+            'queue': self.queue_latency.percentiles(),
+            'e2e': self.e2e_latency.percentiles(),
+        }
+        with self.lock:
+            return {
+                'current_concurrency': self.current_concurrency,
+                'max_concurrency': self.max_concurrency,
+                'healthy': self.healthy,
+                'latency': self.latency,
+                'p50_latency': upstream['p50'],
+                'p95_latency': upstream['p95'],
+                'p99_latency': upstream['p99'],
+                'latency_percentiles': percentiles,
+                'error_rate': self.error_rate,
+                'cost': self.cost,
+                'call_count': self.call_count,
+                'error_count': self.error_count,
+                'token_factor': round(self.token_factor, 4),
+                'token_samples': self.token_samples,
+            }
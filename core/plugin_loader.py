@@ -75,7 +75,7 @@ def scan_and_register_plugins(app=None):
         for func_name, (func, module_name) in plugin_registry.items():
             route_path = f"/{func_name}"
             if route_path not in [route.path for route in app.routes]:
-                print(f"[PluginLoader] 注册插件API路由: {route_path}")
+                logger.info("[PluginLoader] 注册插件API路由: %s", route_path)
                 app.add_api_route(route_path, get_plugin_func(func, module_name, func_name), methods=["GET", "POST"])
 
 # 插件热加载扫描间隔（秒）
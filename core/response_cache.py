@@ -0,0 +1,100 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_request_key(model: str, messages: list, params: dict) -> str:
+    """
+    根据规范化后的请求（模型、消息、采样参数）生成缓存键。
+    - 值为 None 的参数视为未设置，不参与计算；
+    - stop 统一为列表，避免 "x" 与 ["x"] 产生两个键。
+    """
+    normalized = {}
+    for k, v in params.items():
+        if v is None:
+            continue
+        if k == "stop" and isinstance(v, str):
+            v = [v]
+        normalized[k] = v
+    payload = {"model": model, "messages": messages, "params": normalized}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=10000, ttl_sec=3600):
+        """
+        精确匹配的 LLM 响应缓存，LRU + TTL 淘汰。
+        max_bytes: 缓存内容总字节上限（按 JSON 序列化后的长度估算）
+        max_entries: 条目数上限
+        ttl_sec: 条目存活时间（秒），<=0 表示不过期
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict()  # key -> (expire_at, size, value)
+        self._bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expire_at, size, value = entry
+            if expire_at and now >= expire_at:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: dict):
+        size = len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+        # 单条超过总上限的响应不缓存
+        if size > self.max_bytes:
+            return False
+        expire_at = time.time() + self.ttl_sec if self.ttl_sec > 0 else 0
+        with self.lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (expire_at, size, value)
+            self._bytes += size
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,236 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from openai import APIConnectionError, APITimeoutError
+
+from core.admission import AdmissionRejected
+from core.circuit_breaker import CircuitOpen
+from core.deadline import DeadlineExceeded
+from core.token_estimator import PromptTooLong
+
+# 错误分类
+RATE_LIMIT = "rate_limit"          # 429（额度耗尽除外）
+TIMEOUT = "timeout"                # 上游超时、408
+SERVER_ERROR = "server_error"      # 5xx
+CONNECTION = "connection"          # 建连失败、连接中断
+CONFIG_ERROR = "config_error"      # 401/403/404、额度耗尽：该模型的密钥/权限/名称有问题，换模型可能成功
+CLIENT_ERROR = "client_error"      # 其他 4xx：请求本身有问题，换模型也不会成功
+CONTENT_FILTER = "content_filter"  # 内容审核拦截
+UNAVAILABLE = "unavailable"        # 本地拒绝（熔断、准入排队失败、输入超长），没有请求上游
+DEADLINE = "deadline"              # 请求截止时间已到
+UNKNOWN = "unknown"
+
+# 处理方式
+RETRY = "retry"        # 退避后在同一模型上重试
+FAILOVER = "failover"  # 换下一个候选模型
+ABORT = "abort"        # 直接失败
+
+# 各类错误：同一模型上最多重试几次，重试用完（或不重试）后的处理方式
+DEFAULT_RULES = {
+    RATE_LIMIT: (1, FAILOVER),
+    TIMEOUT: (0, FAILOVER),
+    SERVER_ERROR: (1, FAILOVER),
+    CONNECTION: (1, FAILOVER),
+    CONFIG_ERROR: (0, FAILOVER),
+    CLIENT_ERROR: (0, ABORT),
+    CONTENT_FILTER: (0, ABORT),
+    UNAVAILABLE: (0, FAILOVER),
+    DEADLINE: (0, ABORT),
+    UNKNOWN: (0, FAILOVER),
+}
+
+CONTENT_FILTER_MARKERS = ("content_filter", "contentfilter", "content management policy", "data_inspection_failed", "敏感")
+QUOTA_MARKERS = ("insufficient_quota", "quota exceeded", "余额不足")
+
+
+def classify_error(error) -> str:
+    """把异常归入上面的错误类别（本地异常、openai SDK 异常，以及带 status_code 的其他异常）"""
+    if isinstance(error, DeadlineExceeded):
+        return DEADLINE
+    if isinstance(error, (CircuitOpen, AdmissionRejected, PromptTooLong)):
+        return UNAVAILABLE
+    if isinstance(error, (APITimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, APIConnectionError):
+        return CONNECTION
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return UNKNOWN
+    text = f"{getattr(error, 'code', '') or ''} {error}".lower()
+    if status == 429:
+        return CONFIG_ERROR if any(m in text for m in QUOTA_MARKERS) else RATE_LIMIT
+    if status == 408:
+        return TIMEOUT
+    if status >= 500:
+        return SERVER_ERROR
+    if any(m in text for m in CONTENT_FILTER_MARKERS):
+        return CONTENT_FILTER
+    if status in (401, 403, 404):
+        return CONFIG_ERROR
+    return CLIENT_ERROR
+
+
+def retry_after_sec(error) -> float | None:
+    """从上游响应的 retry-after-ms / Retry-After（秒数或 HTTP 日期）头读取建议的等待时间"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_per_sec: float = 5.0, window_sec: int = 10):
+        """
+        重试预算（参考 Finagle RetryBudget）：最近 window_sec 秒内的重试次数
+        不超过 min_per_sec * window_sec + ratio * 首次调用次数，故障期间重试不会成倍放大上游压力。
+        按秒分桶的环形计数，记录与判断都是 O(window_sec)。
+        """
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.window_sec = max(1, int(window_sec))
+        self.lock = threading.Lock()
+        self.seconds = [0] * self.window_sec
+        self.calls = [0] * self.window_sec
+        self.retries = [0] * self.window_sec
+        self.exhausted = 0
+
+    def _slot(self):
+        # 调用方需持有 self.lock
+        now = int(time.monotonic())
+        i = now % self.window_sec
+        if self.seconds[i] != now:
+            self.seconds[i] = now
+            self.calls[i] = 0
+            self.retries[i] = 0
+        return i, now
+
+    def record_call(self):
+        with self.lock:
+            i, _ = self._slot()
+            self.calls[i] += 1
+
+    def try_spend(self) -> bool:
+        """申请一次重试，预算不足时返回 False"""
+        with self.lock:
+            i, now = self._slot()
+            live = [j for j in range(self.window_sec) if now - self.seconds[j] < self.window_sec]
+            allowed = self.min_per_sec * self.window_sec + self.ratio * sum(self.calls[j] for j in live)
+            if sum(self.retries[j] for j in live) >= allowed:
+                self.exhausted += 1
+                return False
+            self.retries[i] += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            _, now = self._slot()
+            live = [j for j in range(self.window_sec) if now - self.seconds[j] < self.window_sec]
+            return {
+                "window_sec": self.window_sec,
+                "calls": sum(self.calls[j] for j in live),
+                "retries": sum(self.retries[j] for j in live),
+                "exhausted": self.exhausted,
+            }
+
+
+class RetryPolicy:
+    def __init__(self, rules=None, base_delay_ms: float = 200, max_delay_ms: float = 5000,
+                 max_retry_after_ms: float = 10000, budget: RetryBudget | None = None):
+        """
+        按错误类别决定重试 / 换模型 / 直接失败：
+        - 同一模型上的重试使用指数退避 + 全抖动（random(0, min(max_delay, base * 2^attempt))），
+          上游给出 Retry-After 时至少等待该时长；建议等待超过 max_retry_after_ms 时不再等，直接换模型
+        - 每次重试都要从 budget 申请名额，预算耗尽时按该类错误重试用完处理
+        rules: {错误类别: (重试次数, 重试用完后的处理)}，未列出的类别使用 DEFAULT_RULES
+        """
+        self.rules = {**DEFAULT_RULES, **(rules or {})}
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.max_retry_after_ms = max_retry_after_ms
+        self.budget = budget or RetryBudget()
+        self.lock = threading.Lock()
+        self.counters = {}  # (错误类别, 处理方式) -> 次数
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RetryPolicy":
+        """从配置字典构造，格式见 USAGE.md（retry_policy.yaml）"""
+        rules = {}
+        for error_class, rule in (config.get("rules") or {}).items():
+            default_retries, default_then = DEFAULT_RULES.get(error_class, DEFAULT_RULES[UNKNOWN])
+            then = rule.get("then", default_then)
+            if then not in (FAILOVER, ABORT):
+                raise ValueError(f"Invalid retry rule for {error_class}: then={then}")
+            rules[error_class] = (int(rule.get("retries", default_retries)), then)
+        budget = config.get("budget") or {}
+        return cls(
+            rules=rules,
+            base_delay_ms=config.get("base_delay_ms", 200),
+            max_delay_ms=config.get("max_delay_ms", 5000),
+            max_retry_after_ms=config.get("max_retry_after_ms", 10000),
+            budget=RetryBudget(
+                ratio=budget.get("ratio", 0.2),
+                min_per_sec=budget.get("min_per_sec", 5.0),
+                window_sec=budget.get("window_sec", 10),
+            ),
+        )
+
+    def _count(self, error_class, action):
+        with self.lock:
+            key = (error_class, action)
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def backoff(self, attempt: int, error=None) -> float:
+        """第 attempt 次重试（从 0 开始）前的等待秒数"""
+        delay = random.uniform(0, min(self.max_delay_ms, self.base_delay_ms * (2 ** attempt))) / 1000
+        retry_after = retry_after_sec(error) if error is not None else None
+        return max(delay, retry_after or 0.0)
+
+    def decide(self, error, attempt: int, time_left: float | None = None) -> tuple:
+        """
+        同一模型第 attempt 次（从 0 开始）调用失败后的处理，返回 (处理方式, 等待秒数, 错误类别)。
+        只有处理方式为 RETRY 时等待秒数才有意义；time_left 为请求剩余秒数，等待后来不及再调用时不重试。
+        """
+        error_class = classify_error(error)
+        retries, then = self.rules.get(error_class, DEFAULT_RULES[UNKNOWN])
+        if attempt < retries:
+            retry_after = retry_after_sec(error)
+            delay = self.backoff(attempt, error)
+            if (retry_after is None or retry_after * 1000 <= self.max_retry_after_ms) and \
+                    (time_left is None or delay < time_left) and self.budget.try_spend():
+                self._count(error_class, RETRY)
+                return RETRY, delay, error_class
+        self._count(error_class, then)
+        return then, 0.0, error_class
+
+    def should_failover(self, error) -> bool:
+        """同一模型的重试用完后，该错误是否允许换下一个候选"""
+        error_class = classify_error(error)
+        return self.rules.get(error_class, DEFAULT_RULES[UNKNOWN])[1] == FAILOVER
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = {f"{error_class}:{action}": n for (error_class, action), n in sorted(self.counters.items())}
+        return {
+            "rules": {k: {"retries": r, "then": t} for k, (r, t) in self.rules.items()},
+            "budget": self.budget.snapshot(),
+            "decisions": counters,
+        }
@@ -0,0 +1,185 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+from core.bandit_router import bucket_key
+
+PREMIUM_MIN_COST = 0.05  # biz_level=premium 只选单位成本不低于该值的模型
+ECONOMY_MAX_COST = 0.02  # biz_level=economy 只选单位成本不高于该值的模型
+MAX_CACHED_ROUTES = 1024  # 预计算候选集的缓存上限
+
+
+class RouteTable:
+    def __init__(self, models, key):
+        """
+        从注册表快照编译出的路由表（列式存储，一行对应一个模型）：
+        - 静态列：标签位图、单位成本、健康状态、并发上限，编译后不变
+        - 实时列：错误率、路由延迟、当前并发、熔断截止时间，由 ModelStats / CircuitBreaker 直接写入
+        """
+        self.key = key
+        self.models = tuple(models)
+        n = len(self.models)
+        self.tag_bits = {}
+        for m in self.models:
+            for tag in m.get('tags') or []:
+                self.tag_bits.setdefault(tag, len(self.tag_bits))
+        self.tag_words = max(1, math.ceil(len(self.tag_bits) / 64))
+        self.tag_masks = np.zeros((n, self.tag_words), dtype=np.uint64)
+        for row, m in enumerate(self.models):
+            for tag in m.get('tags') or []:
+                bit = self.tag_bits[tag]
+                self.tag_masks[row, bit // 64] |= np.uint64(1 << (bit % 64))
+        self.cost = np.array([m.get('cost', 0.0) or 0.0 for m in self.models], dtype=np.float64)
+        self.healthy = np.array([m.get('status', '可用') == '可用' and m.get('health') != 'unhealthy' for m in self.models], dtype=bool)
+        self.max_concurrency = np.zeros(n, dtype=np.float64)
+        # meta.max_input_length（token），未配置或为 0 表示不限制
+        self.max_input = np.array([m.get('meta', {}).get('max_input_length') or np.inf for m in self.models], dtype=np.float64)
+        self.error_rate = np.zeros(n, dtype=np.float64)
+        self.latency = np.zeros(n, dtype=np.float64)
+        self.concurrency = np.zeros(n, dtype=np.float64)
+        self.open_until = np.zeros(n, dtype=np.float64)  # time.monotonic() 时间戳，<= now 表示可路由
+        self.token_factor = np.ones(n, dtype=np.float64)  # token 估算校准系数
+        self._routes = {}  # (tags, biz_level) -> 满足静态条件的行号
+
+    def _tag_mask(self, tags):
+        mask = np.zeros(self.tag_words, dtype=np.uint64)
+        for tag in tags:
+            bit = self.tag_bits.get(tag)
+            if bit is None:
+                return None  # 没有任何模型具备该标签
+            mask[bit // 64] |= np.uint64(1 << (bit % 64))
+        return mask
+
+    def static_rows(self, tags, biz_level):
+        route_key = (tags, biz_level)
+        rows = self._routes.get(route_key)
+        if rows is not None:
+            return rows
+        selected = np.ones(len(self.models), dtype=bool)
+        if tags:
+            mask = self._tag_mask(tags)
+            if mask is None:
+                selected[:] = False
+            else:
+                selected &= np.all((self.tag_masks & mask) == mask, axis=1)
+        if biz_level == 'premium':
+            selected &= self.cost >= PREMIUM_MIN_COST
+        elif biz_level == 'economy':
+            selected &= self.cost <= ECONOMY_MAX_COST
+        rows = np.flatnonzero(selected)
+        if len(self._routes) >= MAX_CACHED_ROUTES:
+            self._routes.clear()
+        self._routes[route_key] = rows
+        return rows
+
+    def rank(self, rows, prefer_cost=None, prompt_tokens=None, allow_overflow=False):
+        """
+        在候选行上按实时状态过滤并打分，返回排序后的行号。
+        prompt_tokens 为未校准的估算输入长度，超出模型上下文的行被排除；
+        allow_overflow=True（调用方会截断）时若没有模型放得下则保留全部。
+        """
+        if not rows.size:
+            return rows
+        # 0. 输入长度：估算值按各模型的校准系数换算后与 max_input_length 比较
+        if prompt_tokens:
+            fits = self.max_input[rows] >= prompt_tokens * self.token_factor[rows]
+            if fits.any() or not allow_overflow:
+                rows = rows[fits]
+            if not rows.size:
+                return rows
+        # 1. 跳过熔断中的模型（全部熔断时兜底保留）
+        available = self.open_until[rows] <= time.monotonic()
+        if available.any():
+            rows = rows[available]
+        # 2. 优先健康且并发未满，其次健康，最后兜底全部
+        healthy = self.healthy[rows]
+        free = healthy & (self.concurrency[rows] < self.max_concurrency[rows])
+        if free.any():
+            rows = rows[free]
+        elif healthy.any():
+            rows = rows[healthy]
+        # 3. 成本偏好：只保留最低/最高成本的模型
+        if prefer_cost == 'low':
+            cost = self.cost[rows]
+            rows = rows[cost == cost.min()]
+        elif prefer_cost == 'high':
+            cost = self.cost[rows]
+            rows = rows[cost == cost.max()]
+        # 4. 综合打分（越小越好）
+        score = (
+            self.error_rate[rows] * 1000 +
+            self.latency[rows] * 0.1 +
+            self.cost[rows] * 10 +
+            self.concurrency[rows] * 5
+        )
+        return rows[np.argsort(score, kind='stable')]
+
+
+class RoutingEngine:
+    def __init__(self, registry, get_stats, get_breaker=None, bandit=None):
+        """
+        统一的模型路由：MultiLLM 的候选选择与 ModelRouter.select_model 都走这里。
+        路由表在注册表版本或健康状态变化时重新编译，之后每次请求只在预计算的候选行上做向量化打分。
+        registry: ModelRegistry；get_stats(name) -> ModelStats；get_breaker(name) -> CircuitBreaker | None
+        bandit: BanditRouter | None，设置后过滤后的候选按 (tags, biz_level) 分桶的老虎机策略排序，取代固定打分
+        """
+        self.registry = registry
+        self.get_stats = get_stats
+        self.get_breaker = get_breaker
+        self.bandit = bandit
+        self.lock = threading.Lock()
+        self.health_epoch = 0
+        self.table = None
+
+    def invalidate(self):
+        """模型健康状态变化（不改变注册表版本）时调用，下次路由时重新编译"""
+        with self.lock:
+            self.health_epoch += 1
+
+    def current_table(self) -> RouteTable:
+        snapshot = self.registry.snapshot
+        key = (snapshot.version, self.health_epoch)
+        table = self.table
+        if table is not None and table.key == key:
+            return table
+        with self.lock:
+            key = (snapshot.version, self.health_epoch)
+            if self.table is None or self.table.key != key:
+                self.table = self._compile(snapshot, key)
+            return self.table
+
+    def _compile(self, snapshot, key):
+        table = RouteTable(snapshot.models, key)
+        for row, m in enumerate(table.models):
+            self.get_stats(m['name']).bind(table, row)
+            breaker = self.get_breaker(m['name']) if self.get_breaker else None
+            if breaker is not None:
+                breaker.bind(table, row)
+        return table
+
+    def route_bucket(self, tags=None, biz_level=None):
+        """自动路由所在的老虎机分桶，调用方据此回报奖励；未启用老虎机时为 None"""
+        if self.bandit is None:
+            return None
+        return bucket_key(tuple(sorted(set(tags))) if tags else (), biz_level)
+
+    def candidates(self, tags=None, biz_level=None, prefer_cost=None, prompt_tokens=None, allow_overflow=False) -> list:
+        """按 tags/biz_level/prefer_cost 与输入长度返回排序后的候选模型（最优在前）"""
+        table = self.current_table()
+        tags = tuple(sorted(set(tags))) if tags else ()
+        rows = table.rank(table.static_rows(tags, biz_level), prefer_cost, prompt_tokens, allow_overflow)
+        models = table.models
+        candidates = [models[i] for i in rows.tolist()]
+        if self.bandit is not None and len(candidates) > 1:
+            order = self.bandit.order(self.route_bucket(tags, biz_level), [m['name'] for m in candidates])
+            candidates = [candidates[i] for i in order]
+        return candidates
+
+    def select_model(self, tags=None, biz_level=None, prefer_cost=None, prompt_tokens=None, allow_overflow=False, **kwargs):
+        candidates = self.candidates(tags=tags, biz_level=biz_level, prefer_cost=prefer_cost,
+                                     prompt_tokens=prompt_tokens, allow_overflow=allow_overflow)
+        if not candidates:
+            raise Exception('No suitable model available')
+        return candidates[0]
@@ -0,0 +1,255 @@
+import asyncio
+import threading
+
+
+def _copy_result(result):
+    # 各调用方拿到独立的结果副本，避免互相修改
+    return dict(result) if isinstance(result, dict) else result
+
+
+class _SyncCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _AsyncCall:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamCall:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.followers = 0
+
+
+class _AsyncStreamCall:
+    def __init__(self):
+        self.cond = asyncio.Condition()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.consumers = 0
+        self.task = None
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        并发请求合并（single-flight）：相同 key 的请求在进行中时，后来者不再发起上游调用，
+        而是等待并共享第一个请求（leader）的结果。
+        - do: 同步调用（线程池中的同步插件/接口）
+        - async_do: 异步调用，共享同一个上游 task；所有等待者都取消时才取消上游
+        - stream: 同步流式调用，leader 读取上游流，跟随者从已缓冲的分片开始回放并实时跟随
+        - async_stream: 异步流式调用，由后台 task 读取上游流并分发给所有消费者；消费者全部离开时取消上游
+        key 不含截止时间：跟随者共享 leader 的上游调用，也就受 leader 请求的截止时间约束，
+        并收到与 leader 相同的结果或异常（包括 leader 超时抛出的 DeadlineExceeded）。
+        对截止时间敏感、不能接受这一点的请求应以 use_cache=False 跳过合并。
+        """
+        self.lock = threading.Lock()
+        self._sync_calls = {}   # key -> _SyncCall
+        self._async_calls = {}  # (loop id, key) -> _AsyncCall
+        self._streams = {}      # key -> _StreamCall
+        self._async_streams = {}  # (loop id, key) -> _AsyncStreamCall
+        self.leader_count = 0
+        self.shared_count = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self._sync_calls.get(key)
+            leader = call is None
+            if leader:
+                call = _SyncCall()
+                self._sync_calls[key] = call
+                self.leader_count += 1
+            else:
+                self.shared_count += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return _copy_result(call.result)
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                if self._sync_calls.get(key) is call:
+                    del self._sync_calls[key]
+            call.done.set()
+
+    async def async_do(self, key, coro_factory):
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        with self.lock:
+            call = self._async_calls.get(call_key)
+            leader = call is None
+            if leader:
+                call = _AsyncCall(loop.create_task(coro_factory()))
+                self._async_calls[call_key] = call
+                self.leader_count += 1
+            else:
+                self.shared_count += 1
+            call.waiters += 1
+
+        def _release(_task=None):
+            with self.lock:
+                if self._async_calls.get(call_key) is call:
+                    del self._async_calls[call_key]
+
+        if leader:
+            call.task.add_done_callback(_release)
+        try:
+            # shield：单个调用方被取消不影响其他共享者
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 所有调用方都已放弃，取消上游调用，后来者重新发起
+                _release()
+                call.task.cancel()
+        return result if leader else _copy_result(result)
+
+    def stream(self, key, gen_factory):
+        with self.lock:
+            call = self._streams.get(key)
+            leader = call is None
+            if leader:
+                call = _StreamCall()
+                self._streams[key] = call
+                self.leader_count += 1
+            else:
+                call.followers += 1
+                self.shared_count += 1
+        if leader:
+            yield from self._lead_stream(key, call, gen_factory)
+        else:
+            yield from self._follow_stream(call)
+
+    def _publish(self, call, chunk):
+        with call.cond:
+            call.chunks.append(chunk)
+            call.cond.notify_all()
+
+    def _lead_stream(self, key, call, gen_factory):
+        upstream = None
+        try:
+            upstream = gen_factory()
+            for chunk in upstream:
+                self._publish(call, chunk)
+                yield chunk
+        except GeneratorExit:
+            # leader 的客户端提前断开：若仍有跟随者，在当前线程把上游读完再结束
+            with self.lock:
+                followers = call.followers
+            if followers:
+                try:
+                    for chunk in upstream:
+                        self._publish(call, chunk)
+                except Exception as e:
+                    call.error = e
+            raise
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+            with call.cond:
+                call.finished = True
+                call.cond.notify_all()
+            if upstream is not None and hasattr(upstream, "close"):
+                upstream.close()
+
+    def _follow_stream(self, call):
+        index = 0
+        try:
+            while True:
+                with call.cond:
+                    while index >= len(call.chunks) and not call.finished:
+                        call.cond.wait()
+                    pending = call.chunks[index:]
+                    finished = call.finished
+                for chunk in pending:
+                    yield chunk
+                index += len(pending)
+                if finished:
+                    if call.error is not None:
+                        raise call.error
+                    return
+        finally:
+            with self.lock:
+                call.followers -= 1
+
+    async def async_stream(self, key, agen_factory):
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        with self.lock:
+            call = self._async_streams.get(call_key)
+            if call is None:
+                call = _AsyncStreamCall()
+                self._async_streams[call_key] = call
+                self.leader_count += 1
+                call.task = loop.create_task(self._pump_stream(call_key, call, agen_factory))
+            else:
+                self.shared_count += 1
+            call.consumers += 1
+        index = 0
+        try:
+            while True:
+                async with call.cond:
+                    await call.cond.wait_for(lambda: index < len(call.chunks) or call.finished)
+                    pending = call.chunks[index:]
+                    finished = call.finished
+                for chunk in pending:
+                    yield chunk
+                index += len(pending)
+                if finished:
+                    if call.error is not None:
+                        raise call.error
+                    return
+        finally:
+            call.consumers -= 1
+            if call.consumers == 0 and not call.task.done():
+                # 所有消费者都已断开，停止读取上游
+                self._release_async_stream(call_key, call)
+                call.task.cancel()
+
+    def _release_async_stream(self, call_key, call):
+        with self.lock:
+            if self._async_streams.get(call_key) is call:
+                del self._async_streams[call_key]
+
+    async def _pump_stream(self, call_key, call, agen_factory):
+        upstream = agen_factory()
+        try:
+            async for chunk in upstream:
+                async with call.cond:
+                    call.chunks.append(chunk)
+                    call.cond.notify_all()
+        except Exception as e:
+            call.error = e
+        finally:
+            self._release_async_stream(call_key, call)
+            await upstream.aclose()
+            async with call.cond:
+                call.finished = True
+                call.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "in_flight": len(self._sync_calls) + len(self._async_calls) + len(self._streams) + len(self._async_streams),
+                "leaders": self.leader_count,
+                "shared": self.shared_count,
+            }
@@ -1,10 +1,13 @@
+from core.logging_config import logger
+
+
 class StateManager:
     def __init__(self):
         self._session_preferred_models = {}
 
     def set_preferred_model_index(self, session_id, index):
         self._session_preferred_models[session_id] = index
-        print(f"[StateManager] Set preferred model for session {session_id} to index {index}", flush=True)
+        logger.debug("[StateManager] Set preferred model for session %s to index %s", session_id, index)
 
     def get_preferred_model_index(self, session_id):
         return self._session_preferred_models.get(session_id)
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+
+import httpx
+
+from core.token_estimator import estimate_messages_tokens
+
+STUB_URL_SCHEME = "stub://"  # llm_models.yaml 中 url 以此开头的模型使用进程内桩
+STUB_BASE_URL = "http://stub.local/v1"
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+DEFAULT_STUB_PROFILE = {
+    "latency_ms": 200,                  # 首 token 延迟（分布的中位数）
+    "latency_distribution": "lognormal",
+    "latency_spread": 0.5,              # lognormal 的 sigma；uniform 为上下浮动比例
+    "tokens_per_sec": 50,               # 生成速度：非流式总延迟 += 输出 token 数 / 速度，流式按此间隔逐 token 输出
+    "completion_tokens": 64,            # 默认输出长度（不超过请求的 max_tokens）
+    "error_rate": 0.0,                  # 以 500 响应的比例
+    "rate_limit_rate": 0.0,             # 以 429 响应的比例
+    "retry_after_sec": 1,               # 429 响应的 Retry-After
+    "max_concurrency": 0,               # 超过该并发时返回 429，0 表示不限制
+    "seed": None,
+}
+
+
+class StubLLM:
+    def __init__(self, profile: dict | None = None, name: str = "stub"):
+        """
+        OpenAI 兼容接口的行为模型（进程内 transport 与独立桩服务共用）：
+        延迟分布、流式 token 速度、500/429 注入、并发上限，以及按离线估算给出的 usage。
+        只负责决定返回什么、等多久，真正的等待由调用方（time.sleep / asyncio.sleep）完成。
+        """
+        self.name = name
+        self.lock = threading.Lock()
+        self.active = 0
+        self.counters = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "overloaded": 0,
+                         "prompt_tokens": 0, "completion_tokens": 0}
+        self.configure(profile)
+
+    def configure(self, profile: dict | None):
+        profile = {**DEFAULT_STUB_PROFILE, **(profile or {})}
+        if profile["latency_distribution"] not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {profile['latency_distribution']}")
+        with self.lock:
+            self.profile = profile
+            self.random = random.Random(profile["seed"])
+
+    def first_token_delay(self) -> float:
+        """按配置的分布抽样首 token 延迟（秒）"""
+        p = self.profile
+        median = p["latency_ms"] / 1000
+        spread = p["latency_spread"]
+        with self.lock:
+            if p["latency_distribution"] == "fixed":
+                return median
+            if p["latency_distribution"] == "uniform":
+                return max(0.0, self.random.uniform(median * (1 - spread), median * (1 + spread)))
+            if p["latency_distribution"] == "exponential":
+                return self.random.expovariate(math.log(2) / median) if median > 0 else 0.0
+            return self.random.lognormvariate(math.log(median), spread) if median > 0 else 0.0
+
+    def token_interval(self) -> float:
+        rate = self.profile["tokens_per_sec"]
+        return 1 / rate if rate and rate > 0 else 0.0
+
+    def admit(self):
+        """一次请求进入：按比例注入 500/429，超过并发上限返回 429；放行时返回 None，之后必须调用 release()"""
+        p = self.profile
+        with self.lock:
+            self.counters["requests"] += 1
+            roll = self.random.random()
+            if roll < p["error_rate"]:
+                self.counters["errors"] += 1
+                return 500, {}, {"error": {"message": "Injected upstream error", "type": "server_error"}}
+            if roll < p["error_rate"] + p["rate_limit_rate"]:
+                self.counters["rate_limited"] += 1
+                return self._rate_limited("Injected rate limit")
+            if p["max_concurrency"] and self.active >= p["max_concurrency"]:
+                self.counters["overloaded"] += 1
+                return self._rate_limited("Too many concurrent requests")
+            self.active += 1
+        return None
+
+    def _rate_limited(self, message):
+        # 调用方需持有 self.lock
+        return 429, {"retry-after": str(self.profile["retry_after_sec"])}, \
+            {"error": {"message": message, "type": "rate_limit_exceeded", "code": "rate_limit_exceeded"}}
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+    def completion_tokens(self, body: dict) -> int:
+        n = self.profile["completion_tokens"]
+        if body.get("max_tokens"):
+            n = min(n, body["max_tokens"])
+        return max(1, int(n))
+
+    def _usage(self, body, completion_tokens):
+        prompt_tokens = estimate_messages_tokens(body.get("messages") or [])
+        with self.lock:
+            self.counters["ok"] += 1
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["completion_tokens"] += completion_tokens
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def response_delay(self, completion_tokens: int) -> float:
+        """非流式响应的总耗时（秒）"""
+        return self.first_token_delay() + completion_tokens * self.token_interval()
+
+    def completion(self, body: dict, completion_tokens: int) -> dict:
+        return {
+            "id": f"chatcmpl-stub-{self.counters['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or self.name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(["tok"] * completion_tokens)},
+                         "finish_reason": "length" if completion_tokens == body.get("max_tokens") else "stop"}],
+            "usage": self._usage(body, completion_tokens),
+        }
+
+    def stream_events(self, body: dict, completion_tokens: int):
+        """流式响应的 SSE 事件（bytes），每个 token 一个 chunk；请求 stream_options.include_usage 时末尾附带 usage"""
+        model = body.get("model") or self.name
+        base = {"id": f"chatcmpl-stub-{self.counters['requests']}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model}
+        for i in range(completion_tokens):
+            delta = {"role": "assistant", "content": "tok"} if i == 0 else {"content": " tok"}
+            yield _sse({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        usage = self._usage(body, completion_tokens)
+        yield _sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield _sse({**base, "choices": [], "usage": usage})
+        yield b"data: [DONE]\n\n"
+
+    def models(self) -> dict:
+        return {"object": "list", "data": [{"id": self.name, "object": "model", "created": 0, "owned_by": "stub"}]}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"active": self.active, **self.counters, "profile": dict(self.profile)}
+
+
+def _sse(payload) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _read_timeout(request: httpx.Request):
+    """客户端为本次请求设置的读超时（秒），未设置时为 None"""
+    return (request.extensions.get("timeout") or {}).get("read")
+
+
+def _timed_out(delay, read_timeout) -> bool:
+    # 与真实连接一致：单次等待超过读超时时，等满读超时后抛出 httpx.ReadTimeout
+    return read_timeout is not None and delay > read_timeout
+
+
+def _route(request: httpx.Request):
+    path = request.url.path.rstrip("/")
+    if request.method == "GET" and path.endswith("/models"):
+        return "models"
+    if request.method == "POST" and path.endswith("/chat/completions"):
+        return "chat"
+    return None
+
+
+class _SyncStubStream(httpx.SyncByteStream):
+    def __init__(self, stub, events, request):
+        self.stub = stub
+        self.events = events
+        self.request = request
+        self.released = False
+
+    def _wait(self, delay):
+        read_timeout = _read_timeout(self.request)
+        if _timed_out(delay, read_timeout):
+            time.sleep(read_timeout)
+            raise httpx.ReadTimeout("Stub stream read timed out", request=self.request)
+        time.sleep(delay)
+
+    def __iter__(self):
+        self._wait(self.stub.first_token_delay())
+        interval = self.stub.token_interval()
+        for event in self.events:
+            yield event
+            if interval:
+                self._wait(interval)
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.stub.release()
+
+
+class _AsyncStubStream(httpx.AsyncByteStream):
+    def __init__(self, stub, events, request):
+        self.stub = stub
+        self.events = events
+        self.request = request
+        self.released = False
+
+    async def _wait(self, delay):
+        read_timeout = _read_timeout(self.request)
+        if _timed_out(delay, read_timeout):
+            await asyncio.sleep(read_timeout)
+            raise httpx.ReadTimeout("Stub stream read timed out", request=self.request)
+        await asyncio.sleep(delay)
+
+    async def __aiter__(self):
+        await self._wait(self.stub.first_token_delay())
+        interval = self.stub.token_interval()
+        for event in self.events:
+            yield event
+            if interval:
+                await self._wait(interval)
+
+    async def aclose(self):
+        if not self.released:
+            self.released = True
+            self.stub.release()
+
+
+class StubTransport(httpx.BaseTransport):
+    def __init__(self, stub: StubLLM):
+        """同步 httpx transport：不经网络，由 StubLLM 模拟上游（time.sleep 模拟延迟，超过请求的读超时时抛出 ReadTimeout）"""
+        self.stub = stub
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        route = _route(request)
+        if route == "models":
+            return httpx.Response(200, json=self.stub.models())
+        if route is None:
+            return httpx.Response(404, json={"error": {"message": f"Unknown path {request.url.path}"}})
+        body = json.loads(request.read() or b"{}")
+        rejected = self.stub.admit()
+        if rejected is not None:
+            status, headers, payload = rejected
+            return httpx.Response(status, headers=headers, json=payload)
+        n = self.stub.completion_tokens(body)
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=_SyncStubStream(self.stub, self.stub.stream_events(body, n), request))
+        try:
+            delay = self.stub.response_delay(n)
+            read_timeout = _read_timeout(request)
+            if _timed_out(delay, read_timeout):
+                time.sleep(read_timeout)
+                raise httpx.ReadTimeout("Stub response read timed out", request=request)
+            time.sleep(delay)
+            return httpx.Response(200, json=self.stub.completion(body, n))
+        finally:
+            self.stub.release()
+
+
+class AsyncStubTransport(httpx.AsyncBaseTransport):
+    def __init__(self, stub: StubLLM):
+        """异步 httpx transport：asyncio.sleep 模拟延迟，等待期间不阻塞事件循环"""
+        self.stub = stub
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        route = _route(request)
+        if route == "models":
+            return httpx.Response(200, json=self.stub.models())
+        if route is None:
+            return httpx.Response(404, json={"error": {"message": f"Unknown path {request.url.path}"}})
+        body = json.loads(await request.aread() or b"{}")
+        rejected = self.stub.admit()
+        if rejected is not None:
+            status, headers, payload = rejected
+            return httpx.Response(status, headers=headers, json=payload)
+        n = self.stub.completion_tokens(body)
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=_AsyncStubStream(self.stub, self.stub.stream_events(body, n), request))
+        try:
+            delay = self.stub.response_delay(n)
+            read_timeout = _read_timeout(request)
+            if _timed_out(delay, read_timeout):
+                await asyncio.sleep(read_timeout)
+                raise httpx.ReadTimeout("Stub response read timed out", request=request)
+            await asyncio.sleep(delay)
+            return httpx.Response(200, json=self.stub.completion(body, n))
+        finally:
+            self.stub.release()
@@ -0,0 +1,66 @@
+import math
+import re
+
+# 离线 token 估算：不依赖具体分词器，按字符类别计数，误差由各模型的校准系数（ModelStats.token_factor）修正
+CJK_TOKENS_PER_CHAR = 0.8    # 中日韩字符：主流中文分词器约 0.6~1 token/字，取偏高值宁可高估
+OTHER_CHARS_PER_TOKEN = 4.0  # 英文、数字、代码等：约 4 个字符 1 个 token
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息的角色与分隔符开销
+REPLY_PRIMING_TOKENS = 3
+
+# 超长截断策略：head 保留开头，tail 保留结尾，middle 保留首尾、删去中间；其他值（如 reject）表示不截断
+TRUNCATE_POLICIES = ("head", "tail", "middle")
+TRUNCATION_MARKER = "\n...\n"
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")  # CJK 部首/汉字/假名、韩文、全角符号
+
+
+class PromptTooLong(ValueError):
+    """估算的输入 token 数超过模型 meta.max_input_length，且未配置截断策略"""
+    def __init__(self, model_name: str, estimated_tokens: int, max_input_tokens: int):
+        super().__init__(f"Prompt too long for model {model_name}: ~{estimated_tokens} tokens > {max_input_tokens}")
+        self.model_name = model_name
+        self.estimated_tokens = estimated_tokens
+        self.max_input_tokens = max_input_tokens
+
+
+def estimate_tokens(text) -> int:
+    """估算一段文本的 token 数（O(n) 单次正则扫描）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    whitespace = text.count(" ") + text.count("\n") + text.count("\t")
+    other = max(0, len(text) - cjk - whitespace)
+    return math.ceil(cjk * CJK_TOKENS_PER_CHAR + other / OTHER_CHARS_PER_TOKEN)
+
+
+def estimate_messages_tokens(messages) -> int:
+    """估算 chat messages 的输入 token 数（含每条消息的格式开销）"""
+    total = REPLY_PRIMING_TOKENS
+    for message in messages:
+        content = message.get("content")
+        total += MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content if isinstance(content, str) else str(content or ""))
+    return total
+
+
+def truncate_text(text: str, max_tokens: int, policy: str = "tail") -> str:
+    """按策略把文本截到估算不超过 max_tokens 个 token"""
+    if policy not in TRUNCATE_POLICIES:
+        raise ValueError(f"Unknown truncation policy: {policy}")
+    if max_tokens <= 0:
+        return ""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    keep = int(len(text) * max_tokens / total)
+    while keep > 0:
+        if policy == "head":
+            result = text[:keep]
+        elif policy == "tail":
+            result = text[-keep:]
+        else:
+            head = keep // 2
+            result = text[:head] + TRUNCATION_MARKER + text[len(text) - (keep - head):]
+        if estimate_tokens(result) <= max_tokens:
+            return result
+        keep = int(keep * 0.95)  # 字符分布不均时逐步收缩
+    return ""
@@ -0,0 +1,263 @@
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from core.logging_config import dumps, logger
+
+# 轻量请求追踪：span 记录在 ContextVar 中逐层嵌套，跨服务通过 W3C traceparent 头传播，
+# 结束的 span 由后台线程批量写入本地文件（jsonl 每行一个 span；otlp 每行一个 OTLP/JSON ExportTraceServiceRequest），无需 collector
+TRACING_ENABLED = os.getenv("LLM_TRACING_ENABLED", "0") == "1"
+TRACE_PATH = os.getenv("LLM_TRACE_PATH", "traces.jsonl")
+TRACE_FORMAT = os.getenv("LLM_TRACE_FORMAT", "jsonl")  # jsonl | otlp
+TRACE_SAMPLE_RATE = float(os.getenv("LLM_TRACE_SAMPLE_RATE", "1.0"))  # 没有上游 traceparent 时的采样比例
+TRACE_SERVICE_NAME = os.getenv("LLM_TRACE_SERVICE_NAME", "aicore-director")
+TRACE_QUEUE_SIZE = int(os.getenv("LLM_TRACE_QUEUE_SIZE", "10000"))
+TRACE_FLUSH_INTERVAL_SEC = 1.0
+TRACE_BATCH_SIZE = 512
+
+INTERNAL = "internal"
+SERVER = "server"
+CLIENT = "client"
+OTLP_SPAN_KINDS = {INTERNAL: 1, SERVER: 2, CLIENT: 3}
+
+TRACEPARENT_HEADER = "traceparent"
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name, trace_id, parent_id=None, kind=INTERNAL, sampled=True, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_error(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+        }
+
+
+class SpanExporter:
+    def __init__(self, path: str, fmt: str = "jsonl", queue_size: int = 10000):
+        """后台线程批量写文件：请求路径上只有一次 put_nowait，队列满时丢弃并计数"""
+        if fmt not in ("jsonl", "otlp"):
+            raise ValueError(f"Unknown trace format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.exported = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.flush)
+
+    def export(self, span: Span):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, block: bool) -> list:
+        batch = []
+        try:
+            if block:
+                batch.append(self.queue.get(timeout=TRACE_FLUSH_INTERVAL_SEC))
+            while len(batch) < TRACE_BATCH_SIZE:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain(block=True)
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, spans: list):
+        if self.fmt == "otlp":
+            lines = [dumps(otlp_request(spans))]
+        else:
+            lines = [dumps(span.to_dict()) for span in spans]
+        try:
+            with self.lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logger.warning("[SpanExporter] 写入 %s 失败: %s", self.path, e)
+
+    def snapshot(self) -> dict:
+        return {"enabled": TRACING_ENABLED, "path": self.path, "format": self.fmt, "exported": self.exported,
+                "dropped": self.dropped, "pending": self.queue.qsize()}
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def otlp_request(spans: list) -> dict:
+    """OTLP/JSON ExportTraceServiceRequest（trace/span id 为十六进制字符串），可直接交给 otel collector 的 file receiver"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": "core.tracing"},
+            "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                "name": span.name,
+                "kind": OTLP_SPAN_KINDS[span.kind],
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items() if v is not None],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            } for span in spans],
+        }],
+    }]}
+
+
+exporter = SpanExporter(TRACE_PATH, TRACE_FORMAT, TRACE_QUEUE_SIZE)
+
+
+def parse_traceparent(header) -> tuple | None:
+    """解析 W3C traceparent，返回 (trace_id, parent_span_id, sampled)，格式不合法时返回 None"""
+    match = TRACEPARENT_RE.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+def start_span(name: str, kind: str = INTERNAL, traceparent: str | None = None, **attributes) -> Span | None:
+    """开始一个 span（父 span 取自 traceparent 或当前上下文），调用方负责 end() 与上下文切换；未开启追踪时返回 None"""
+    if not TRACING_ENABLED:
+        return None
+    parent = current_span.get()
+    remote = parse_traceparent(traceparent) if traceparent else None
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    elif parent is not None:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    else:
+        trace_id, parent_id, sampled = f"{random.getrandbits(128):032x}", None, random.random() < TRACE_SAMPLE_RATE
+    return Span(name, trace_id, parent_id, kind, sampled, attributes)
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = INTERNAL, traceparent: str | None = None, **attributes):
+    """with span("route", tags=...) as s: ...；异常会记录到 span 上并继续抛出。未开启追踪时 s 为 None"""
+    s = start_span(name, kind, traceparent, **attributes)
+    if s is None:
+        yield None
+        return
+    token = current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.record_error(e)
+        raise
+    finally:
+        current_span.reset(token)
+        s.end()
+
+
+def traced(name: str, kind: str = INTERNAL):
+    """给同步或异步函数整体加一个 span 的装饰器（保留签名，可用于 FastAPI 路由）"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_attributes(**attributes):
+    """给当前 span 补充属性（未开启追踪或不在 span 内时忽略）"""
+    s = current_span.get()
+    if s is not None:
+        s.set(**attributes)
+
+
+def inject_headers(headers: dict | None = None) -> dict:
+    """把当前 span 的 traceparent 写入出站请求头（返回同一个 dict）；不在 span 内时原样返回"""
+    headers = {} if headers is None else headers
+    s = current_span.get()
+    if s is not None:
+        for key in [k for k in headers if k.lower() == TRACEPARENT_HEADER]:
+            del headers[key]
+        headers[TRACEPARENT_HEADER] = s.traceparent()
+    return headers
@@ -0,0 +1,118 @@
+"""
+Benchmark concurrent throughput of /llm_invoke (non-stream) within one worker.
+
+The app runs in-process behind httpx.ASGITransport (one event loop = one uvicorn
+worker). Upstream LLM calls are served by a mock transport that sleeps for
+--latency-ms, so no provider or network is needed.
+
+Two modes are compared:
+- blocking: the endpoint awaits a wrapper around the sync
+  generate_with_specific_model (the old behaviour: the event loop is blocked for
+  every upstream round-trip).
+- async: the endpoint awaits async_generate_with_specific_model (AsyncOpenAI).
+
+Run from repository root:
+  python -m scripts.bench_llm_invoke --requests 200 --concurrency 50 --latency-ms 200
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+import api.main as api_main
+from adapters.llm_adapter import MultiLLM
+
+
+def _completion(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    return httpx.Response(200, json={
+        "id": "bench",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    })
+
+
+def build_manager(latency_s: float) -> MultiLLM:
+    def sync_handler(request):
+        time.sleep(latency_s)
+        return _completion(request)
+
+    async def async_handler(request):
+        await asyncio.sleep(latency_s)
+        return _completion(request)
+
+    manager = MultiLLM()
+    manager.response_cache = None
+    manager.single_flight = None
+    manager.admission = None  # 关闭准入控制，只测事件循环是否被阻塞
+    for m in manager.models:
+        m["qps"] = 0  # 关闭 QPS 限流，只测吞吐
+        m["sync_client"] = OpenAI(base_url="http://bench/v1", api_key="bench", max_retries=0,
+                                  http_client=httpx.Client(transport=httpx.MockTransport(sync_handler)))
+        m["async_client"] = AsyncOpenAI(base_url="http://bench/v1", api_key="bench", max_retries=0,
+                                        http_client=httpx.AsyncClient(transport=httpx.MockTransport(async_handler)))
+    return manager
+
+
+async def run_mode(mode: str, requests: int, concurrency: int, latency_s: float) -> dict:
+    manager = build_manager(latency_s)
+    if mode == "blocking":
+        async def blocking(*args, **kwargs):
+            return manager.generate_with_specific_model(*args, **kwargs)
+        manager.async_generate_with_specific_model = blocking
+    api_main.llm_manager = manager
+    model_name = manager.models[0]["name"]
+
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_main.app), base_url="http://bench") as client:
+        async def one(i):
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                resp = await client.post("/llm_invoke", json={"prompt": f"bench {i}", "model_name": model_name})
+                latencies.append(time.perf_counter() - t0)
+                if resp.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    args = parser.parse_args()
+    results = [
+        asyncio.run(run_mode(mode, args.requests, args.concurrency, args.latency_ms / 1000))
+        for mode in ("blocking", "async")
+    ]
+    print(json.dumps(results, indent=2))
+    print(f"Speedup (async / blocking RPS): {results[1]['rps'] / results[0]['rps']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Microbenchmark of QPSMonitor at a sustained 10k QPS.
+
+Before the timed section, each monitor is filled with one full window of traffic
+(qps * window timestamps). The benchmark then times record / get_qps /
+is_limited calls and compares:
+- legacy: the previous list-based implementation. It keeps every timestamp in
+  the window and rebuilds or rescans the list on each call.
+- current: core.health_checker.QPSMonitor. It uses a sliding-window counter and
+  token buckets, so each call is O(1).
+
+Run from repository root:
+  python -m scripts.bench_qps_monitor --qps 10000 --window 60 --ops 200
+"""
+from __future__ import annotations
+import argparse
+import json
+import threading
+import time
+
+from core.health_checker import QPSMonitor
+
+
+class LegacyQPSMonitor:
+    """改造前的实现，仅用于对比"""
+    def __init__(self, window_sec=60):
+        self.window_sec = window_sec
+        self.model_stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, model_name: str):
+        now = time.time()
+        with self.lock:
+            stats = self.model_stats.setdefault(model_name, [])
+            stats.append(now)
+            self.model_stats[model_name] = [t for t in stats if now - t < self.window_sec]
+
+    def get_qps(self, model_name: str) -> float:
+        now = time.time()
+        with self.lock:
+            stats = self.model_stats.get(model_name, [])
+            return len([t for t in stats if now - t < self.window_sec]) / self.window_sec
+
+    def is_limited(self, model_name: str, max_qps: float) -> bool:
+        return self.get_qps(model_name) > max_qps
+
+
+def _timeit(fn, ops: int) -> dict:
+    t0 = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    elapsed = time.perf_counter() - t0
+    return {"us_per_op": round(elapsed / ops * 1e6, 2), "ops_per_sec": round(ops / elapsed)}
+
+
+def run(qps: int, window: int, ops: int) -> list:
+    model = "bench-model"
+    now = time.time()
+    legacy = LegacyQPSMonitor(window)
+    # 预热：填满一个窗口的历史请求
+    legacy.model_stats[model] = [now - window + i / qps for i in range(qps * window)]
+    current = QPSMonitor(window)
+    for _ in range(qps):
+        current.record(model)
+
+    results = []
+    for name, monitor in (("legacy", legacy), ("current", current)):
+        results.append({
+            "impl": name,
+            "record": _timeit(lambda: monitor.record(model), ops),
+            "get_qps": _timeit(lambda: monitor.get_qps(model), ops),
+            "is_limited": _timeit(lambda: monitor.is_limited(model, qps), ops),
+        })
+    results.append({
+        "impl": "current",
+        "acquire(model+user+app)": _timeit(lambda: current.acquire(model, qps, user_id="u", app_id="a"), ops),
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qps", type=int, default=10000)
+    parser.add_argument("--window", type=int, default=60)
+    parser.add_argument("--ops", type=int, default=200)
+    args = parser.parse_args()
+    results = run(args.qps, args.window, args.ops)
+    print(json.dumps(results, indent=2))
+    legacy_us = results[0]["record"]["us_per_op"]
+    current_us = results[1]["record"]["us_per_op"]
+    budget_us = 1e6 / args.qps
+    print(f"record(): legacy {legacy_us}us vs current {current_us}us per call "
+          f"(budget at {args.qps} QPS: {budget_us:.0f}us per call)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Microbenchmark of candidate selection as the model pool grows.
+
+Each run uses a synthetic pool of N models with random tags, costs and live stats,
+then times one routing decision and compares:
+- legacy: the previous per-request filter + sort over the full model list. It
+  rebuilds set(tags) for every model and sorts by a Python score function.
+- engine: core.routing_engine.RoutingEngine. Candidate sets are precomputed per
+  (tags, biz_level), tags are stored as bitmasks, and scoring is vectorized with NumPy.
+
+Run from repository root:
+  python -m scripts.bench_routing --sizes 10 100 500 1000 --iterations 2000
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import time
+
+from core.model_registry import ModelRegistry
+from core.model_stats import ModelStats
+from core.routing_engine import RoutingEngine
+
+TAGS = ["llm", "zh", "en", "code", "vision", "long", "fast", "cheap", "reasoning", "batch"]
+
+
+def build_pool(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    models = []
+    stats = {}
+    for i in range(size):
+        name = f"model-{i}"
+        models.append({
+            "name": name,
+            "tags": rng.sample(TAGS, rng.randint(1, 4)),
+            "cost": rng.choice([0.0, 0.01, 0.02, 0.05, 0.1]),
+            "status": "可用",
+            "meta": {"vendor": f"vendor-{i % 7}"},
+        })
+        st = ModelStats(max_concurrency=rng.randint(1, 8), cost=models[-1]["cost"])
+        for _ in range(rng.randint(0, 20)):
+            if rng.random() < 0.1:
+                st.record_failure()
+            else:
+                st.record_success(rng.uniform(100, 3000))
+        stats[name] = st
+    return models, stats
+
+
+def legacy_select(models, stats, biz_level=None, prefer_cost=None, tags=None):
+    """改造前 _select_llm_candidates 的逻辑，仅用于对比"""
+    candidates = [m for m in models if stats[m['name']].healthy and stats[m['name']].current_concurrency < stats[m['name']].max_concurrency]
+    if not candidates:
+        candidates = [m for m in models if stats[m['name']].healthy]
+    if not candidates:
+        candidates = models
+    if biz_level == "premium":
+        candidates = [m for m in candidates if m.get("cost", 0) >= 0.05]
+    elif biz_level == "economy":
+        candidates = [m for m in candidates if m.get("cost", 0) <= 0.02]
+    if prefer_cost == "low" and candidates:
+        min_cost = min(m.get("cost", 0) for m in candidates)
+        candidates = [m for m in candidates if m.get("cost", 0) == min_cost]
+    elif prefer_cost == "high" and candidates:
+        max_cost = max(m.get("cost", 0) for m in candidates)
+        candidates = [m for m in candidates if m.get("cost", 0) == max_cost]
+    if tags:
+        candidates = [m for m in candidates if set(tags).issubset(set(m.get("tags", [])))]
+
+    def score(m):
+        s = stats[m['name']]
+        return s.error_rate * 1000 + s.latency * 0.1 + s.cost * 10 + s.current_concurrency * 5
+    return sorted(candidates, key=score)
+
+
+def _timeit(fn, iterations: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t0) / iterations * 1e6
+
+
+def run(size: int, iterations: int) -> dict:
+    models, stats = build_pool(size)
+    engine = RoutingEngine(ModelRegistry(models), stats.__getitem__)
+    engine.current_table()  # 编译路由表，不计入单次路由耗时
+    queries = [
+        {},
+        {"tags": ["zh"]},
+        {"tags": ["code", "fast"], "prefer_cost": "low"},
+        {"biz_level": "premium"},
+    ]
+    result = {"models": size}
+    for q in queries:
+        label = json.dumps(q, sort_keys=True)
+        result[label] = {
+            "legacy_us": round(_timeit(lambda: legacy_select(models, stats, **q), iterations), 1),
+            "engine_us": round(_timeit(lambda: engine.candidates(**q), iterations), 1),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500, 1000])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    print(json.dumps([run(size, args.iterations) for size in args.sizes], indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
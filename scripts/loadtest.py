@@ -0,0 +1,398 @@
+"""
+End-to-end load generator for /llm_invoke, /plugin/invoke and the dynamic proxy.
+
+Scenarios (--scenario, repeatable; run one after another):
+- invoke:        POST /llm_invoke (non-stream)
+- invoke_stream: POST /llm_invoke?stream=true; latency is time to the last byte,
+                 time to first byte is reported separately
+- plugin_batch:  POST /plugin/invoke with a batch_payload of --batch-size articles
+- session:       every virtual user sets a preferred model once via
+                 /set_preferred_model, then calls /llm_invoke without model_name
+- proxy:         registers a service pointing at a stub LLM server and POSTs
+                 chat completions through dynamic_router
+
+Load models:
+- closed: --concurrency virtual users, each sends its next request as soon as the
+          previous one finishes (throughput under a fixed number of clients)
+- open:   requests arrive at --rate per second (Poisson or uniform) whether or not
+          earlier ones have finished; latency is measured from the scheduled send
+          time, so server-side queueing is not hidden by a slow client
+
+Targets:
+- --base-url: a running server. Start it with LLM_STUB_ALL=1 (and run
+  scripts.stub_llm_server for the proxy scenario) to test without providers.
+- --in-process: the app runs behind httpx.ASGITransport with every model on the
+  in-process stub transport; the proxy scenario gets a stub server on a free port.
+  ASGITransport buffers response bodies, so streaming TTFB equals total latency here.
+
+Results are printed as JSON and optionally written to --report-json / --report-html.
+
+Run from repository root:
+  python -m scripts.loadtest --in-process --scenario invoke --scenario invoke_stream --mode closed --concurrency 32 --duration 20
+  python -m scripts.loadtest --base-url http://127.0.0.1:8000 --scenario proxy --mode open --rate 50 --duration 30 --stub-url http://127.0.0.1:8900
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import html
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+SCENARIOS = ("invoke", "invoke_stream", "plugin_batch", "session", "proxy")
+PROXY_SERVICE_NAME = "loadtest_stub"
+ARTICLE = "6月28日，国有企业A发布公告称，完成对B公司的重组，成为其控股股东。此次重组涉及资金10亿元。"
+
+
+def _percentile(values: list, q: float) -> float | None:
+    """values 已排序；最近秩法"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def _ms(value):
+    return None if value is None else round(value * 1000, 1)
+
+
+class Recorder:
+    def __init__(self, scenario: str, mode: str):
+        self.scenario = scenario
+        self.mode = mode
+        self.latencies = []
+        self.ttfb = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.started = None
+        self.finished = None
+
+    def record(self, latency: float, status, ttfb: float | None = None, error: str | None = None):
+        self.latencies.append(latency)
+        self.statuses[str(status)] += 1
+        if ttfb is not None:
+            self.ttfb.append(ttfb)
+        if error:
+            self.errors[error] += 1
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        latencies = sorted(self.latencies)
+        ttfb = sorted(self.ttfb)
+        ok = sum(n for status, n in self.statuses.items() if status.startswith("2"))
+        total = len(latencies)
+        result = {
+            "scenario": self.scenario,
+            "mode": self.mode,
+            "requests": total,
+            "ok": ok,
+            "error_rate": round(1 - ok / total, 4) if total else None,
+            "elapsed_s": round(elapsed, 3),
+            "rps": round(total / elapsed, 1) if elapsed > 0 else None,
+            "ok_rps": round(ok / elapsed, 1) if elapsed > 0 else None,
+            "latency_ms": {
+                "mean": _ms(sum(latencies) / total) if total else None,
+                "p50": _ms(_percentile(latencies, 50)),
+                "p95": _ms(_percentile(latencies, 95)),
+                "p99": _ms(_percentile(latencies, 99)),
+                "max": _ms(latencies[-1]) if latencies else None,
+            },
+            "status_codes": dict(sorted(self.statuses.items())),
+        }
+        if ttfb:
+            result["ttfb_ms"] = {"p50": _ms(_percentile(ttfb, 50)), "p95": _ms(_percentile(ttfb, 95)), "p99": _ms(_percentile(ttfb, 99))}
+        if self.errors:
+            result["errors"] = dict(self.errors.most_common(10))
+        return result
+
+
+class Scenario:
+    def __init__(self, name: str, client: httpx.AsyncClient, args, model_names: list):
+        """一个压测场景：setup 做一次性准备（会话、服务注册），request 发送一次请求并记录结果"""
+        self.name = name
+        self.client = client
+        self.args = args
+        self.model_names = model_names
+        self.sessions = []
+        self.counter = 0
+
+    async def setup(self, users: int):
+        if self.name == "session":
+            model_name = self.args.model or (self.model_names[0] if self.model_names else None)
+            for _ in range(max(1, users)):
+                session_id = str(uuid.uuid4())
+                resp = await self.client.post("/set_preferred_model", json={"model_name": model_name},
+                                              cookies={"session_id": session_id})
+                resp.raise_for_status()
+                self.sessions.append(session_id)
+        elif self.name == "proxy":
+            stub = httpx.URL(self.args.stub_url)
+            service = {
+                "service_name": PROXY_SERVICE_NAME,
+                "name": PROXY_SERVICE_NAME,
+                "target_ip": stub.host,
+                "target_port": str(stub.port or 80),
+                "target_route": "v1/chat/completions",
+                "desc": "scripts.loadtest stub upstream",
+            }
+            if self.args.in_process:
+                import api.main as api_main
+                api_main.service_registry[PROXY_SERVICE_NAME] = service  # 不落盘，避免改动 service_registry.json
+            else:
+                resp = await self.client.post("/service-registry/register", json=service)
+                resp.raise_for_status()
+
+    async def teardown(self):
+        if self.name != "proxy":
+            return
+        if self.args.in_process:
+            import api.main as api_main
+            api_main.service_registry.pop(PROXY_SERVICE_NAME, None)
+        else:
+            await self.client.post("/service-registry/unregister", json={"service_name": PROXY_SERVICE_NAME})
+
+    def _invoke_body(self, i: int) -> dict:
+        body = {"prompt": f"{self.args.prompt} #{i}", "max_tokens": self.args.max_tokens}
+        if self.args.model:
+            body["model_name"] = self.args.model
+        if self.args.tags:
+            body["tags"] = self.args.tags
+        if self.args.timeout_ms:
+            body["timeout_ms"] = self.args.timeout_ms
+        return body
+
+    async def request(self, recorder: Recorder, scheduled: float | None = None, user: int = 0):
+        self.counter += 1
+        i = self.counter
+        start = scheduled if scheduled is not None else time.perf_counter()
+        ttfb = None
+        try:
+            if self.name == "invoke_stream":
+                async with self.client.stream("POST", "/llm_invoke", params={"stream": "true"}, json=self._invoke_body(i)) as resp:
+                    async for _ in resp.aiter_bytes():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - start
+                status = resp.status_code
+            else:
+                if self.name == "invoke":
+                    resp = await self.client.post("/llm_invoke", json=self._invoke_body(i))
+                elif self.name == "session":
+                    body = self._invoke_body(i)
+                    body.pop("model_name", None)
+                    resp = await self.client.post("/llm_invoke", json=body,
+                                                  cookies={"session_id": self.sessions[user % len(self.sessions)]})
+                elif self.name == "plugin_batch":
+                    body = {"batch_payload": [{"article": f"{ARTICLE} #{i}-{j}"} for j in range(self.args.batch_size)]}
+                    if self.args.model:
+                        body["model_name"] = self.args.model
+                    resp = await self.client.post("/plugin/invoke", params={"plugin_name": self.args.plugin}, json=body)
+                else:
+                    resp = await self.client.post(f"/{PROXY_SERVICE_NAME}", json={
+                        "model": "stub", "max_tokens": self.args.max_tokens,
+                        "messages": [{"role": "user", "content": f"{self.args.prompt} #{i}"}],
+                    })
+                status = resp.status_code
+            error = None if 200 <= status < 300 else f"HTTP {status}"
+        except Exception as e:
+            status, error = "exception", type(e).__name__
+        recorder.record(time.perf_counter() - start, status, ttfb, error)
+
+
+async def run_closed(scenario: Scenario, args) -> dict:
+    recorder = Recorder(scenario.name, "closed")
+    await scenario.setup(args.concurrency)
+    sent = 0
+    recorder.started = time.perf_counter()
+    stop_at = recorder.started + args.duration
+
+    async def user(u):
+        nonlocal sent
+        while time.perf_counter() < stop_at and (not args.requests or sent < args.requests):
+            sent += 1
+            await scenario.request(recorder, user=u)
+
+    await asyncio.gather(*(user(u) for u in range(args.concurrency)))
+    recorder.finished = time.perf_counter()
+    await scenario.teardown()
+    return recorder.summary()
+
+
+async def run_open(scenario: Scenario, args) -> dict:
+    recorder = Recorder(scenario.name, "open")
+    await scenario.setup(args.concurrency)
+    rng = random.Random(args.seed)
+    tasks = set()
+    dropped = 0
+    recorder.started = time.perf_counter()
+    next_at = recorder.started
+    stop_at = recorder.started + args.duration
+    i = 0
+    while next_at < stop_at and (not args.requests or i < args.requests):
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= args.max_in_flight:
+            dropped += 1  # 客户端侧在途上限，记为丢弃，不计入延迟
+        else:
+            task = asyncio.create_task(scenario.request(recorder, scheduled=next_at, user=i))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        i += 1
+        next_at += rng.expovariate(args.rate) if args.arrival == "poisson" else 1 / args.rate
+    if tasks:
+        await asyncio.gather(*tasks)
+    recorder.finished = time.perf_counter()
+    await scenario.teardown()
+    result = recorder.summary()
+    result["offered_rps"] = args.rate
+    result["dropped"] = dropped
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(profile: dict) -> str:
+    """在后台线程启动独立桩服务（供 dynamic_router 代理），返回其地址"""
+    import uvicorn
+    from core.stub_llm import StubLLM
+    from scripts.stub_llm_server import create_app
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(StubLLM(profile)), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def build_in_process_app(args, profile: dict):
+    """所有模型走进程内桩，不启动健康检查等后台线程"""
+    os.environ["LLM_STUB_ALL"] = "1"
+    import api.main as api_main
+
+    api_main.scan_and_register_plugins()  # /plugin/invoke 只需要插件注册表
+    api_main.move_dynamic_router_to_end(api_main.app)
+    api_main.init_llm_manager()
+    manager = api_main.llm_manager
+    for stub in manager.stubs.values():
+        stub.configure({**stub.profile, **profile})
+    if args.no_limits:
+        manager.admission = None
+        for m in manager.models:
+            m["qps"] = 0  # 关闭 QPS 限流，只测网关自身
+    return api_main.app
+
+
+def render_html(report: dict) -> str:
+    rows = []
+    for r in report["results"]:
+        lat = r["latency_ms"]
+        ttfb = r.get("ttfb_ms", {})
+        rows.append("<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in (
+            r["scenario"], r["mode"], r["requests"], r["ok"], r["error_rate"], r["rps"], r["ok_rps"],
+            lat["p50"], lat["p95"], lat["p99"], lat["max"], ttfb.get("p50", ""), ttfb.get("p99", ""),
+            ", ".join(f"{k}: {v}" for k, v in r["status_codes"].items()),
+        )) + "</tr>")
+    headers = ("scenario", "mode", "requests", "ok", "error rate", "RPS", "ok RPS", "p50 ms", "p95 ms", "p99 ms",
+               "max ms", "TTFB p50", "TTFB p99", "status codes")
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Load test report</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse}}td,th{{border:1px solid #ccc;padding:4px 8px;text-align:right}}th{{background:#f3f3f3}}td:first-child{{text-align:left}}</style>
+</head><body>
+<h1>Load test report</h1>
+<p>{html.escape(report["target"])} &middot; {html.escape(report["time"])}</p>
+<table><tr>{"".join(f"<th>{h}</th>" for h in headers)}</tr>
+{"".join(rows)}
+</table>
+<h2>Parameters</h2>
+<pre>{html.escape(json.dumps(report["params"], indent=2, ensure_ascii=False))}</pre>
+</body></html>
+"""
+
+
+async def run(args) -> dict:
+    profile = {}
+    if args.stub_profile:
+        import yaml
+        with open(args.stub_profile, "r", encoding="utf-8") as f:
+            profile = yaml.safe_load(f) or {}
+    if args.in_process:
+        transport = httpx.ASGITransport(app=build_in_process_app(args, profile))
+        base_url = "http://loadtest"
+        if "proxy" in args.scenario and not args.stub_url:
+            args.stub_url = start_stub_server(profile)
+    else:
+        transport = None
+        base_url = args.base_url
+    if "proxy" in args.scenario and not args.stub_url:
+        raise SystemExit("--stub-url is required for the proxy scenario against --base-url")
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(args.client_timeout_sec)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=timeout) as client:
+        resp = await client.post("/list_LLM")
+        model_names = [m["name"] for m in resp.json().get("models", [])] if resp.status_code == 200 else []
+        for name in args.scenario:
+            scenario = Scenario(name, client, args, model_names)
+            runner = run_open if args.mode == "open" else run_closed
+            result = await runner(scenario, args)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+            results.append(result)
+    params = {k: v for k, v in vars(args).items() if k not in ("report_json", "report_html")}
+    return {"target": "in-process" if args.in_process else base_url, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "params": params, "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", default="http://127.0.0.1:8000")
+    target.add_argument("--in-process", action="store_true")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="repeatable; default: invoke")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--requests", type=int, default=0, help="stop a scenario after this many requests (0 = duration only)")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed loop: virtual users; session: number of sessions")
+    parser.add_argument("--rate", type=float, default=20, help="open loop: arrivals per second")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="open loop: client-side cap, arrivals beyond it are dropped")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--model", help="model_name for invoke/plugin_batch and the preferred model for session")
+    parser.add_argument("--tags", nargs="*")
+    parser.add_argument("--prompt", default="Summarise the load test request")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--timeout-ms", type=int, help="per-request deadline sent as timeout_ms")
+    parser.add_argument("--plugin", default="extract_")
+    parser.add_argument("--batch-size", type=int, default=3)
+    parser.add_argument("--stub-url", help="stub LLM server behind the proxy scenario")
+    parser.add_argument("--stub-profile", help="in-process: YAML stub profile applied to every model")
+    parser.add_argument("--no-limits", action="store_true", help="in-process: disable QPS limits and admission control")
+    parser.add_argument("--client-timeout-sec", type=float, default=60)
+    parser.add_argument("--report-json")
+    parser.add_argument("--report-html")
+    args = parser.parse_args()
+    args.scenario = args.scenario or ["invoke"]
+
+    report = asyncio.run(run(args))
+    if args.report_json:
+        with open(args.report_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.report_html:
+        with open(args.report_html, "w", encoding="utf-8") as f:
+            f.write(render_html(report))
+
+
+if __name__ == "__main__":
+    main()
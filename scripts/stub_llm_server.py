@@ -0,0 +1,104 @@
+"""
+Standalone OpenAI-compatible stub LLM server for offline benchmarking.
+
+Serves /v1/models and /v1/chat/completions (plain and SSE streaming) with the
+same behaviour model as the in-process stub transport (core.stub_llm.StubLLM):
+sampled first-token latency, a fixed token rate for streaming, injected 500/429
+responses, a concurrency limit that answers 429 when exceeded, and usage
+accounting. Point llm_models.yaml entries at it, e.g.
+
+  - name: stub-fast
+    url: http://127.0.0.1:8900/v1
+    key: stub
+
+GET /stub/stats returns the request counters and the active profile.
+
+Run from repository root:
+  python -m scripts.stub_llm_server --port 8900 --latency-ms 300 --tokens-per-sec 40 --rate-limit-rate 0.05
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+
+import uvicorn
+import yaml
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from core.stub_llm import DEFAULT_STUB_PROFILE, LATENCY_DISTRIBUTIONS, StubLLM
+
+
+def create_app(stub: StubLLM) -> FastAPI:
+    app = FastAPI(title="stub-llm")
+
+    @app.get("/v1/models")
+    async def models():
+        return stub.models()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = json.loads(await request.body() or b"{}")
+        rejected = stub.admit()
+        if rejected is not None:
+            status, headers, payload = rejected
+            return JSONResponse(payload, status_code=status, headers=headers)
+        n = stub.completion_tokens(body)
+        if body.get("stream"):
+            async def events():
+                try:
+                    await asyncio.sleep(stub.first_token_delay())
+                    interval = stub.token_interval()
+                    for event in stub.stream_events(body, n):
+                        yield event
+                        if interval:
+                            await asyncio.sleep(interval)
+                finally:
+                    stub.release()
+            return StreamingResponse(events(), media_type="text/event-stream")
+        try:
+            await asyncio.sleep(stub.response_delay(n))
+            return stub.completion(body, n)
+        finally:
+            stub.release()
+
+    @app.get("/stub/stats")
+    async def stats():
+        return stub.snapshot()
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--name", default="stub", help="model id reported by /v1/models")
+    parser.add_argument("--profile", help="YAML file with stub profile fields (see core.stub_llm.DEFAULT_STUB_PROFILE)")
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS)
+    parser.add_argument("--latency-spread", type=float)
+    parser.add_argument("--tokens-per-sec", type=float)
+    parser.add_argument("--completion-tokens", type=int)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--rate-limit-rate", type=float)
+    parser.add_argument("--retry-after-sec", type=float)
+    parser.add_argument("--max-concurrency", type=int)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    profile = {}
+    if args.profile:
+        with open(args.profile, "r", encoding="utf-8") as f:
+            profile.update(yaml.safe_load(f) or {})
+    for field in DEFAULT_STUB_PROFILE:
+        value = getattr(args, field, None)
+        if value is not None:
+            profile[field] = value
+    stub = StubLLM(profile, name=args.name)
+    print(json.dumps({"listen": f"http://{args.host}:{args.port}/v1", "profile": stub.profile}, ensure_ascii=False), flush=True)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+进程内热点路径的微基准（pytest-benchmark）。
+
+保存基线（换机器或有意改变性能后重新保存）：
+  python -m pytest tests/benchmarks --benchmark-only --benchmark-storage=tests/benchmarks/baselines --benchmark-save=baseline
+与基线比较，中位数变慢超过 25% 即失败（部署前执行）：
+  python -m pytest tests/benchmarks --benchmark-only --benchmark-storage=tests/benchmarks/baselines --benchmark-compare --benchmark-compare-fail=median:25%
+基线按机器（系统-解释器-位数）分目录保存，只与同类机器上的结果比较。
+"""
+import random
+from unittest import mock
+
+import pytest
+import yaml
+
+TAGS = ["llm", "zh", "en", "code", "vision", "long", "fast", "cheap", "reasoning", "batch"]
+POOL_SIZES = (10, 100, 1000)
+
+
+def make_models(size: int, seed: int = 0) -> list:
+    """合成的模型池配置（与 llm_models.yaml 条目同构），url 指向 stub:// 不会发起网络请求"""
+    rng = random.Random(seed)
+    return [{
+        "name": f"model-{i}",
+        "url": f"stub://model-{i}",
+        "key": "bench",
+        "meta": {
+            "tags": rng.sample(TAGS, rng.randint(1, 4)),
+            "cost": rng.choice([0.0, 0.01, 0.02, 0.05, 0.1]),
+            "qps": rng.randint(1, 8),
+            "max_input_length": rng.choice([0, 8000, 32000, 128000]),
+        },
+    } for i in range(size)]
+
+
+@pytest.fixture(scope="session")
+def llm_pool(tmp_path_factory):
+    """按池大小缓存的 MultiLLM（合成模型池，统计数据预先写入），同一会话内复用"""
+    from adapters.llm_adapter import MultiLLM
+
+    pools = {}
+    load_models = MultiLLM._load_models
+
+    def get(size: int):
+        if size not in pools:
+            path = tmp_path_factory.mktemp("pool") / "llm_models.yaml"
+            path.write_text(yaml.safe_dump({"models": make_models(size)}, allow_unicode=True), encoding="utf-8")
+            with mock.patch.object(MultiLLM, "_load_models", lambda self, _=None: load_models(self, str(path))):
+                llm = MultiLLM()
+            rng = random.Random(size)
+            for m in llm.models:
+                stats = llm._stats(m["name"])
+                for _ in range(rng.randint(0, 20)):
+                    if rng.random() < 0.1:
+                        stats.record_failure()
+                    else:
+                        stats.record_success(rng.uniform(100, 3000))
+            pools[size] = llm
+        return pools[size]
+
+    return get
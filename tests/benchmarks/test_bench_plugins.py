@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from business.doc_extractor import extract_json_text
+
+RESPONSE = "好的，以下是抽取结果：\n```json\n" + json.dumps({
+    "companies": [{"name": f"公司{i}", "role": "控股股东", "amount": "10亿元"} for i in range(20)],
+    "people": [{"name": f"专家{i}", "view": "有助于提升企业核心竞争力"} for i in range(20)],
+    "events": ["重组", "技术突破"],
+}, ensure_ascii=False, indent=2) + "\n```\n以上结果仅供参考。"
+
+
+@pytest.mark.benchmark(group="extraction")
+def test_extract_json_text(benchmark):
+    assert json.loads(benchmark(extract_json_text, RESPONSE))["events"] == ["重组", "技术突破"]
+
+
+@pytest.fixture(scope="module")
+def event_loop_runner():
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.mark.benchmark(group="batch_concurrent")
+@pytest.mark.parametrize("size", (10, 100))
+def test_batch_concurrent_overhead(benchmark, event_loop_runner, size):
+    # 处理函数本身不做任何事，测到的是分发、并发控制与上下文复制的开销
+    from api.main import batch_concurrent
+
+    async def handler(article, **params):
+        return {"result": article}
+
+    items = [{"article": f"资讯{i}", "model_name": "model-0", "temperature": 0.3} for i in range(size)]
+    results = benchmark(lambda: event_loop_runner(batch_concurrent(items, handler, max_concurrency=10)))
+    assert len(results) == size
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from core.model_router import ModelRouter
+from tests.benchmarks.conftest import POOL_SIZES
+
+PROMPT = "请从下面的资讯中抽取公司、人物与事件。" * 20
+
+
+@pytest.mark.benchmark(group="select_llm_candidates")
+@pytest.mark.parametrize("size", POOL_SIZES)
+def test_select_llm_candidates(benchmark, llm_pool, size):
+    llm = llm_pool(size)
+    candidates = benchmark(llm._select_llm_candidates, tags=["zh"], prompt=PROMPT)
+    assert all("zh" in m["tags"] for m in candidates)
+
+
+@pytest.mark.benchmark(group="select_llm_candidates")
+@pytest.mark.parametrize("size", POOL_SIZES)
+def test_select_llm_candidates_biz_level(benchmark, llm_pool, size):
+    llm = llm_pool(size)
+    candidates = benchmark(llm._select_llm_candidates, biz_level="economy", prefer_cost="low", tags=["llm", "fast"])
+    assert all(m["cost"] <= 0.02 for m in candidates)
+
+
+@pytest.mark.benchmark(group="model_router")
+@pytest.mark.parametrize("size", POOL_SIZES)
+def test_model_router_select_model(benchmark, llm_pool, size):
+    llm = llm_pool(size)
+    router = ModelRouter(lambda: llm.routing)
+    model = benchmark(router.select_model, tags=["llm"], prefer_cost="low")
+    assert "llm" in model["tags"]
@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import core.statistics as statistics
+from core.health_checker import QPSMonitor
+from core.logging_config import JsonFormatter
+
+
+@pytest.fixture
+def qps_monitor():
+    monitor = QPSMonitor()
+    for i in range(100):
+        monitor.record(f"model-{i}")
+    return monitor
+
+
+@pytest.mark.benchmark(group="qps_monitor")
+def test_qps_monitor_record(benchmark, qps_monitor):
+    benchmark(qps_monitor.record, "model-7")
+
+
+@pytest.mark.benchmark(group="qps_monitor")
+def test_qps_monitor_get_qps(benchmark, qps_monitor):
+    assert benchmark(qps_monitor.get_qps, "model-7") > 0
+
+
+@pytest.mark.benchmark(group="qps_monitor")
+def test_qps_monitor_acquire(benchmark, qps_monitor):
+    benchmark(qps_monitor.acquire, "model-7", 0, "user-1", "app-1")
+
+
+@pytest.fixture
+def clean_statistics():
+    hits = dict(statistics.model_hit_counter)
+    total = statistics.total_request_count
+    history = list(statistics.model_call_history)
+    yield
+    statistics.model_hit_counter.clear()
+    statistics.model_hit_counter.update(hits)
+    statistics.total_request_count = total
+    statistics.model_call_history[:] = history
+
+
+@pytest.mark.benchmark(group="statistics")
+def test_record_model_call(benchmark, clean_statistics):
+    # 预先填满调用历史，测到的是稳态（超过上限后每次都要淘汰最旧记录）的开销
+    statistics.model_call_history[:] = [{"model": "model-0", "time": "2025-01-01 00:00:00"}] * 10000
+    benchmark(statistics.record_model_call, "model-7")
+
+
+@pytest.mark.benchmark(group="logging")
+def test_json_formatter_format(benchmark):
+    formatter = JsonFormatter()
+    record = logging.LogRecord("llm_service", logging.INFO, __file__, 1, {
+        "event": "llm_generate",
+        "model": "GLM-4-Flash",
+        "request_id": "7aff20b5-9f8b-4d68-a98a-cc9a51e9c42e",
+        "success": True,
+        "duration_ms": 154,
+        "prompt_len": 2048,
+        "token_usage": 913,
+        "params": {"temperature": 0.7, "top_p": None, "max_tokens": 512, "stop": None},
+    }, None, None, func="_call_model_sync")
+    assert benchmark(formatter.format, record).startswith("{")
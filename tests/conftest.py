@@ -0,0 +1,26 @@
+from unittest import mock
+
+import pytest
+import yaml
+
+
+@pytest.fixture
+def make_llm(tmp_path):
+    """按给定的模型条目构造 MultiLLM（url 用 stub:// 时由进程内桩应答，不发网络请求）"""
+    from adapters.llm_adapter import MultiLLM
+
+    load_models = MultiLLM._load_models
+
+    def make(models):
+        path = tmp_path / "llm_models.yaml"
+        path.write_text(yaml.safe_dump({"models": models}, allow_unicode=True), encoding="utf-8")
+        with mock.patch.object(MultiLLM, "_load_models", lambda self, _=None: load_models(self, str(path))):
+            return MultiLLM()
+
+    return make
+
+
+def stub_model(name, stub=None, **meta):
+    """桩模型条目：meta.stub 为 StubLLM 配置，其余关键字写入 meta"""
+    return {"name": name, "url": f"stub://{name}", "key": "test",
+            "meta": {"qps": 1000, "max_concurrency": 8, **meta, "stub": stub or {}}}
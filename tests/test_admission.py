@@ -0,0 +1,163 @@
+"""core.admission：FIFO 名额移交、拒绝原因与取消时的名额归还"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.admission import AdmissionRejected, ModelAdmission
+
+
+async def _enqueue(gate, n, admitted):
+    """依次启动 n 个排队的协程，保证入队顺序与编号一致"""
+    async def waiter(i):
+        await gate.acquire_async()
+        admitted.append(i)
+    tasks = []
+    for i in range(n):
+        tasks.append(asyncio.create_task(waiter(i)))
+        await asyncio.sleep(0)
+    return tasks
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.001)
+
+
+def test_release_hands_slots_over_in_fifo_order():
+    async def scenario():
+        gate = ModelAdmission("m", max_concurrency=1)
+        await gate.acquire_async()
+        admitted = []
+        tasks = await _enqueue(gate, 3, admitted)
+        assert gate.snapshot()["queue_depth"] == 3
+        for expected in range(3):
+            gate.release()
+            await asyncio.sleep(0.01)
+            assert admitted == list(range(expected + 1))
+            # 名额直接移交给队首，active 保持为上限
+            assert gate.snapshot()["active"] == 1
+        gate.release()
+        await asyncio.gather(*tasks)
+        snapshot = gate.snapshot()
+        assert snapshot["active"] == 0
+        assert snapshot["queued"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_new_arrivals_do_not_jump_the_queue():
+    gate = ModelAdmission("m", max_concurrency=1)
+    gate.acquire()
+    order = []
+
+    def worker(name):
+        gate.acquire(timeout=2)
+        order.append(name)
+        gate.release()
+
+    first = threading.Thread(target=worker, args=("queued",))
+    first.start()
+    _wait_until(lambda: gate.snapshot()["queue_depth"] == 1)
+    second = threading.Thread(target=worker, args=("late",))
+    second.start()
+    _wait_until(lambda: gate.snapshot()["queue_depth"] == 2)
+    gate.release()
+    first.join()
+    second.join()
+    assert order == ["queued", "late"]
+    assert gate.snapshot()["active"] == 0
+
+
+def test_rejects_when_queue_is_full():
+    async def scenario():
+        gate = ModelAdmission("m", max_concurrency=1, max_queue=1)
+        await gate.acquire_async()
+        tasks = await _enqueue(gate, 1, [])
+        with pytest.raises(AdmissionRejected) as info:
+            await gate.acquire_async()
+        assert info.value.reason == "queue_full"
+        assert gate.snapshot()["rejected_queue_full"] == 1
+        gate.release()
+        await asyncio.gather(*tasks)
+        gate.release()
+
+    asyncio.run(scenario())
+
+
+def test_rejects_after_queue_timeout():
+    gate = ModelAdmission("m", max_concurrency=1, max_wait_sec=0.05)
+    gate.acquire()
+    with pytest.raises(AdmissionRejected) as info:
+        gate.acquire()
+    assert info.value.reason == "queue_timeout"
+
+    async def scenario():
+        with pytest.raises(AdmissionRejected) as info:
+            await gate.acquire_async(timeout=0.05)
+        assert info.value.reason == "queue_timeout"
+
+    asyncio.run(scenario())
+    snapshot = gate.snapshot()
+    assert snapshot["rejected_timeout"] == 2
+    # 超时的等待者已离开队列，之后的释放不会移交给它们
+    assert snapshot["queue_depth"] == 0
+    gate.release()
+    assert gate.snapshot()["active"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        gate = ModelAdmission("m", max_concurrency=1)
+        await gate.acquire_async()
+        task = asyncio.create_task(gate.acquire_async())
+        await asyncio.sleep(0)
+        assert gate.snapshot()["queue_depth"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert gate.snapshot()["queue_depth"] == 0
+        gate.release()
+        assert gate.snapshot()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiter_cancelled_after_grant_returns_the_slot():
+    async def scenario():
+        gate = ModelAdmission("m", max_concurrency=1)
+        await gate.acquire_async()
+        task = asyncio.create_task(gate.acquire_async())
+        await asyncio.sleep(0)
+        # 名额已移交，但等待者在被唤醒前取消：名额必须归还，不能泄漏
+        gate.release()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        snapshot = gate.snapshot()
+        assert snapshot["active"] == 0
+        assert snapshot["queue_depth"] == 0
+        assert await gate.acquire_async() == 0.0
+        gate.release()
+
+    asyncio.run(scenario())
+
+
+def test_raising_the_limit_wakes_waiters():
+    async def scenario():
+        gate = ModelAdmission("m", max_concurrency=1)
+        await gate.acquire_async()
+        admitted = []
+        tasks = await _enqueue(gate, 2, admitted)
+        gate.set_limit(3)
+        await asyncio.gather(*tasks)
+        assert admitted == [0, 1]
+        assert gate.snapshot()["active"] == 3
+        for _ in range(3):
+            gate.release()
+        assert gate.snapshot()["active"] == 0
+
+    asyncio.run(scenario())
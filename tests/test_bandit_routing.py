@@ -0,0 +1,92 @@
+"""老虎机路由的奖励回报：自动路由的调用按所在分桶计入，指定模型的调用不计入"""
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+import api.main as api_main
+from core.bandit_router import BanditRouter, bucket_key
+from tests.conftest import stub_model
+
+STUB_PROFILE = {"latency_ms": 1, "latency_distribution": "fixed", "tokens_per_sec": 0, "completion_tokens": 2}
+
+
+@pytest.fixture
+def llm(make_llm, monkeypatch):
+    """两个桩模型的 MultiLLM，挂上不落盘的老虎机，并替换为 api.main 使用的实例"""
+    llm = make_llm([stub_model(f"stub-{i}", STUB_PROFILE, tags=["zh"]) for i in range(2)])
+    llm.bandit = BanditRouter(state_path=None, seed=0)
+    llm.routing.bandit = llm.bandit
+    llm.routing.invalidate()
+    monkeypatch.setattr(api_main, "llm_manager", llm)
+    monkeypatch.setattr(api_main, "health_checker", None)
+    return llm
+
+
+async def _invoke(payloads):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_main.app), base_url="http://t") as client:
+        for payload in payloads:
+            response = await client.post("/llm_invoke", json=payload)
+            assert response.status_code == 200, response.text
+
+
+def _weight(llm, bucket):
+    return sum(arm["weight"] for arm in llm.bandit.snapshot()["buckets"].get(bucket, {}).values())
+
+
+def test_auto_routed_invoke_rewards_the_bucket(llm):
+    asyncio.run(_invoke([{"prompt": f"p{i}", "tags": ["zh"], "biz_level": "standard"} for i in range(20)]))
+    assert llm.bandit.snapshot()["updates"] == 20
+    assert _weight(llm, bucket_key(("zh",), "standard")) == pytest.approx(20, rel=0.1)
+
+
+def test_explicit_model_is_not_rewarded(llm):
+    asyncio.run(_invoke([{"prompt": f"p{i}", "model_name": "stub-1", "tags": ["zh"]} for i in range(5)]))
+    assert llm.bandit.snapshot()["updates"] == 0
+
+
+def test_explicit_model_after_auto_route_in_same_context(llm):
+    async def scenario():
+        await llm.async_generate_with_specific_model("auto", tags=["zh"])
+        # 同一上下文中随后指定模型的调用不能沿用上一次路由的分桶
+        await llm.async_generate_with_specific_model("explicit", model_name="stub-0")
+
+    asyncio.run(scenario())
+    assert llm.bandit.snapshot()["updates"] == 1
+
+
+def test_generate_many_rewards_the_bucket(llm):
+    async def scenario():
+        return [r async for r in llm.async_generate_many([f"p{i}" for i in range(6)], tags=["zh"])]
+
+    results = asyncio.run(scenario())
+    assert all("error" not in r for r in results)
+    assert llm.bandit.snapshot()["updates"] == 6
+    assert list(llm.bandit.snapshot()["buckets"]) == [bucket_key(("zh",), None)]
+
+
+def test_state_is_written_by_the_saver_thread(tmp_path):
+    path = tmp_path / "bandit_state.json"
+    bandit = BanditRouter(state_path=str(path), save_interval_sec=60, save_every=5, seed=0)
+    save = bandit.save
+    writers = []
+
+    def tracked_save():
+        writers.append(threading.current_thread().name)
+        save()
+
+    bandit.save = tracked_save
+    for _ in range(4):
+        bandit.record("b", "m", 1.0)
+    assert not path.exists()
+    # 达到 save_every 后由后台线程写盘，record 本身不做文件 I/O
+    bandit.record("b", "m", 1.0)
+    deadline = time.monotonic() + 2
+    while not path.exists():
+        assert time.monotonic() < deadline, "state was not saved"
+        time.sleep(0.01)
+    assert writers == ["bandit-saver"]
+    restored = BanditRouter(state_path=str(path)).snapshot()
+    assert restored["buckets"]["b"]["m"]["weight"] == pytest.approx(5, rel=0.1)
@@ -0,0 +1,113 @@
+"""core.circuit_breaker：熔断、半开单探测与探测结果决定恢复或重新熔断"""
+import time
+
+import pytest
+
+from core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+def _breaker(**settings):
+    settings.setdefault("failure_threshold", 3)
+    settings.setdefault("cooldown_sec", 0.05)
+    return CircuitBreaker("m", **settings)
+
+
+def _trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.acquire()
+        breaker.record(False)
+    assert breaker.state == OPEN
+
+
+def _half_open(breaker):
+    """熔断后等待冷却结束，返回占用探测名额后的 probe 标记"""
+    _trip(breaker)
+    time.sleep(breaker.cooldown_sec + 0.01)
+    probe = breaker.acquire()
+    assert probe is True
+    assert breaker.state == HALF_OPEN
+    return probe
+
+
+def test_opens_after_consecutive_failures():
+    breaker = _breaker()
+    for _ in range(breaker.failure_threshold - 1):
+        assert breaker.acquire() is False
+        breaker.record(False)
+    assert breaker.state == CLOSED
+    # 中间一次成功会清零连续失败计数
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as info:
+        breaker.acquire()
+    assert 0 < info.value.retry_after <= breaker.cooldown_sec
+    snapshot = breaker.snapshot()
+    assert snapshot["open_count"] == 1
+    assert snapshot["rejected"] == 1
+
+
+def test_opens_on_failure_rate_within_window():
+    breaker = _breaker(failure_threshold=100, failure_rate_threshold=0.5, window=4, min_calls=4)
+    for success in (True, False, True):
+        breaker.record(success)
+    assert breaker.state == CLOSED  # 未达到 min_calls
+    breaker.record(False)
+    assert breaker.state == OPEN  # 2/4 失败率达到阈值
+
+
+def test_unknown_outcome_is_ignored():
+    breaker = _breaker()
+    for _ in range(breaker.failure_threshold * 2):
+        breaker.record(None)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["recent_failure_rate"] == 0.0
+
+
+def test_half_open_admits_a_single_probe():
+    breaker = _breaker()
+    _trip(breaker)
+    assert not breaker.is_available()
+    time.sleep(breaker.cooldown_sec + 0.01)
+    assert breaker.is_available()
+    assert breaker.acquire() is True
+    assert not breaker.is_available()
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+    # 熔断前发出的旧请求返回，不影响探测
+    breaker.record(True)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+def test_successful_probe_closes_the_circuit():
+    breaker = _breaker()
+    probe = _half_open(breaker)
+    breaker.record(True, probe=probe)
+    assert breaker.state == CLOSED
+    assert breaker.acquire() is False
+    snapshot = breaker.snapshot()
+    assert snapshot["consecutive_failures"] == 0
+    assert snapshot["recent_failure_rate"] == 0.0
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = _breaker()
+    probe = _half_open(breaker)
+    breaker.record(False, probe=probe)
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["open_count"] == 2
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+def test_cancelled_probe_releases_the_slot():
+    breaker = _breaker()
+    probe = _half_open(breaker)
+    breaker.record(None, probe=probe)
+    assert breaker.state == HALF_OPEN
+    assert breaker.acquire() is True
@@ -0,0 +1,48 @@
+"""/llm_invoke?stream=true：首个片段之前的错误映射为状态码，之后的错误以错误尾标结束响应体"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import api.main as api_main
+from tests.conftest import stub_model
+
+
+@pytest.fixture
+def llm(make_llm, monkeypatch):
+    """单个桩模型：首 token 20ms，之后每 100ms 一个 token"""
+    llm = make_llm([stub_model("stub-slow", {
+        "latency_ms": 20, "latency_distribution": "fixed", "tokens_per_sec": 10, "completion_tokens": 20})])
+    monkeypatch.setattr(api_main, "llm_manager", llm)
+    monkeypatch.setattr(api_main, "health_checker", None)
+    return llm
+
+
+async def _stream(payload):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_main.app), base_url="http://t") as client:
+        async with client.stream("POST", "/llm_invoke?stream=true", json=payload) as response:
+            return response.status_code, "".join([chunk async for chunk in response.aiter_text()])
+
+
+def test_deadline_after_first_chunk_ends_with_trailer(llm):
+    status, body = asyncio.run(_stream({"prompt": "p", "model_name": "stub-slow", "timeout_ms": 350, "use_cache": False}))
+    assert status == 200
+    text, _, trailer = body.rpartition("\n" + api_main.STREAM_ERROR_PREFIX)
+    assert text.startswith("tok")
+    error = json.loads(trailer)
+    assert error["error"] == "Deadline exceeded"
+    assert error["stage"] in ("stream", "upstream")
+
+
+def test_deadline_before_first_chunk_returns_504(llm):
+    status, body = asyncio.run(_stream({"prompt": "p", "model_name": "stub-slow", "timeout_ms": 10, "use_cache": False}))
+    assert status == 504
+    assert json.loads(body)["error"] == "Deadline exceeded"
+
+
+def test_complete_stream_has_no_trailer(llm):
+    llm.stubs["stub-slow"].configure({**llm.stubs["stub-slow"].profile, "tokens_per_sec": 0, "completion_tokens": 3})
+    status, body = asyncio.run(_stream({"prompt": "p", "model_name": "stub-slow", "use_cache": False}))
+    assert status == 200
+    assert body == "tok tok tok"
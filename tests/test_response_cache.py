@@ -0,0 +1,115 @@
+"""core.response_cache：LRU / TTL 淘汰、键的规范化，以及 MultiLLM 对采样请求跳过缓存"""
+import asyncio
+import json
+
+import pytest
+
+import core.response_cache as response_cache
+from core.response_cache import ResponseCache, make_request_key
+from tests.conftest import stub_model
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = ResponseCache(max_entries=2, ttl_sec=0)
+    cache.put("a", {"result": "A"})
+    cache.put("b", {"result": "B"})
+    assert cache.get("a") == {"result": "A"}  # a 变为最近使用
+    cache.put("c", {"result": "C"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"result": "A"}
+    assert cache.get("c") == {"result": "C"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_limit_evicts_and_rejects_oversized_entries():
+    value = {"result": "x" * 100}
+    size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    cache = ResponseCache(max_bytes=size * 2, max_entries=100, ttl_sec=0)
+    for key in "abc":
+        assert cache.put(key, value)
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == size * 2
+    assert cache.get("a") is None
+    # 单条超过总上限时不缓存，也不挤掉已有条目
+    assert not cache.put("huge", {"result": "x" * size * 3})
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl_sec=10)
+    cache.put("k", {"result": "v"})
+    now[0] += 9.9
+    assert cache.get("k") == {"result": "v"}
+    now[0] += 0.2
+    assert cache.get("k") is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 0
+    assert stats["bytes"] == 0
+
+
+def test_request_key_normalizes_params():
+    key = make_request_key("m", MESSAGES, {"temperature": 0, "stop": "x", "top_p": None})
+    assert key == make_request_key("m", MESSAGES, {"stop": ["x"], "temperature": 0})
+    assert key != make_request_key("m", MESSAGES, {"stop": ["x"], "temperature": 0, "max_tokens": 5})
+    assert key != make_request_key("other", MESSAGES, {"stop": ["x"], "temperature": 0})
+
+
+@pytest.fixture
+def llm(make_llm):
+    return make_llm([stub_model("stub-0", {"latency_ms": 1, "latency_distribution": "fixed",
+                                           "tokens_per_sec": 0, "completion_tokens": 3})])
+
+
+def _upstream_calls(llm):
+    return llm.stubs["stub-0"].snapshot()["requests"]
+
+
+def test_deterministic_requests_are_served_from_cache(llm):
+    first = llm.generate_with_specific_model("p", model_name="stub-0", temperature=0)
+    second = llm.generate_with_specific_model("p", model_name="stub-0", temperature=0)
+    assert _upstream_calls(llm) == 1
+    assert second["cached"] is True
+    assert second["result"] == first["result"]
+    assert second["cost"] == 0.0
+    # 缓存的非流式结果可以流式回放
+    assert "".join(llm.generate_stream_with_specific_model("p", model_name="stub-0", temperature=0)) == first["result"]
+    assert _upstream_calls(llm) == 1
+    assert llm.generate_with_specific_model("p", model_name="stub-0", temperature=0, use_cache=False).get("cached") is None
+    assert _upstream_calls(llm) == 2
+
+
+def test_sampled_requests_skip_the_cache(llm):
+    async def scenario():
+        for _ in range(2):
+            result = await llm.async_generate_with_specific_model("p", model_name="stub-0", temperature=0.7)
+            assert "cached" not in result
+
+    asyncio.run(scenario())
+    for _ in range(2):
+        assert list(llm.generate_stream_with_specific_model("p", model_name="stub-0", temperature=0.7))
+    assert _upstream_calls(llm) == 4
+    assert llm.response_cache.stats()["entries"] == 0
+    # 显式 use_cache=True 时采样请求也走缓存
+    llm.generate_with_specific_model("p", model_name="stub-0", temperature=0.7, use_cache=True)
+    assert llm.generate_with_specific_model("p", model_name="stub-0", temperature=0.7, use_cache=True)["cached"] is True
+    assert _upstream_calls(llm) == 5
+
+
+def test_complete_streams_are_cached_for_replay(llm):
+    streamed = "".join(llm.generate_stream_with_specific_model("s", model_name="stub-0", temperature=0))
+    assert "".join(llm.generate_stream_with_specific_model("s", model_name="stub-0", temperature=0)) == streamed
+    assert llm.generate_with_specific_model("s", model_name="stub-0", temperature=0)["cached"] is True
+    assert _upstream_calls(llm) == 1
+
+    # 客户端中途断开的流不写入缓存
+    stream = llm.generate_stream_with_specific_model("t", model_name="stub-0", temperature=0)
+    next(stream)
+    stream.close()
+    list(llm.generate_stream_with_specific_model("t", model_name="stub-0", temperature=0))
+    assert _upstream_calls(llm) == 3
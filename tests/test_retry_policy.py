@@ -0,0 +1,116 @@
+"""core.retry_policy：错误分类、重试预算耗尽与 Retry-After（上游错误由 core.stub_llm 注入）"""
+import httpx
+import openai
+import pytest
+from openai import OpenAI
+
+from core.admission import AdmissionRejected
+from core.circuit_breaker import CircuitOpen
+from core.deadline import DeadlineExceeded
+from core.retry_policy import (
+    ABORT, CLIENT_ERROR, CONFIG_ERROR, CONNECTION, CONTENT_FILTER, DEADLINE, FAILOVER, RATE_LIMIT, RETRY,
+    SERVER_ERROR, TIMEOUT, UNAVAILABLE, UNKNOWN, RetryBudget, RetryPolicy, classify_error, retry_after_sec,
+)
+from core.stub_llm import STUB_BASE_URL, StubLLM, StubTransport
+from core.token_estimator import PromptTooLong
+
+REQUEST = httpx.Request("POST", f"{STUB_BASE_URL}/chat/completions")
+
+
+def _status_error(cls, status, message="error", body=None, headers=None):
+    response = httpx.Response(status, request=REQUEST, headers=headers)
+    return cls(message, response=response, body=body)
+
+
+def _stub_error(**profile):
+    """通过桩 transport 发一次请求，返回 openai SDK 抛出的异常"""
+    stub = StubLLM({"latency_ms": 0, "latency_distribution": "fixed", "seed": 1, **profile})
+    client = OpenAI(base_url=STUB_BASE_URL, api_key="stub", max_retries=0,
+                    http_client=httpx.Client(transport=StubTransport(stub)))
+    with pytest.raises(openai.APIStatusError) as info:
+        client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+    return info.value
+
+
+@pytest.mark.parametrize("error, expected", [
+    (_status_error(openai.RateLimitError, 429), RATE_LIMIT),
+    (_status_error(openai.RateLimitError, 429, body={"code": "insufficient_quota"}), CONFIG_ERROR),
+    (_status_error(openai.InternalServerError, 500), SERVER_ERROR),
+    (_status_error(openai.InternalServerError, 503), SERVER_ERROR),
+    (_status_error(openai.APIStatusError, 408), TIMEOUT),
+    (openai.APITimeoutError(request=REQUEST), TIMEOUT),
+    (TimeoutError(), TIMEOUT),
+    (openai.APIConnectionError(request=REQUEST), CONNECTION),
+    (_status_error(openai.AuthenticationError, 401), CONFIG_ERROR),
+    (_status_error(openai.PermissionDeniedError, 403), CONFIG_ERROR),
+    (_status_error(openai.NotFoundError, 404), CONFIG_ERROR),
+    (_status_error(openai.BadRequestError, 400), CLIENT_ERROR),
+    (_status_error(openai.BadRequestError, 400, body={"code": "content_filter"}), CONTENT_FILTER),
+    (DeadlineExceeded("llm_invoke"), DEADLINE),
+    (CircuitOpen("m"), UNAVAILABLE),
+    (AdmissionRejected("m", "queue_full"), UNAVAILABLE),
+    (PromptTooLong("m", 10, 5), UNAVAILABLE),
+    (ValueError("boom"), UNKNOWN),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_stub_server_error_is_retried_then_fails_over():
+    error = _stub_error(error_rate=1.0)
+    assert isinstance(error, openai.InternalServerError)
+    assert classify_error(error) == SERVER_ERROR
+    policy = RetryPolicy(base_delay_ms=10, max_delay_ms=10)
+    action, delay, error_class = policy.decide(error, attempt=0)
+    assert (action, error_class) == (RETRY, SERVER_ERROR)
+    assert 0 <= delay <= 0.01
+    assert policy.decide(error, attempt=1)[0] == FAILOVER
+
+
+def test_client_error_aborts_without_retry():
+    policy = RetryPolicy()
+    action, delay, error_class = policy.decide(_status_error(openai.BadRequestError, 400), attempt=0)
+    assert (action, delay, error_class) == (ABORT, 0.0, CLIENT_ERROR)
+    assert policy.budget.snapshot()["retries"] == 0
+
+
+def test_stub_rate_limit_honours_retry_after():
+    error = _stub_error(rate_limit_rate=1.0, retry_after_sec=2)
+    assert isinstance(error, openai.RateLimitError)
+    assert classify_error(error) == RATE_LIMIT
+    assert retry_after_sec(error) == 2
+    policy = RetryPolicy(base_delay_ms=10, max_delay_ms=10)
+    action, delay, _ = policy.decide(error, attempt=0)
+    assert action == RETRY
+    assert delay >= 2
+    # 剩余时间不够等 Retry-After 时不重试
+    assert RetryPolicy().decide(error, attempt=0, time_left=1.0)[0] == FAILOVER
+    # 建议等待超过 max_retry_after_ms 时直接换模型
+    assert RetryPolicy(max_retry_after_ms=1000).decide(error, attempt=0)[0] == FAILOVER
+
+
+def test_retry_after_ms_header_takes_precedence():
+    error = _status_error(openai.RateLimitError, 429, headers={"retry-after-ms": "1500", "retry-after": "9"})
+    assert retry_after_sec(error) == 1.5
+    assert retry_after_sec(_status_error(openai.RateLimitError, 429)) is None
+
+
+def test_retry_budget_exhaustion_fails_over():
+    budget = RetryBudget(ratio=0.0, min_per_sec=0.1, window_sec=10)  # 窗口内只允许 1 次重试
+    policy = RetryPolicy(base_delay_ms=1, max_delay_ms=1, budget=budget)
+    error = _status_error(openai.InternalServerError, 500)
+    assert policy.decide(error, attempt=0)[0] == RETRY
+    assert policy.decide(error, attempt=0)[0] == FAILOVER
+    assert budget.snapshot()["exhausted"] == 1
+    assert policy.snapshot()["decisions"] == {f"{SERVER_ERROR}:{FAILOVER}": 1, f"{SERVER_ERROR}:{RETRY}": 1}
+
+
+def test_retry_budget_grows_with_calls():
+    budget = RetryBudget(ratio=0.5, min_per_sec=0.0, window_sec=10)
+    assert not budget.try_spend()
+    for _ in range(4):
+        budget.record_call()
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.snapshot()["retries"] == 2
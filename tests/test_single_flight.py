@@ -0,0 +1,189 @@
+"""core.single_flight：相同请求只发起一次上游调用，错误传给所有跟随者，leader 取消不影响跟随者"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.single_flight import SingleFlight
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.001)
+
+
+def test_concurrent_sync_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+    results = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(2)
+        return {"result": "ok"}
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", upstream))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: flight.stats()["shared"] == 7)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"result": "ok"}] * 8
+    # 每个调用方拿到独立的副本
+    assert len({id(r) for r in results}) == 8
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "shared": 7}
+
+
+def test_concurrent_async_calls_share_one_upstream_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"result": "ok"}
+
+        results = await asyncio.gather(*[flight.async_do("k", upstream) for _ in range(8)])
+        assert len(calls) == 1
+        assert results == [{"result": "ok"}] * 8
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_error_reaches_all_followers_and_clears_the_key():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*[flight.async_do("k", failing) for _ in range(4)], return_exceptions=True)
+        assert len(calls) == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight.stats()["in_flight"] == 0
+
+        # key 已清除，下一次调用重新发起上游请求
+        async def ok():
+            calls.append(1)
+            return "ok"
+
+        assert await flight.async_do("k", ok) == "ok"
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_sync_error_reaches_all_followers_and_clears_the_key():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(2)
+        raise RuntimeError("upstream down")
+
+    def call():
+        try:
+            flight.do("k", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: flight.stats()["shared"] == 3)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 4
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_leader_cancellation_does_not_hang_followers():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        leader = asyncio.create_task(flight.async_do("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.async_do("k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await asyncio.wait_for(follower, 1) == "ok"
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+
+def test_upstream_is_cancelled_when_every_caller_leaves():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        tasks = [asyncio.create_task(flight.async_do("k", upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_async_stream_is_shared_and_survives_the_first_consumer_leaving():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            for i in range(5):
+                await asyncio.sleep(0.005)
+                yield f"c{i}"
+
+        async def consume(limit=None):
+            chunks = []
+            stream = flight.async_stream("k", upstream)
+            async for chunk in stream:
+                chunks.append(chunk)
+                if limit is not None and len(chunks) == limit:
+                    await stream.aclose()
+                    break
+            return chunks
+
+        first = asyncio.create_task(consume(limit=2))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(consume())
+        assert await first == ["c0", "c1"]
+        assert await asyncio.wait_for(second, 1) == [f"c{i}" for i in range(5)]
+        assert len(calls) == 1
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())